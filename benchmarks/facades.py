@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Measures the overhead of the facades and their hot paths, offline.
+
+API calls are answered by botocore Stubbers, so no AWS account or network
+access is needed. Produces one JSON object per benchmark with the median
+time of a run in milliseconds and, where it applies, the number of items
+processed per second:
+
+    python benchmarks/facades.py [--repeat N] [--sizes N ...] [name ...]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from botocore.stub import Stubber
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import boto3facade  # noqa: E402
+from boto3facade import utils  # noqa: E402
+from boto3facade.cloudformation import Cloudformation  # noqa: E402
+from boto3facade.config import Config  # noqa: E402
+from boto3facade.kinesis import Kinesis  # noqa: E402
+from boto3facade.s3 import S3  # noqa: E402
+
+
+DEFAULT_SIZES = [10000, 100000]
+NB_STACKS = 5000
+STACKS_PER_PAGE = 100
+NB_OBJECTS = 100000
+OBJECTS_PER_PAGE = 1000
+
+
+class Resource(object):
+    """A synthetic boto3 resource, with attributes instead of keys"""
+    def __init__(self, resource_id, state, tags):
+        self.resource_id = resource_id
+        self.state = state
+        self.tags = tags
+
+
+def measure(func, repeat):
+    """Runs func repeat times and produces the median time in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def result(name, seconds, items=None, **params):
+    """Formats the result of a benchmark"""
+    res = {'benchmark': name, 'version': boto3facade.__version__,
+           'median_ms': round(1000 * seconds, 3)}
+    if items is not None:
+        res['items'] = items
+        res['items_per_sec'] = round(items / seconds) if seconds else None
+    res.update(params)
+    return res
+
+
+def bench_facade_construction(config_file, repeat, **kwargs):
+    yield result('facade_construction', measure(
+        lambda: Kinesis(config_file=config_file), repeat))
+    yield result('facade_client', measure(
+        lambda: Kinesis(config_file=config_file).client, repeat))
+
+
+def bench_config(config_file, repeat, **kwargs):
+    config = Config(config_file=config_file)
+    yield result('config_load', measure(config.load, repeat))
+    yield result('config_save', measure(config.save, repeat))
+    yield result('config_set_batch', measure(lambda: set_options(config),
+                                             repeat), items=100)
+
+
+def set_options(config):
+    with config.batch():
+        for i in range(100):
+            config.set_profile_option('default', 'option{}'.format(i), 'x')
+
+
+def bench_retried_proxy(config_file, repeat, **kwargs):
+    facade = Kinesis(config_file=config_file)
+    proxied = facade.client
+    raw = proxied.__wrapped__
+    nb = 100000
+    for name, client in (('retried_attribute', proxied),
+                         ('raw_attribute', raw)):
+        def lookup():
+            for _ in range(nb):
+                client.meta
+        yield result(name, measure(lookup, repeat), items=nb)
+
+
+def bench_filters(repeat, sizes, **kwargs):
+    for size in sizes:
+        # A third of the resources are in prod, half of them are running
+        dicts = [{'InstanceId': 'i-{}'.format(i),
+                  'State': ('running', 'stopped')[i % 2],
+                  'Tags': [{'Key': 'Name', 'Value': 'name-{}'.format(i)},
+                           {'Key': 'Env',
+                            'Value': ('prod', 'dev', 'dev')[i % 3]}]}
+                 for i in range(size)]
+        objects = [Resource(d['InstanceId'], d['State'], d['Tags'])
+                   for d in dicts]
+        tag_filter = utils.tag_filter('Env', 'prod')
+        prop_filter = utils.property_filter('state', 'running')
+        for name, filtfunc, resources in (
+                ('tag_filter_dicts', tag_filter, dicts),
+                ('tag_filter_objects', tag_filter, objects),
+                ('property_filter_dicts', prop_filter, dicts),
+                ('property_filter_objects', prop_filter, objects)):
+            yield result(name, measure(
+                lambda: sum(1 for _ in filter(filtfunc, resources)), repeat),
+                items=size)
+
+
+def bench_cloudformation_stacks(config_file, repeat, **kwargs):
+    cf = Cloudformation(config_file=config_file)
+    created = datetime.datetime(2020, 1, 1)
+    stacks = [{'StackName': 'stack-{}'.format(i),
+               'CreationTime': created,
+               'StackStatus': 'CREATE_COMPLETE'} for i in range(NB_STACKS)]
+    pages = list(utils.chunked(stacks, STACKS_PER_PAGE))
+
+    def describe():
+        cf.flush_cache()
+        with Stubber(cf.client) as stubber:
+            for i, page in enumerate(pages):
+                resp = {'Stacks': page}
+                if i < len(pages) - 1:
+                    resp['NextToken'] = str(i + 1)
+                stubber.add_response('describe_stacks', resp)
+            return cf.stacks
+
+    yield result('cloudformation_stacks', measure(describe, repeat),
+                 items=NB_STACKS)
+    yield result('cloudformation_stack_statuses', measure(
+        lambda: cf.stack_statuses, repeat), items=NB_STACKS)
+
+
+def bench_pagination(config_file, repeat, **kwargs):
+    s3 = S3(config_file=config_file)
+    modified = datetime.datetime(2020, 1, 1)
+    pages = [[{'Key': 'key-{:08d}'.format(i), 'Size': i,
+               'LastModified': modified}
+              for i in range(start, start + OBJECTS_PER_PAGE)]
+             for start in range(0, NB_OBJECTS, OBJECTS_PER_PAGE)]
+
+    def paginate():
+        with Stubber(s3.client) as stubber:
+            for i, page in enumerate(pages):
+                resp = {'Contents': page, 'KeyCount': len(page)}
+                if i < len(pages) - 1:
+                    resp.update(IsTruncated=True,
+                                NextContinuationToken=str(i + 1))
+                stubber.add_response('list_objects_v2', resp)
+            paginator = s3.client.get_paginator('list_objects_v2')
+            return sum(len(p['Contents'])
+                       for p in paginator.paginate(Bucket='bucket'))
+
+    yield result('pagination', measure(paginate, repeat), items=NB_OBJECTS)
+
+
+BENCHMARKS = {
+    'facade_construction': bench_facade_construction,
+    'config': bench_config,
+    'retried_proxy': bench_retried_proxy,
+    'filters': bench_filters,
+    'cloudformation_stacks': bench_cloudformation_stacks,
+    'pagination': bench_pagination}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='name',
+                        help='One of {}'.format(', '.join(sorted(BENCHMARKS))))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Numbers of resources filtered')
+    args = parser.parse_args()
+    unknown = set(args.benchmarks).difference(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: {}'.format(', '.join(unknown)))
+    # Stubbed calls are never signed, but clients need a region
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+    workdir = tempfile.mkdtemp()
+    try:
+        config_file = os.path.join(workdir, 'boto3facade.ini')
+        for name in args.benchmarks or sorted(BENCHMARKS):
+            for res in BENCHMARKS[name](config_file=config_file,
+                                        repeat=args.repeat, sizes=args.sizes):
+                print(json.dumps(res))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Measures the time it takes to import the boto3facade modules.
+
+Every import is timed in a fresh interpreter, so that nothing is cached by
+a previous import. Produces one JSON object per module with the median
+import time in milliseconds and the heavy dependencies that got imported:
+
+    python benchmarks/import_time.py [--repeat N] [module ...]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+DEFAULT_MODULES = ['boto3facade', 'boto3facade.s3', 'boto3facade.dynamodb',
+                   'boto3facade.kinesis', 'boto3facade.kms',
+                   'boto3facade.cloudformation', 'boto3facade.redshift',
+                   'boto3facade.ec2']
+HEAVY_MODULES = ['boto3', 'botocore.session', 'botocore.config', 'requests',
+                 'wrapt', 'retrying', 'boto3facade.ec2', 'boto3facade.iam']
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed,
+                   'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module, repeat):
+    """Imports a module in repeat fresh interpreters"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    script = SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    runs = [json.loads(subprocess.check_output(
+        [sys.executable, '-c', script], env=env).decode())
+        for _ in range(repeat)]
+    return {'benchmark': 'import_time',
+            'module': module,
+            'median_ms': round(
+                1000 * statistics.median(r['seconds'] for r in runs), 3),
+            'loaded': runs[-1]['loaded']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for module in args.modules:
+        print(json.dumps(time_import(module, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
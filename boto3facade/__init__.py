@@ -1,8 +1,24 @@
 """A simple facade for boto3."""
 
+import importlib
 import os
-import inspect
 
 
 __version__ = "0.5.9"
-__dir__ = os.path.dirname(inspect.getfile(inspect.currentframe()))
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+
+# Facade modules are only imported when they are first accessed as
+# attributes of the package (e.g. boto3facade.s3), so that importing the
+# package does not import boto3 and the rest of the facades.
+_SUBMODULES = {'aio', 'aws', 'budget', 'cassette', 'cloudformation',
+               'columnar', 'config', 'dynamodb', 'ec2', 'exceptions',
+               'export', 'fanout', 'iam', 'inventory', 'kinesis', 'kms',
+               'metrics', 'redshift', 's3', 'singleflight', 'utils',
+               'waiter'}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
@@ -0,0 +1,178 @@
+"""asyncio counterparts of the facades.
+
+botocore only makes blocking calls, so the async facades wrap the sync
+facades and make their calls on a bounded pool of threads shared by all of
+them. They share the configuration, caches and retry policy of the facades
+they wrap. Waiting (between polls or pages) happens in the event loop, so
+no thread is held while waiting.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import threading
+
+import inflection
+
+from .aws import AwsFacade
+
+
+# Number of threads shared by the async facades that make the API calls
+AIO_WORKERS = 64
+# Seconds between two polls of a stack status
+POLL_INTERVAL = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def shared_executor():
+    """The pool of threads used by the async facades by default"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=AIO_WORKERS)
+        return _executor
+
+
+class AsyncFacade(object):
+    """Async counterpart of a facade.
+
+    Every method and property of the wrapped facade is available as a
+    coroutine function: await facade.method(...) or await facade.prop().
+    Iterators produced by methods are consumed in the pool of threads, and
+    their items returned as a list.
+    """
+    def __init__(self, facade, executor=None):
+        """
+        :param facade: The sync facade that is wrapped.
+        :param executor: The pool of threads where calls are made. By
+            default the one shared by all the async facades.
+        """
+        self.facade = facade
+        self.executor = executor
+
+    def __getattr__(self, name):
+        attr = getattr(type(self.facade), name, None)
+        if isinstance(attr, property):
+            return functools.partial(self.run, getattr, self.facade, name)
+        method = getattr(self.facade, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self.run(_consumed, method, *args, **kwargs)
+        return call
+
+    async def run(self, func, *args, **kwargs):
+        """Calls a blocking function in the pool of threads, in a copy of
+        the context of the caller"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor or shared_executor(),
+            functools.partial(contextvars.copy_context().run, func, *args,
+                              **kwargs))
+
+    async def paginate(self, operation, **kwargs):
+        """Produces the pages of a client operation, fetching one at a time.
+
+        Operations that cannot be paginated produce a single page.
+        """
+        client = await self.client()
+        if not client.can_paginate(operation):
+            yield await self.run(getattr(client, operation), **kwargs)
+            return
+        pages = await self.run(
+            lambda: iter(client.get_paginator(operation).paginate(**kwargs)))
+        done = object()
+        while True:
+            page = await self.run(next, pages, done)
+            if page is done:
+                return
+            yield page
+
+    async def iter_resources(self, restype, **kwargs):
+        """Produces AWS resources page by page, like the sync _get_resource"""
+        operation = "describe_{}s".format(inflection.underscore(restype))
+        resource = await self.resource()
+        factory = getattr(resource, restype)
+        id_field = AwsFacade._get_id_field(restype)
+        async for page in self.paginate(operation, **kwargs):
+            for value in page[restype + 's']:
+                yield factory(value[id_field])
+
+    async def wait(self, waiter_name, delay=None, max_attempts=None,
+                   **kwargs):
+        """Waits for a botocore waiter of the client to succeed.
+
+        Polls like the sync waiter, but sleeps in the event loop. Produces
+        the last response.
+        """
+        from botocore.exceptions import ClientError, WaiterError
+        client = await self.client()
+        config = client.get_waiter(waiter_name).config
+        method = getattr(client, inflection.underscore(config.operation))
+        delay = config.delay if delay is None else delay
+        max_attempts = max_attempts or config.max_attempts
+        for attempt in range(max_attempts):
+            try:
+                response = await self.run(method, **kwargs)
+            except ClientError as error:
+                response = error.response
+            acceptor = next((a for a in config.acceptors
+                             if a.matcher_func(response)), None)
+            if acceptor is None and 'Error' in response:
+                raise WaiterError(name=waiter_name,
+                                  reason='An error occurred',
+                                  last_response=response)
+            if acceptor is not None and acceptor.state == 'success':
+                return response
+            if acceptor is not None and acceptor.state == 'failure':
+                raise WaiterError(name=waiter_name,
+                                  reason='Waiter encountered a terminal '
+                                  'failure state', last_response=response)
+            if attempt < max_attempts - 1:
+                await asyncio.sleep(delay)
+        raise WaiterError(name=waiter_name, reason='Max attempts exceeded',
+                          last_response=response)
+
+
+class AsyncCloudformation(AsyncFacade):
+    """Async counterpart of the Cloudformation facade"""
+    async def wait_for_status_change(self, stack_name, status,
+                                     nb_seconds=None, interval=POLL_INTERVAL):
+        """Waits for a stack status to change"""
+        from .cloudformation import CF_TIMEOUT
+        from .exceptions import AwsError
+        nb_seconds = CF_TIMEOUT if nb_seconds is None else nb_seconds
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + nb_seconds
+        curr_status = status
+        while curr_status and curr_status == status:
+            await asyncio.sleep(interval)
+            statuses = await self.stack_statuses()
+            curr_status = statuses.get(stack_name)
+            if curr_status == status and loop.time() >= deadline:
+                msg = ("Stack {stack_name} has stayed over {nb_seconds} "
+                       "seconds in status {status}").format(
+                    stack_name=stack_name, nb_seconds=nb_seconds,
+                    status=status)
+                raise AwsError(msg, logger=self.facade.config.logger)
+        return curr_status
+
+
+def wrap(facade, executor=None):
+    """Produces the async counterpart of a facade"""
+    from .cloudformation import Cloudformation
+    if isinstance(facade, Cloudformation):
+        return AsyncCloudformation(facade, executor)
+    return AsyncFacade(facade, executor)
+
+
+def _consumed(func, *args, **kwargs):
+    """Calls a function and consumes the iterator it produces, if any"""
+    value = func(*args, **kwargs)
+    if hasattr(value, '__next__'):
+        value = list(value)
+    return value
@@ -1,39 +1,158 @@
 """Generic AWS facade class."""
 
 import abc
+import configparser
 import inflection
+import jmespath
 import os
-from configparser import ConfigParser
 from collections import namedtuple
+import threading
 
-import botocore.config
-from boto3.session import Session
-from retrying import retry
-import wrapt
-
-from . import utils
-from .config import Config
-from .exceptions import CredentialsError
+from . import budget, utils
+from .metrics import default_metrics, timed
+from .config import Config, read_ini
+from .exceptions import CredentialsError, InvalidConfiguration
 
 
 Credentials = namedtuple('Credentials', 'key_id secret_key')
 
+# Model files loaded by warm_models
+MODEL_TYPES = ['service-2', 'paginators-1', 'waiters-2', 'resources-1',
+               'endpoint-rule-set-1']
+
+# Profile options that tune the HTTP connections of clients and resources,
+# and the functions that parse their values
+CONNECTION_OPTIONS = {'max_pool_connections': int,
+                      'connect_timeout': float,
+                      'read_timeout': float,
+                      'tcp_keepalive': utils.parse_bool}
+
+# JMESPath expressions of the items of the describe responses of the
+# resource types whose items are not in a top-level <restype>s list
+DESCRIBE_ITEMS = {'Instance': 'Reservations[].Instances[]'}
+
+# The botocore data loader shared by all sessions created by the facades
+_loader = None
+_loader_lock = threading.Lock()
+
+
+_retried_class = None
+
+
+def _retried():
+    """Produces the Retried class, importing wrapt and retrying on first use"""
+    global _retried_class
+    if _retried_class is None:
+        from retrying import retry
+        import wrapt
+
+        class Retried(wrapt.ObjectProxy):
+            """Add retry logic to a boto3 client or resource."""
+
+            @retry(wait_exponential_multiplier=1000,
+                   wait_exponential_max=10000)
+            def __getattr__(self, name):
+                    if name == '__wrapped__':
+                        raise ValueError('wrapper has not been initialised')
+
+                    return getattr(self.__wrapped__, name)
+
+        _retried_class = Retried
+    return _retried_class
 
-class Retried(wrapt.ObjectProxy):
-    """Add retry logic to a boto3 client or resource."""
 
-    @retry(wait_exponential_multiplier=1000, wait_exponential_max=10000)
-    def __getattr__(self, name):
-            if name == '__wrapped__':
-                raise ValueError('wrapper has not been initialised')
+def __getattr__(name):
+    # Retried is created lazily: importing wrapt is slow
+    if name == 'Retried':
+        return _retried()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
 
-            return getattr(self.__wrapped__, name)
+
+def _shared_loader(botocore_session):
+    """Produces the data loader that is shared by all facade sessions"""
+    global _loader
+    with _loader_lock:
+        if _loader is None:
+            from botocore.loaders import create_loader
+            _loader = create_loader(
+                botocore_session.get_config_variable('data_path'))
+        return _loader
+
+
+def new_session(**kwargs):
+    """Creates a boto3 session that shares its data loader.
+
+    Service and resource models are cached by the loader, so they are
+    loaded and parsed once per process instead of once per session. Keyword
+    arguments are passed to the boto3 Session constructor.
+    """
+    import botocore.session
+    from boto3.session import Session
+    botocore_session = botocore.session.get_session()
+    loader = _shared_loader(botocore_session)
+    botocore_session.register_component('data_loader', loader)
+    session = Session(botocore_session=botocore_session, **kwargs)
+    with _loader_lock:
+        # Every boto3 session appends its data path to the loader's paths
+        paths = loader.search_paths
+        paths[:] = sorted(set(paths), key=paths.index)
+    return session
+
+
+def warm_models(services, resources=True, region_name='us-east-1'):
+    """Preloads the models of some services in the shared data loader.
+
+    Call it at startup, or in a parent process before forking workers, so
+    that creating clients and resources later does not load models. Models
+    that a service does not have are skipped.
+    """
+    from botocore.exceptions import DataNotFoundError
+    session = new_session(region_name=region_name)
+    loader = session._session.get_component('data_loader')
+    for service in services:
+        for type_name in MODEL_TYPES:
+            try:
+                loader.load_service_model(service, type_name)
+            except DataNotFoundError:
+                pass
+        # Loads the remaining data that clients need (endpoints, retries...)
+        session.client(service)
+        if resources and service in session.get_available_resources():
+            session.resource(service)
 
 
 class AwsFacade(object):
     """Common facade functionality across AWS service facades"""
     def __init__(self, config=None, **kwargs):
-        """Initializes the proxy object configuration object"""
+        """Initializes the proxy object configuration object
+
+        :param single_flight: A SingleFlight that coalesces the identical
+            read-only calls made concurrently by the client and resource. It
+            may be shared by several facades. By default every facade has its
+            own, and False disables coalescing.
+        :param metrics: The Metrics registry where the API calls of the
+            facade are recorded. By default metrics.default_metrics, and False
+            disables recording.
+        :param cassette: An optional Cassette where the API calls of the
+            facade are recorded, or from which they are replayed.
+        :param session: An optional boto3 session to use instead of the one
+            of the configured profile.
+        :param inventory: An optional Inventory where the resources
+            described by the facade are stored and reused from.
+        """
+        session = kwargs.pop('session', None)
+        self.inventory = kwargs.pop('inventory', None)
+        self.cassette = kwargs.pop('cassette', None)
+        single_flight = kwargs.pop('single_flight', True)
+        if single_flight is True:
+            from .singleflight import SingleFlight
+            single_flight = SingleFlight()
+        self.single_flight = single_flight or None
+        metrics = kwargs.pop('metrics', True)
+        if metrics is True:
+            metrics = default_metrics
+        self.metrics = metrics or None
 
         if config is None:
             self.config = Config(**kwargs)
@@ -41,10 +160,14 @@ class AwsFacade(object):
             self.config = config
 
         # To cache boto3 stuff
-        self.__session = None
+        self.__session = session
         self.__client = None
         self.__resource = None
         self.__botocore_config = None
+        self.__scope = None
+        # Guards the lazy creation of the above, so that facades can be
+        # shared between threads
+        self.__lock = threading.RLock()
 
     @abc.abstractproperty
     def service(self):
@@ -53,52 +176,112 @@ class AwsFacade(object):
     @property
     def session(self):
         if self.__session is None:
-            aws_profile = self.config.profile.get('aws_profile')
-            if aws_profile == '' or aws_profile == 'default':
-                # Use the default creds for this system (maybe temporary
-                # creds from a role)
-                aws_region = self.config.profile.get('aws_region') or \
-                    os.environ.get("AWS_REGION") or \
-                    os.environ.get("AWS_DEFAULT_REGION")
-                if aws_region:
-                    # Region specified in the boto3facade profile.
-                    self.__session = Session(region_name=aws_region)
-                else:
-                    # Use the settings in ~/.aws/config
-                    self.__session = Session()
-            else:
-                self.__session = Session(
-                    profile_name=self.config.profile.get('aws_profile'))
+            with self.__lock:
+                if self.__session is None:
+                    self.__session = self._new_session()
         return self.__session
 
+    def _new_session(self):
+        """Creates the boto3 session for the configured profile"""
+        aws_profile = self.config.profile.get('aws_profile')
+        if aws_profile == '' or aws_profile == 'default':
+            # Use the default creds for this system (maybe temporary
+            # creds from a role)
+            aws_region = self.config.profile.get('aws_region') or \
+                os.environ.get("AWS_REGION") or \
+                os.environ.get("AWS_DEFAULT_REGION")
+            if aws_region:
+                # Region specified in the boto3facade profile.
+                return new_session(region_name=aws_region)
+            else:
+                # Use the settings in ~/.aws/config
+                return new_session()
+        else:
+            return new_session(
+                profile_name=self.config.profile.get('aws_profile'))
+
+    @property
+    def scope(self):
+        """Identifies who the facade makes its calls as: the profile and
+        access key id of its session. What is stored or shared for a scope
+        is never served to another one."""
+        if self.__scope is None:
+            with self.__lock:
+                if self.__scope is None:
+                    # The session caches its credentials, which the clients
+                    # it creates resolve anyway
+                    credentials = self.session.get_credentials()
+                    self.__scope = '{}:{}'.format(
+                        self.session.profile_name,
+                        credentials.access_key if credentials else '')
+        return self.__scope
+
     @property
     def botocore_config(self):
         """Advanced client/resource configuration options."""
         if self.__botocore_config is None:
-            # Among other things, using KMS with S3 requires v4
-            self.__botocore_config = botocore.config.Config(
-                signature_version="s3v4",
-                retries={"max_attempts": 20})
+            with self.__lock:
+                if self.__botocore_config is None:
+                    import botocore.config
+                    # Among other things, using KMS with S3 requires v4
+                    self.__botocore_config = botocore.config.Config(
+                        signature_version="s3v4",
+                        retries={"max_attempts": 20},
+                        **self._connection_options())
         return self.__botocore_config
 
+    def _connection_options(self):
+        """Reads the connection options that are set in the profile"""
+        options = {}
+        for option, parse in CONNECTION_OPTIONS.items():
+            value = self.config.profile.get(option)
+            if value is None or value == '':
+                continue
+            try:
+                options[option] = parse(value)
+            except ValueError:
+                msg = "Invalid value for option {}: {}".format(option, value)
+                raise InvalidConfiguration(msg, logger=self.config.logger)
+        return options
+
     @property
     def client(self):
         if self.__client is None:
-            self.__client = Retried(
-                self.session.client(self.service, config=self.botocore_config))
+            with self.__lock:
+                if self.__client is None:
+                    client = self.session.client(
+                        self.service, config=self.botocore_config)
+                    self._register_handlers(client)
+                    self.__client = _retried()(client)
         return self.__client
 
     @property
     def resource(self):
         if self.__resource is None:
-            self.__resource = Retried(self.session.resource(
-                self.service, config=self.botocore_config))
+            with self.__lock:
+                if self.__resource is None:
+                    resource = self.session.resource(
+                        self.service, config=self.botocore_config)
+                    self._register_handlers(resource.meta.client)
+                    self.__resource = _retried()(resource)
         return self.__resource
 
+    def _register_handlers(self, client):
+        """Registers the event handlers of the facade in a botocore client"""
+        if self.metrics is not None:
+            self.metrics.register(client)
+        if self.cassette is not None:
+            self.cassette.register(client)
+        if self.single_flight is not None:
+            self.single_flight.register(client, scope=self.scope)
+        # Registered last, since it may raise once other handlers have run
+        budget.register(client)
+
     def get_resource_by_tag(self, *args, **kwargs):
         """An alias of filter_resource_by_tag"""
         return self.filter_resource_by_tag(*args, **kwargs)
 
+    @timed
     def filter_resource_by_tag(self, restype, tags, **kwargs):
         """Get the list of resources that match the provided tags"""
         resources = self._get_resource(restype, **kwargs)
@@ -106,6 +289,7 @@ class AwsFacade(object):
             resources = filter(utils.tag_filter(k, v), resources)
         return resources
 
+    @timed
     def filter_resource_by_property(self, restype, props, **kwargs):
         """Get the list of resources that match the provided properties"""
         resources = self._get_resource(restype, **kwargs)
@@ -113,20 +297,77 @@ class AwsFacade(object):
             resources = filter(utils.property_filter(k, v), resources)
         return resources
 
+    def get_listing(self, restype, fields, tags=None, **kwargs):
+        """Produces a compact columnar Listing of resources.
+
+        :param fields: The names of the fields of the descriptions of the
+            resources that are kept, e.g. ['VpcId', 'State'].
+        :param tags: The keys of the tags that are kept, or True to keep
+            all of them.
+
+        Additional arguments are passed to the describe method.
+        """
+        from .columnar import Listing
+        if self.inventory is None:
+            # Pages are folded into the listing as they arrive
+            items = self._iter_descriptions(restype, **kwargs)
+        else:
+            items = self._describe_resources(restype, **kwargs)
+        return Listing.from_items(items, fields, tags)
+
+    def wait_for(self, spec, resource_ids, timeout=None):
+        """Waits on the states of resources in the background.
+
+        :param spec: A waiter.WaitSpec, or the name of one in waiter.WAITS
+            such as image_available.
+
+        Produces a future per resource id: waits on resources of the same
+        type are batched in the same describe calls.
+        """
+        from . import waiter
+        engine = waiter.default_engine()
+        timeout = waiter.WAIT_TIMEOUT if timeout is None else timeout
+        return [engine.wait(self.client, spec, resource_id, timeout)
+                for resource_id in resource_ids]
+
     def _get_resource(self, restype, **kwargs):
         """Returns a list of AWS resources"""
-        method = getattr(self.client, "describe_{}s".format(
-            inflection.underscore(restype)))
+        items = self._describe_resources(restype, **kwargs)
+        if self.resource:
+            resource = getattr(self.resource, restype)
+            id_field = AwsFacade._get_id_field(restype)
+            if self.inventory is None:
+                return (resource(v[id_field]) for v in items)
+            return (_loaded(resource(v[id_field]), v) for v in items)
+        else:
+            return (r for r in items)
 
+    def _describe_resources(self, restype, **kwargs):
+        """Describes AWS resources, or reads them from the inventory"""
         def describe():
-            return method(**kwargs)
+            return list(self._iter_descriptions(restype, **kwargs))
 
-        if self.resource:
-            resource = getattr(self.resource, restype)
-            return (resource(v[AwsFacade._get_id_field(restype)])
-                    for v in describe()[restype + 's'])
+        if self.inventory is None:
+            return describe()
+        return self.inventory.fetch(self._inventory_key(restype, kwargs),
+                                    describe)
+
+    def _iter_descriptions(self, restype, **kwargs):
+        """Produces the descriptions of AWS resources, page by page"""
+        operation = "describe_{}s".format(inflection.underscore(restype))
+        items = jmespath.compile(
+            DESCRIBE_ITEMS.get(restype, '{}s[]'.format(restype)))
+        if self.client.can_paginate(operation):
+            pages = self.client.get_paginator(operation).paginate(**kwargs)
         else:
-            return (r for r in describe()[restype + 's'])
+            pages = [getattr(self.client, operation)(**kwargs)]
+        for page in pages:
+            for item in items.search(page) or []:
+                yield item
+
+    def _inventory_key(self, restype, params=None):
+        """The key of the inventory entry of a type of resources"""
+        return self.scope, self.session.region_name, restype, params
 
     def get_credentials(self):
         """Produces a tuple with the local AWS credentials"""
@@ -135,8 +376,9 @@ class AwsFacade(object):
         if key_id is None or secret_key is None:
             aws_creds_ini = os.path.join(
                 os.path.expanduser('~'), '.aws', 'credentials')
-            cfg = ConfigParser()
-            cfg.read(aws_creds_ini)
+            # Options of the DEFAULT section are inherited by the profiles
+            cfg = configparser.ConfigParser()
+            cfg.read_dict(read_ini(aws_creds_ini))
             profiles = cfg.sections()
             if self.config.active_profile not in profiles:
                 msg = ("No credentials for profile {} could be found in "
@@ -155,3 +397,10 @@ class AwsFacade(object):
             return 'GroupId'
         else:
             return restype + 'Id'
+
+
+def _loaded(resource, data):
+    """Sets the data of a resource from its stored description, so that
+    reading its attributes does not describe it again"""
+    resource.meta.data = data
+    return resource
@@ -0,0 +1,201 @@
+"""Accounting and budgeting of the API calls made by the facades."""
+
+import contextvars
+import logging
+import sys
+import threading
+
+from .exceptions import BudgetExceededError
+from .metrics import _body_size, _response_size
+
+
+# Name under which the calls that are not made by a facade method are counted
+DIRECT_CALLS = 'direct'
+# The quantities that are counted by a budget
+COUNTERS = ('calls', 'requests', 'pages', 'bytes_sent', 'bytes_received')
+
+DEFAULT_LOGGER = logging.getLogger(__name__)
+
+# The budgets that are active in any thread
+_active = []
+_active_lock = threading.Lock()
+# The budgets entered in the current context, which the pools of threads of
+# the facades hand over to their workers
+_entered = contextvars.ContextVar('budgets', default=())
+# The facade method that handed over the work running in the current context
+_handed_over_by = contextvars.ContextVar('handed_over_by', default=None)
+
+
+class Budget(object):
+    """Counts the API calls made within a block and enforces limits on them.
+
+    Use it as a context manager. It counts the API calls made by the facades
+    in the current thread and in the work it hands over to the pools of
+    threads of the facades (or in every thread if all_threads is True): the
+    calls, the HTTP requests (retries included), the pages of paginated
+    operations and the bytes sent and received. The counts are attributed
+    to the outermost public facade method that made the calls, such as
+    Cloudformation.stack_ok.
+
+    When a count exceeds its limit, a warning is logged if action is 'warn',
+    or BudgetExceededError is raised by the call that exceeded it if action
+    is 'raise'.
+    """
+    def __init__(self, max_calls=None, max_requests=None, max_pages=None,
+                 max_bytes=None, action='raise', all_threads=False,
+                 logger=DEFAULT_LOGGER):
+        """
+        :param max_bytes: Limit on the bytes sent and received.
+        """
+        if action not in ('raise', 'warn'):
+            raise ValueError("Invalid budget action: {}".format(action))
+        self.limits = {'calls': max_calls, 'requests': max_requests,
+                       'pages': max_pages, 'bytes': max_bytes}
+        self.action = action
+        self.all_threads = all_threads
+        self.logger = logger
+        self.totals = dict.fromkeys(COUNTERS, 0)
+        self.by_method = {}
+        self._exceeded = set()
+        self._token = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._token = _entered.set(_entered.get() + (self,))
+        with _active_lock:
+            _active.append(self)
+        return self
+
+    def __exit__(self, *args):
+        with _active_lock:
+            _active.remove(self)
+        _entered.reset(self._token)
+
+    def report(self):
+        """Produces the counts, in total and per facade method"""
+        with self._lock:
+            return {'totals': dict(self.totals),
+                    'by_method': {k: dict(v)
+                                  for k, v in self.by_method.items()}}
+
+    def _applies(self):
+        """True if the calls made in the current context are counted"""
+        return self.all_threads or self in _entered.get()
+
+    def _add(self, method, counts):
+        with self._lock:
+            per_method = self.by_method.setdefault(
+                method or DIRECT_CALLS, dict.fromkeys(COUNTERS, 0))
+            for name, value in counts.items():
+                self.totals[name] += value
+                per_method[name] += value
+            totals = dict(self.totals,
+                          bytes=self.totals['bytes_sent'] +
+                          self.totals['bytes_received'])
+            exceeded = [name for name, limit in self.limits.items()
+                        if limit is not None and totals[name] > limit and
+                        name not in self._exceeded]
+            if self.action == 'warn':
+                # Warn only once per limit
+                self._exceeded.update(exceeded)
+        for name in exceeded:
+            msg = "API call budget exceeded: {} {} > {} (in {})".format(
+                totals[name], name, self.limits[name],
+                method or DIRECT_CALLS)
+            if self.action == 'raise':
+                raise BudgetExceededError(msg, logger=self.logger)
+            self.logger.warning(msg)
+
+
+def register(client):
+    """Counts the calls made with a botocore client in the active budgets"""
+    events = client.meta.events
+    pageable = []
+
+    def end_call(event_name, context, **kwargs):
+        counts = context.pop('budget_counts', None)
+        budgets = _budgets()
+        if not budgets:
+            return
+        if not pageable:
+            pageable.append(_pageable_operations(client))
+        counts = counts or dict.fromkeys(COUNTERS, 0)
+        counts['calls'] = 1
+        counts['pages'] = int(event_name.split('.')[2] in pageable[0])
+        method = _calling_method()
+        for budget in budgets:
+            budget._add(method, counts)
+
+    events.register('request-created.*.*', _request_created,
+                    unique_id='boto3facade-budget-request')
+    events.register('needs-retry.*.*', _needs_retry,
+                    unique_id='boto3facade-budget-retry')
+    events.register('after-call.*.*', end_call,
+                    unique_id='boto3facade-budget-after')
+    events.register('after-call-error.*.*', end_call,
+                    unique_id='boto3facade-budget-error')
+    return client
+
+
+def hand_over():
+    """Attributes the calls made in the current context to the facade method
+    that is running, before the context is handed over to another thread"""
+    if _entered.get():
+        _handed_over_by.set(_calling_method())
+
+
+def _budgets():
+    """The active budgets that count the calls of the current thread"""
+    if not _active:
+        return []
+    with _active_lock:
+        return [b for b in _active if b._applies()]
+
+
+def _call_counts(context):
+    """The counts of the call a request belongs to"""
+    counts = context.get('budget_counts')
+    if counts is None:
+        counts = context['budget_counts'] = dict.fromkeys(COUNTERS, 0)
+    return counts
+
+
+def _request_created(request, **kwargs):
+    if not _active:
+        return
+    counts = _call_counts(request.context)
+    counts['requests'] += 1
+    counts['bytes_sent'] += _body_size(request.body)
+
+
+def _needs_retry(response, operation, request_dict, **kwargs):
+    if not _active or response is None:
+        return
+    _call_counts(request_dict['context'])['bytes_received'] += \
+        _response_size(response[0], operation)
+
+
+def _pageable_operations(client):
+    """The names of the operations of a client that can be paginated"""
+    return {operation for method, operation
+            in client.meta.method_to_api_mapping.items()
+            if client.can_paginate(method)}
+
+
+def _calling_method():
+    """The name of the outermost public facade method in the call stack, or
+    of the one that handed over the work of a pool thread"""
+    from .aws import AwsFacade
+    method = _handed_over_by.get()
+    if method is not None:
+        return method
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_code.co_name
+        if not name.startswith('_') and 'self' in frame.f_code.co_varnames:
+            obj = frame.f_locals.get('self')
+            # Decorators and nested functions are not attributes of the class
+            if isinstance(obj, AwsFacade) and hasattr(type(obj), name):
+                method = '{}.{}'.format(type(obj).__name__, name)
+        frame = frame.f_back
+    return method
@@ -0,0 +1,183 @@
+"""Recording and replaying of the API calls made by the facades."""
+
+import base64
+from collections import deque
+import gzip
+import io
+import json
+import threading
+import time
+
+from .exceptions import CassetteError
+from . import utils
+
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+
+class Cassette(object):
+    """Records the API calls of botocore clients to a file, and replays them.
+
+    A cassette is a gzip-compressed file with one JSON object per call: the
+    service, the operation, its parameters, the parsed response (or the
+    error) and the latency of the call.
+
+    When replaying, every call is answered with a recorded response for the
+    same service, operation and parameters, after sleeping for the recorded
+    latency multiplied by latency_scale. Identical calls get the recorded
+    responses in the order they were recorded, and the last one once they
+    have all been replayed, so that polling loops can run longer than they
+    did when recording.
+
+    :param path: The cassette file.
+    :param mode: RECORD or REPLAY.
+    :param latency_scale: Factor applied to the recorded latencies when
+        replaying. 0 replays calls without any delay.
+    """
+    def __init__(self, path, mode=REPLAY, latency_scale=1.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Invalid cassette mode: {}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._file = None
+        self._calls = {}
+        if mode == RECORD:
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Writes any pending recorded calls to the cassette file"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def register(self, client):
+        """Records or replays the calls made with a botocore client"""
+        events = client.meta.events
+        service_id = client.meta.service_model.service_id.hyphenize()
+        unique_id = 'boto3facade-cassette-{}'.format(id(self))
+
+        def set_key(params, model, context, **kwargs):
+            context['cassette_call'] = {
+                'service': service_id, 'operation': model.name,
+                'params': _params_key(params, model)}
+
+        events.register_last('before-parameter-build.*.*', set_key,
+                             unique_id=unique_id + '-key')
+        if self.mode == RECORD:
+            events.register('before-call.*.*', self._start,
+                            unique_id=unique_id + '-start')
+            events.register('after-call.*.*', self._record,
+                            unique_id=unique_id + '-record')
+            events.register('after-call-error.*.*', self._record_error,
+                            unique_id=unique_id + '-error')
+        else:
+            events.register('before-call.*.*', self._replay,
+                            unique_id=unique_id + '-replay')
+        return client
+
+    def _load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                key = (record['service'], record['operation'],
+                       record['params'])
+                self._calls.setdefault(key, deque()).append(record)
+
+    def _start(self, context, **kwargs):
+        context['cassette_start'] = time.time()
+
+    def _write(self, context, **fields):
+        call = context.pop('cassette_call', None)
+        if call is None:
+            return
+        start = context.pop('cassette_start', time.time())
+        call.update(fields, latency=round(time.time() - start, 6))
+        line = json.dumps(call, sort_keys=True) + '\n'
+        with self._lock:
+            if self._file is None:
+                raise CassetteError(
+                    "Cassette {} is closed".format(self.path))
+            self._file.write(line)
+
+    def _record(self, http_response, parsed, model, context, **kwargs):
+        streams = _buffer_streams(parsed) if model.has_streaming_output \
+            else {}
+        response = utils.to_json_types(parsed)
+        for key, data in streams.items():
+            response[key] = {'$stream': base64.b64encode(data).decode(
+                'ascii')}
+        self._write(context, status=http_response.status_code,
+                    response=response)
+
+    def _record_error(self, exception, context, **kwargs):
+        self._write(context, error='{}: {}'.format(
+            type(exception).__name__, exception))
+
+    def _replay(self, context, **kwargs):
+        from botocore.awsrequest import AWSResponse
+        call = context.get('cassette_call')
+        key = (call['service'], call['operation'], call['params'])
+        with self._lock:
+            records = self._calls.get(key)
+            if not records:
+                msg = "No recorded {} call to {} with parameters {}".format(
+                    key[1], key[0], key[2])
+                raise CassetteError(msg)
+            record = records.popleft() if len(records) > 1 else records[0]
+        if self.latency_scale > 0:
+            time.sleep(record['latency'] * self.latency_scale)
+        if 'error' in record:
+            raise CassetteError("Replayed error: {}".format(record['error']))
+        http = AWSResponse(None, record['status'], {}, None)
+        return http, _decode(record['response'])
+
+
+def _params_key(params, model):
+    """The parameters of a call that identify it, as a JSON string.
+
+    Idempotency tokens, which are random, are left out.
+    """
+    members = model.input_shape.members if model.input_shape else {}
+    return json.dumps(
+        {k: v for k, v in params.items()
+         if not (k in members and
+                 members[k].metadata.get('idempotencyToken'))},
+        sort_keys=True, default=repr)
+
+
+def _buffer_streams(parsed):
+    """Reads the streaming bodies of a response so that they can be recorded.
+
+    They are replaced in the response with streams of what was read.
+    Produces a dict with the data of every stream.
+    """
+    from botocore.response import StreamingBody
+    streams = {}
+    for key, value in list(parsed.items()):
+        if isinstance(value, StreamingBody):
+            data = streams[key] = value.read()
+            parsed[key] = StreamingBody(io.BytesIO(data), len(data))
+    return streams
+
+
+def _decode(response):
+    """Converts a recorded response back into a parsed response"""
+    from botocore.response import StreamingBody
+    response = utils.from_json_types(response)
+    for key, value in list(response.items()):
+        if isinstance(value, dict) and list(value) == ['$stream']:
+            data = base64.b64decode(value['$stream'])
+            response[key] = StreamingBody(io.BytesIO(data), len(data))
+    return response
@@ -1,5 +1,6 @@
 """Cloudformation facade."""
 
+import threading
 import time
 
 from botocore.exceptions import ClientError
@@ -7,10 +8,14 @@ from botocore.exceptions import ClientError
 from .aws import AwsFacade
 from .exceptions import AwsError, NoUpdatesError, StackNotFoundError
 from . import utils
+from .metrics import timed
 
 
 CF_TIMEOUT = 20*60
 CACHE_TIMEOUT = 5  # seconds
+# Above this number of changed stacks, all the stacks are described again
+# when the stacks of the inventory are refreshed
+INCREMENTAL_MAX_CHANGES = 20
 
 
 def retry_after_flush(func):
@@ -28,6 +33,8 @@ class Cloudformation(AwsFacade):
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
         self.__stacks = None
+        self.__stacks_lock = threading.Lock()
+        self.__flushed = False
 
     @property
     def service(self):
@@ -36,12 +43,56 @@ class Cloudformation(AwsFacade):
     @property
     def stacks(self):
         """Produces a list of CF stack description objects."""
-        if not self.__stacks or \
-                (time.time() - self.__stacks["ts"]) > CACHE_TIMEOUT:
-            self.__stacks = {
-                'ts': time.time(),
-                'stacks': self._describe_all_stacks()}
-        return self.__stacks["stacks"]
+        stacks = self.__stacks
+        if not stacks or (time.time() - stacks["ts"]) > CACHE_TIMEOUT:
+            with self.__stacks_lock:
+                # Another thread may have refreshed the cache in the meantime
+                stacks = self.__stacks
+                if not stacks or \
+                        (time.time() - stacks["ts"]) > CACHE_TIMEOUT:
+                    stacks = {
+                        'ts': time.time(),
+                        'stacks': self._fetch_stacks()}
+                    self.__stacks = stacks
+        return stacks["stacks"]
+
+    def _fetch_stacks(self):
+        """Describes all the stacks, or reads them from the inventory"""
+        if self.inventory is None:
+            return self._describe_all_stacks()
+        # After a flush the stored stacks are refreshed before being used
+        max_age = 0 if self.__flushed else None
+        self.__flushed = False
+        return self.inventory.fetch(self._inventory_key('Stack'),
+                                    self._describe_all_stacks,
+                                    update=self._update_stacks,
+                                    max_age=max_age)
+
+    def _update_stacks(self, stacks):
+        """Produces the current stacks from stored ones, describing only the
+        stacks that have been created, updated or deleted since then"""
+        stored = {s['StackId']: s for s in stacks}
+        statuses = self.client.meta.service_model.shape_for(
+            'StackStatus').enum
+        paginator = self.client.get_paginator('list_stacks')
+        current, changed = [], []
+        for page in paginator.paginate(StackStatusFilter=[
+                s for s in statuses if s != 'DELETE_COMPLETE']):
+            for summary in page['StackSummaries']:
+                stack = stored.get(summary['StackId'])
+                if stack is not None and \
+                        stack['StackStatus'] == summary['StackStatus'] and \
+                        stack.get('LastUpdatedTime') == \
+                        summary.get('LastUpdatedTime'):
+                    current.append(stack)
+                else:
+                    changed.append(summary['StackId'])
+        if len(changed) > INCREMENTAL_MAX_CHANGES:
+            return self._describe_all_stacks()
+        for stack_id in changed:
+            current += self.client.describe_stacks(
+                StackName=stack_id)['Stacks']
+        return current
 
     @property
     def stack_statuses(self):
@@ -67,6 +118,14 @@ class Cloudformation(AwsFacade):
     def flush_cache(self):
         """Flush the CF Stacks cache."""
         self.__stacks = None
+        self.__flushed = True
+
+    def _stacks_changed(self):
+        """Forgets the known stacks after a stack is created, updated or
+        deleted"""
+        self.flush_cache()
+        if self.inventory is not None:
+            self.inventory.discard(self._inventory_key('Stack'))
 
     def _get_stack_property(self, property_name):
         """Gets the value of certain stack property for every stack in CF."""
@@ -85,6 +144,7 @@ class Cloudformation(AwsFacade):
             return
 
         self.client.delete_stack(StackName=stack_name)
+        self._stacks_changed()
         self.wait_for_status_change(stack_name, 'DELETE_IN_PROGRESS',
                                     nb_seconds=wait)
         stack_status = self.stack_statuses.get(stack_name)
@@ -110,6 +170,7 @@ class Cloudformation(AwsFacade):
             Capabilities=['CAPABILITY_IAM'],
             NotificationARNs=notification_arns,
             Tags=utils.roll_tags(tags))
+        self._stacks_changed()
         if wait:
             self.wait_for_status_change(stack_name, 'CREATE_IN_PROGRESS')
         stack_status = self.stack_statuses.get(stack_name)
@@ -139,6 +200,7 @@ class Cloudformation(AwsFacade):
             else:
                 raise
 
+        self._stacks_changed()
         if wait:
             self.wait_for_status_change(stack_name, 'UPDATE_IN_PROGRESS')
         stack_status = self.stack_statuses.get(stack_name)
@@ -168,6 +230,7 @@ class Cloudformation(AwsFacade):
         else:
             return is_ok
 
+    @timed
     def wait_for_status_change(self, stack_name, status,
                                nb_seconds=CF_TIMEOUT):
         """Waits for a stack status to change"""
@@ -177,6 +240,8 @@ class Cloudformation(AwsFacade):
         while curr_status and curr_status == status:
             time.sleep(1)
             counter += 1
+            # Stored stacks are refreshed before being polled
+            self.__flushed = True
             curr_status = self.stack_statuses.get(stack_name)
             if counter >= nb_seconds:
                 msg = ("Stack {stack_name} has stayed over {nb_seconds} "
@@ -0,0 +1,174 @@
+"""Compact columnar listings of AWS resources."""
+
+from array import array
+from collections import Counter
+
+
+# Prefix of the names of the columns that hold tag values
+TAG_PREFIX = 'tag:'
+
+
+class Listing(object):
+    """A listing of resources stored as columns of selected fields.
+
+    Every column is an array of integer codes that index a table of the
+    distinct values of the listing, so repeated values (tag keys and values,
+    VPC ids, states...) are stored only once and every item costs a few
+    bytes per column. Field values must be hashable: nested fields can be
+    selected with dotted names such as State.Name. Tags are stored in
+    columns named tag:<key>.
+
+    Filters and groupings evaluate their conditions once per distinct
+    value, and then only compare integer codes.
+    """
+    def __init__(self, fields, tags=None):
+        """
+        :param fields: The names of the fields that are kept.
+        :param tags: The keys of the tags that are kept, or True to keep
+            all of them.
+        """
+        self.fields = list(fields)
+        self.tags = tags
+        self._values = [None]
+        self._codes = {_interned(None): 0}
+        self._columns = {name: array('I') for name in self.fields}
+        if tags not in (None, True):
+            for key in tags:
+                self._columns[TAG_PREFIX + key] = array('I')
+        self._size = 0
+
+    @classmethod
+    def from_items(cls, items, fields, tags=None):
+        """Produces the listing of resource descriptions"""
+        listing = cls(fields, tags)
+        listing.extend(items)
+        return listing
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        """Produces every item as a dict of column values"""
+        names = list(self._columns)
+        columns = [self._columns[name] for name in names]
+        values = self._values
+        for row in zip(*columns):
+            yield {name: values[code] for name, code in zip(names, row)}
+
+    @property
+    def columns(self):
+        """The names of the columns"""
+        return list(self._columns)
+
+    def column(self, name):
+        """Produces the values of a column"""
+        values = self._values
+        return [values[code] for code in self._columns[name]]
+
+    def append(self, item):
+        """Adds a resource description to the listing"""
+        self.extend([item])
+
+    def extend(self, items):
+        """Adds resource descriptions to the listing"""
+        intern = self._intern
+        for item in items:
+            for name in self.fields:
+                self._columns[name].append(intern(_get_field(item, name)))
+            if self.tags is not None:
+                self._append_tags(item.get('Tags') or [])
+            self._size += 1
+
+    def filter(self, conditions=None, **kwargs):
+        """Produces the listing of the items that match all the conditions.
+
+        :param conditions: A dict of column names and conditions, for
+            column names that are not identifiers such as tag:Name.
+        :param kwargs: More column names and conditions.
+
+        A condition is either the value of the column, or a function that
+        is called with a value and returns True if it matches. Missing values
+        only match a None condition.
+        """
+        conditions = dict(conditions or {}, **kwargs)
+        selected = range(self._size)
+        for name, condition in conditions.items():
+            codes = self._matching_codes(condition)
+            column = self._columns.get(name)
+            if column is None:
+                # Missing columns hold no value
+                selected = selected if 0 in codes else []
+            else:
+                selected = [i for i in selected if column[i] in codes]
+        return self._take(selected)
+
+    def group_by(self, name):
+        """Produces a dict of the listings of the items per column value"""
+        groups = {}
+        for i, code in enumerate(self._columns[name]):
+            groups.setdefault(code, []).append(i)
+        return {self._values[code]: self._take(indexes)
+                for code, indexes in groups.items()}
+
+    def count_by(self, name):
+        """Produces a dict of the number of items per column value"""
+        values = self._values
+        return {values[code]: count
+                for code, count in Counter(self._columns[name]).items()}
+
+    def _intern(self, value):
+        key = _interned(value)
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def _append_tags(self, tags):
+        tags = {tag['Key']: tag['Value'] for tag in tags}
+        if self.tags is True:
+            for key in tags:
+                name = TAG_PREFIX + key
+                if name not in self._columns:
+                    # The items already listed do not have the tag
+                    self._columns[name] = array('I', [0] * self._size)
+        for name, column in self._columns.items():
+            if name.startswith(TAG_PREFIX):
+                column.append(self._intern(tags.get(name[len(TAG_PREFIX):])))
+
+    def _matching_codes(self, condition):
+        """The codes of the values that match a condition"""
+        if callable(condition):
+            return {code for code, value in enumerate(self._values)
+                    if code and condition(value)}
+        code = self._codes.get(_interned(condition))
+        return set() if code is None else {code}
+
+    def _take(self, indexes):
+        """Produces the listing of some items, sharing the values table"""
+        listing = Listing.__new__(Listing)
+        listing.fields = self.fields
+        listing.tags = self.tags
+        listing._values = self._values
+        listing._codes = self._codes
+        listing._columns = {
+            name: array('I', (column[i] for i in indexes))
+            for name, column in self._columns.items()}
+        listing._size = len(indexes)
+        return listing
+
+
+def _get_field(item, name):
+    """The value of a field of a resource description, given its dotted
+    name"""
+    for key in name.split('.'):
+        if not isinstance(item, dict):
+            return None
+        item = item.get(key)
+    return item
+
+
+def _interned(value):
+    """The key of a value in the values table, so that e.g. True and 1 are
+    distinct values"""
+    return value.__class__, value
@@ -1,11 +1,15 @@
 """Configuration management."""
 
 import configparser
+import contextlib
+import io
 import logging
 import os
 import shutil
+import threading
 
 from boto3facade import __dir__
+from . import utils
 from .exceptions import InvalidConfiguration
 
 
@@ -25,6 +29,60 @@ DEFAULT_FALLBACK = {'aws_profile': 'default'}
 
 CONFIG_FILE_TEMPLATE = os.path.join(__dir__, "boto3facade.ini")
 
+# Parsed ini files, shared by the whole process
+_ini_cache = {}
+_ini_cache_lock = threading.Lock()
+
+
+def _file_signature(path):
+    """Identifies a version of a file by its inode, mtime and size"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _parser_to_dict(parser):
+    """Converts a ConfigParser into a dict of sections with raw values"""
+    defaults = parser.defaults()
+    data = {parser.default_section: dict(defaults)} if defaults else {}
+    for section in parser.sections():
+        data[section] = {k: v for k, v in parser.items(section, raw=True)
+                         if defaults.get(k) != v}
+    return data
+
+
+def read_ini(path):
+    """Produces the contents of an ini file as a dict of sections.
+
+    Parsed files are cached for the whole process and revalidated with a
+    stat call, so reading an unchanged file does not read or parse it
+    again. The produced dict is shared and must not be modified. A missing
+    file produces an empty dict. Options of the DEFAULT section are only in
+    its own entry: reading the dict into a ConfigParser makes the other
+    sections inherit them.
+    """
+    signature = _file_signature(path)
+    if signature is None:
+        return {}
+    with _ini_cache_lock:
+        cached = _ini_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    data = _parser_to_dict(parser)
+    with _ini_cache_lock:
+        _ini_cache[path] = (signature, data)
+    return data
+
+
+def clear_ini_cache():
+    """Forgets all parsed ini files"""
+    with _ini_cache_lock:
+        _ini_cache.clear()
+
 
 class Config:
     def __init__(self, env_prefix=DEFAULT_ENV_PREFIX,
@@ -53,6 +111,10 @@ class Config:
         if not os.path.isfile(config_file):
             shutil.copyfile(config_file_template, config_file)
 
+        # Pending changes are only saved when the outermost batch exits
+        self._batch_depth = 0
+        self._dirty = False
+
         self.config = configparser.ConfigParser()
         self.load()
 
@@ -70,10 +132,11 @@ class Config:
             self.config_file = local_file
             self.load()
         fallback = self.fallback
-        for option in self.keys:
-            value = kwargs.get(option) or \
-                self._get_config(option, ask=ask, fallback=fallback)
-            self.set_profile_option(self.active_profile, option, value)
+        with self.batch():
+            for option in self.keys:
+                value = kwargs.get(option) or \
+                    self._get_config(option, ask=ask, fallback=fallback)
+                self.set_profile_option(self.active_profile, option, value)
 
         # We just updated the ini file: reload
         self.profile = self.get_profile(self.active_profile)
@@ -86,7 +149,7 @@ class Config:
         if not os.path.isdir(AWS_CONFIG_DIR):
             os.makedirs(AWS_CONFIG_DIR)
         cfg = configparser.ConfigParser()
-        cfg.read(AWS_CONFIG_FILE)
+        cfg.read_dict(read_ini(AWS_CONFIG_FILE))
         return cfg
 
     def _write_aws_config(self, cfg):
@@ -134,16 +197,66 @@ class Config:
 
     def load(self):
         """Load configuration from ini file."""
-        self.config.read(self.config_file)
+        self.config.read_dict(read_ini(self.config_file))
         self.profile = self.get_profile(self.active_profile)
 
     def save(self):
-        """Save configuration to ini file"""
-        with open(self.config_file, 'w') as f:
-            self.config.write(f)
-            # Force flushing the file to disk
-            f.flush()
-            os.fsync(f.fileno())
+        """Save configuration to ini file.
+
+        The file is replaced atomically while holding a lock, so that
+        concurrent processes never read or write a partial file. Within a
+        batch, saving is deferred until the batch exits.
+        """
+        if self._batch_depth > 0:
+            self._dirty = True
+            return
+        with utils.file_lock(self.config_file + '.lock'):
+            self._write()
+
+    def _write(self):
+        """Writes the ini file, while the caller holds the lock"""
+        buf = io.StringIO()
+        self.config.write(buf)
+        # Force flushing the file to disk
+        utils.atomic_write(self.config_file, buf.getvalue(), fsync=True)
+        signature = _file_signature(self.config_file)
+        # What was just written does not need to be parsed again
+        with _ini_cache_lock:
+            _ini_cache[self.config_file] = (signature,
+                                            _parser_to_dict(self.config))
+        self._dirty = False
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Groups configuration changes so that they are saved only once.
+
+        The outermost batch locks the ini file and loads it again, so that
+        its changes apply to the latest contents of the file and no
+        concurrent change is lost. The changes are written when the outermost batch
+        exits, and discarded if an exception is raised in it.
+        """
+        outermost = self._batch_depth == 0
+        with contextlib.ExitStack() as stack:
+            if outermost:
+                stack.enter_context(
+                    utils.file_lock(self.config_file + '.lock'))
+                self.load()
+                snapshot = io.StringIO()
+                self.config.write(snapshot)
+            self._batch_depth += 1
+            try:
+                yield self
+            except Exception:
+                if outermost:
+                    self.config = configparser.ConfigParser()
+                    self.config.read_string(snapshot.getvalue())
+                    self.profile = self.get_profile(self.active_profile)
+                    self._dirty = False
+                raise
+            finally:
+                self._batch_depth -= 1
+            if outermost and self._dirty:
+                self._write()
 
     def get(self, section, param):
         """Get configuration option"""
@@ -160,9 +273,10 @@ class Config:
 
     def remove_profile(self, profile_name):
         """Removes a profile, if it exists. Otherwise does nothing."""
-        removed = self.config.remove_section("profile:{}".format(profile_name))
-        if removed:
-            self.save()
+        with self.batch():
+            section = "profile:{}".format(profile_name)
+            if self.config.remove_section(section):
+                self.save()
 
     def get_profile_option(self, profile_name, param):
         """Reads a config option for a profile"""
@@ -178,13 +292,14 @@ class Config:
 
     def set(self, section, param, value):
         """Writes a configuration parameter"""
-        if not self.config.has_section(section):
-            self.config.add_section(section)
+        with self.batch():
+            if not self.config.has_section(section):
+                self.config.add_section(section)
 
-        if value is None:
-            value = ''
-        self.config.set(section, param, value)
-        self.save()
+            if value is None:
+                value = ''
+            self.config.set(section, param, value)
+            self.save()
 
     def set_profile_option(self, profile_name, param, value):
         """Writes a profile parameter value"""
@@ -1,9 +1,497 @@
 """Dynamodb facade."""
 
+import base64
+from collections import namedtuple, OrderedDict
+import copy
+import functools
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
 from .aws import AwsFacade
+from . import utils
+
+
+# Maximum number of requests in a single BatchWriteItem call
+WRITE_BATCH_SIZE = 25
+# Maximum size of a single BatchWriteItem call
+WRITE_BATCH_MAX_BYTES = 16 * 1024 * 1024
+# Number of BatchWriteItem calls that are sent concurrently
+WRITE_WORKERS = 10
+# Number of attempts made to write items that come back as unprocessed
+WRITE_MAX_ATTEMPTS = 8
+# Maximum number of keys remembered to order the batches that write the same
+# keys: the batches in flight are waited for once it is reached
+WRITE_ROUND_MAX_KEYS = 25000
+# Default number of segments scanned concurrently by a parallel scan
+SCAN_SEGMENTS = 8
+# Maximum number of scanned pages waiting to be consumed
+SCAN_QUEUE_SIZE = 16
+# Maximum number of keys in a single BatchGetItem call
+GET_BATCH_SIZE = 100
+# Number of BatchGetItem calls that are sent concurrently
+GET_WORKERS = 10
+# Number of attempts made to read keys that come back as unprocessed
+GET_MAX_ATTEMPTS = 8
+# Defaults for the read-through cache
+CACHE_MAX_ITEMS = 10000
+CACHE_TTL = 60  # seconds
+
+
+BatchWriteResult = namedtuple('BatchWriteResult', 'written unprocessed')
+BatchGetResult = namedtuple('BatchGetResult', 'items unprocessed')
+
+# Created on first use: importing boto3.dynamodb imports boto3
+_serializer = None
+_deserializer = None
+
+
+def serialize(item):
+    """Converts a dict of native Python values to DynamoDB attribute values"""
+    global _serializer
+    if _serializer is None:
+        from boto3.dynamodb.types import TypeSerializer
+        _serializer = TypeSerializer()
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+def deserialize(item):
+    """Converts a dict of DynamoDB attribute values to native Python values"""
+    global _deserializer
+    if _deserializer is None:
+        from boto3.dynamodb.types import TypeDeserializer
+        _deserializer = TypeDeserializer()
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+
+def put_request(item):
+    """Produces a BatchWriteItem put request for a native Python item"""
+    return {'PutRequest': {'Item': serialize(item)}}
+
+
+def delete_request(key):
+    """Produces a BatchWriteItem delete request for a native Python key"""
+    return {'DeleteRequest': {'Key': serialize(key)}}
+
+
+class ReadCache(object):
+    """A thread-safe in-process LRU cache of items with a time-to-live.
+
+    Items are cached per table, so that every table has its own size limit.
+    Missing items are cached too. The cache is not invalidated by writes:
+    entries are served until they expire. Items are copied when they are
+    cached and when they are served, so callers may modify them.
+    """
+    # Produced by get for the keys that are not cached
+    MISS = object()
+
+    def __init__(self, max_items=CACHE_MAX_ITEMS, ttl=CACHE_TTL,
+                 table_limits=None):
+        """
+        :param max_items: Maximum number of items cached for a table.
+        :param ttl: Number of seconds an item is served from the cache.
+        :param table_limits: A dict with the maximum number of items of
+            tables that must not use max_items.
+        """
+        self.max_items = max_items
+        self.ttl = ttl
+        self.table_limits = table_limits or {}
+        self._tables = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, table_name, key_id):
+        """Produces a copy of a cached item, or ReadCache.MISS"""
+        with self._lock:
+            stats = self._table_stats(table_name)
+            entries = self._tables.get(table_name, {})
+            entry = entries.get(key_id)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del entries[key_id]
+                stats['misses'] += 1
+                return self.MISS
+            entries.move_to_end(key_id)
+            stats['hits'] += 1
+        # Copied outside of the lock: entries are never modified in place
+        return copy.deepcopy(entry[1])
+
+    def put(self, table_name, key_id, item):
+        """Caches a copy of an item, evicting the least recently used
+        ones"""
+        item = copy.deepcopy(item)
+        limit = self.table_limits.get(table_name, self.max_items)
+        with self._lock:
+            entries = self._tables.setdefault(table_name, OrderedDict())
+            entries[key_id] = (time.time() + self.ttl, item)
+            entries.move_to_end(key_id)
+            while len(entries) > limit:
+                entries.popitem(last=False)
+                self._table_stats(table_name)['evictions'] += 1
+
+    def invalidate(self, table_name=None):
+        """Removes all the cached items of a table, or of all tables"""
+        with self._lock:
+            if table_name is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table_name, None)
+
+    def stats(self):
+        """Produces the hits, misses, evictions and size of every table"""
+        with self._lock:
+            return {table: dict(stats,
+                                size=len(self._tables.get(table, {})))
+                    for table, stats in self._stats.items()}
+
+    def _table_stats(self, table_name):
+        return self._stats.setdefault(
+            table_name, {'hits': 0, 'misses': 0, 'evictions': 0})
 
 
 class Dynamodb(AwsFacade):
+    def __init__(self, *args, **kwargs):
+        """
+        :param cache: An optional ReadCache used by get_many.
+        """
+        self.cache = kwargs.pop('cache', None)
+        super(Dynamodb, self).__init__(*args, **kwargs)
+
     @property
     def service(self):
         return 'dynamodb'
+
+    def batch_write(self, table_name, requests, max_workers=WRITE_WORKERS,
+                    write_capacity=None, max_attempts=WRITE_MAX_ATTEMPTS,
+                    key_names=None):
+        """Writes a stream of put and delete requests to a table.
+
+        :param requests: An iterable of BatchWriteItem requests, as produced
+            by put_request and delete_request. It is consumed lazily. When
+            a batch has several requests for the same key only the last one
+            is sent, since DynamoDB rejects such batches. Writes to the same
+            key in different batches are applied in the order of the
+            requests: a batch that writes a key of a batch in flight waits
+            for it to complete.
+        :param max_workers: Number of BatchWriteItem calls sent concurrently.
+        :param write_capacity: If set, the rate of writes is kept below this
+            number of write capacity units per second.
+        :param max_attempts: Attempts made for items that come back as
+            unprocessed. Unprocessed items are retried with backoff.
+        :param key_names: The names of the key attributes of the table. By
+            default they are read with a DescribeTable call.
+
+        Returns a BatchWriteResult with the number of written items and the
+        list of requests that remained unprocessed.
+        """
+        if write_capacity:
+            limiter = utils.RateLimiter(write_capacity)
+        else:
+            limiter = None
+
+        if key_names is None:
+            key_names = self.key_names(table_name)
+
+        def write(batch):
+            return self._write_batch(table_name, batch, limiter, max_attempts)
+
+        written, unprocessed = 0, []
+        rounds = itertools.groupby(_write_batches(requests, key_names),
+                                   key=lambda batch: batch[2])
+        for _, batches in rounds:
+            for result in utils.parallel_map(write, batches,
+                                             max_workers=max_workers):
+                written += result.written
+                unprocessed += result.unprocessed
+        if unprocessed:
+            msg = "Failed to write {} items to table {}".format(
+                len(unprocessed), table_name)
+            self.config.logger.error(msg)
+        return BatchWriteResult(written, unprocessed)
+
+    def key_names(self, table_name):
+        """Produces the names of the key attributes of a table"""
+        table = self.client.describe_table(TableName=table_name)['Table']
+        return [key['AttributeName'] for key in table['KeySchema']]
+
+    def parallel_scan(self, table_name, segments=SCAN_SEGMENTS,
+                      processes=False, checkpoint_file=None,
+                      queue_size=SCAN_QUEUE_SIZE, **kwargs):
+        """Scans a whole table using concurrent segment workers.
+
+        :param segments: Number of segments (and workers) of the scan.
+        :param processes: If True the segments are scanned by a pool of
+            processes (at most one per CPU), each of them creating its own
+            facade from the config file and active profile of this facade.
+        :param checkpoint_file: If set, the LastEvaluatedKey of every segment
+            is saved to this local file as pages are consumed, and an
+            interrupted scan is resumed from there. The file is removed once
+            the scan completes.
+        :param queue_size: Maximum number of scanned pages waiting to be
+            consumed.
+
+        Additional keyword arguments (e.g. ProjectionExpression,
+        FilterExpression) are passed to every Scan call. Items are produced
+        as dicts of native Python values, in no particular order.
+        """
+        if checkpoint_file:
+            store = utils.FileCheckpointStore(checkpoint_file)
+            checkpoint = self._load_scan_checkpoint(store, table_name,
+                                                    segments)
+        else:
+            store = None
+            checkpoint = _new_scan_checkpoint(table_name, segments)
+
+        producers = []
+        for segment in range(segments):
+            if segment in checkpoint['done']:
+                continue
+            start_key = checkpoint['last_keys'].get(str(segment))
+            args = (table_name, segment, segments, start_key, kwargs)
+            if processes:
+                producers.append(functools.partial(
+                    _scan_segment_in_process, self.config.config_file,
+                    self.config.active_profile, *args))
+            else:
+                producers.append(functools.partial(_scan_segment, self,
+                                                   *args))
+
+        workers = min(segments, os.cpu_count() or 1) if processes \
+            else segments
+        pages = utils.merge_streams(producers, max_workers=workers,
+                                    maxsize=queue_size, processes=processes)
+        for segment, items, last_key in pages:
+            for item in items:
+                yield item
+            if store is not None:
+                if last_key is None:
+                    checkpoint['done'].append(segment)
+                else:
+                    checkpoint['last_keys'][str(segment)] = last_key
+                store.save(checkpoint)
+        if store is not None:
+            store.clear()
+
+    def _load_scan_checkpoint(self, store, table_name, segments):
+        """Loads the checkpoint of an interrupted parallel scan"""
+        checkpoint = store.load()
+        if not checkpoint:
+            return _new_scan_checkpoint(table_name, segments)
+        if checkpoint.get('table') != table_name or \
+                checkpoint.get('segments') != segments:
+            msg = ("Ignoring scan checkpoint in {} that does not match table "
+                   "{} with {} segments").format(store.path, table_name,
+                                                 segments)
+            self.config.logger.warning(msg)
+            return _new_scan_checkpoint(table_name, segments)
+        return checkpoint
+
+    def get_many(self, table_name, keys, max_workers=GET_WORKERS,
+                 max_attempts=GET_MAX_ATTEMPTS, **kwargs):
+        """Reads many items from a table using BatchGetItem calls.
+
+        :param keys: A list of keys as dicts of native Python values. Keys
+            may be repeated: every distinct key is read only once.
+        :param max_workers: Number of BatchGetItem calls sent concurrently.
+        :param max_attempts: Attempts made for keys that come back as
+            unprocessed.
+
+        Additional keyword arguments (e.g. ConsistentRead) are added to the
+        table request. A ProjectionExpression must include the key
+        attributes. The facade cache, if any, is only used when no keyword
+        arguments are given.
+
+        Returns a BatchGetResult with the item (or None if it does not
+        exist or could not be read) for every key, in the order of keys,
+        and the list of keys that remained unprocessed.
+        """
+        keys = list(keys)
+        if not keys:
+            return BatchGetResult([], [])
+        key_names = list(keys[0])
+        unique = OrderedDict((_key_id(k), k) for k in keys)
+        cache = self.cache if not kwargs else None
+        found = {}
+        if cache is not None:
+            for key_id in list(unique):
+                item = cache.get(table_name, key_id)
+                if item is not ReadCache.MISS:
+                    found[key_id] = item
+                    del unique[key_id]
+
+        def get_batch(batch):
+            return self._get_batch(table_name, batch, kwargs, max_attempts)
+
+        unprocessed = []
+        batches = utils.chunked(unique.values(), GET_BATCH_SIZE)
+        for items, left in utils.parallel_map(get_batch, batches,
+                                              max_workers=max_workers):
+            for item in items:
+                found[_key_id({n: item[n] for n in key_names})] = item
+            unprocessed += left
+        if unprocessed:
+            msg = "Failed to read {} keys from table {}".format(
+                len(unprocessed), table_name)
+            self.config.logger.error(msg)
+        if cache is not None:
+            left = {_key_id(k) for k in unprocessed}
+            for key_id in unique:
+                if key_id not in left:
+                    cache.put(table_name, key_id, found.get(key_id))
+        return BatchGetResult([found.get(_key_id(k)) for k in keys],
+                              unprocessed)
+
+    def _get_batch(self, table_name, keys, kwargs, max_attempts):
+        """Sends a BatchGetItem call, retrying unprocessed keys. Produces
+        the read items and the keys that remained unprocessed."""
+        request = dict(kwargs, Keys=[serialize(k) for k in keys])
+        items = []
+        for attempt in range(max_attempts):
+            if attempt > 0:
+                time.sleep(utils.backoff_delay(attempt))
+            resp = self.client.batch_get_item(
+                RequestItems={table_name: request})
+            items += [deserialize(i) for i
+                      in resp.get('Responses', {}).get(table_name, [])]
+            request = resp.get('UnprocessedKeys', {}).get(table_name)
+            if not request:
+                return items, []
+        return items, [deserialize(k) for k in request['Keys']]
+
+    def _write_batch(self, table_name, batch, limiter, max_attempts):
+        """Sends a BatchWriteItem call, retrying unprocessed items"""
+        requests, units, _ = batch
+        written = 0
+        for attempt in range(max_attempts):
+            if attempt > 0:
+                time.sleep(utils.backoff_delay(attempt))
+                units = sum(_write_units(_request_size(r)) for r in requests)
+            if limiter is not None:
+                limiter.acquire(units)
+            resp = self.client.batch_write_item(
+                RequestItems={table_name: requests})
+            left = resp.get('UnprocessedItems', {}).get(table_name, [])
+            written += len(requests) - len(left)
+            if not left:
+                return BatchWriteResult(written, [])
+            requests = left
+        return BatchWriteResult(written, requests)
+
+
+def _request_size(request):
+    """Estimates the size in bytes of a BatchWriteItem request"""
+    return len(json.dumps(request, default=str))
+
+
+def _write_units(size):
+    """Write capacity units consumed when writing an item of some size"""
+    return max(1, int(math.ceil(size / 1024.0)))
+
+
+def _write_batches(requests, key_names=None):
+    """Groups requests in batches that fit in a BatchWriteItem call.
+
+    If key_names is given, a request replaces the request for the same key
+    in its batch. Produces tuples (requests, write_units, round): a batch
+    starts a new round when it writes a key of an earlier batch of the
+    round, so that the batches of a round can be sent concurrently.
+    """
+    batches = _chunk_write_requests(requests, key_names)
+    round_number, round_keys = 0, set()
+    for batch, units in batches:
+        if key_names is not None:
+            if not round_keys.isdisjoint(batch) or \
+                    len(round_keys) + len(batch) > WRITE_ROUND_MAX_KEYS:
+                round_number, round_keys = round_number + 1, set()
+            round_keys.update(batch)
+        yield [r for r, _ in batch.values()], units, round_number
+
+
+def _chunk_write_requests(requests, key_names):
+    """Produces the batches of _write_batches, as dicts of the requests and
+    their sizes by key, and their write units"""
+    batch, nb_bytes, units = OrderedDict(), 0, 0
+    for index, request in enumerate(requests):
+        size = _request_size(request)
+        if size > WRITE_BATCH_MAX_BYTES:
+            raise ValueError(
+                "A write request of {} bytes exceeds the {} bytes limit of "
+                "BatchWriteItem".format(size, WRITE_BATCH_MAX_BYTES))
+        key = index if key_names is None else _request_key(request,
+                                                            key_names)
+        previous = batch.pop(key, None)
+        if previous is not None:
+            # The last write of a key wins
+            nb_bytes -= previous[1]
+            units -= _write_units(previous[1])
+        if batch and (len(batch) == WRITE_BATCH_SIZE or
+                      nb_bytes + size > WRITE_BATCH_MAX_BYTES):
+            yield batch, units
+            batch, nb_bytes, units = OrderedDict(), 0, 0
+        batch[key] = (request, size)
+        nb_bytes += size
+        units += _write_units(size)
+    if batch:
+        yield batch, units
+
+
+def _request_key(request, key_names):
+    """A hashable identifier of the key of a BatchWriteItem request"""
+    if 'PutRequest' in request:
+        attributes = request['PutRequest']['Item']
+    else:
+        attributes = request['DeleteRequest']['Key']
+    return tuple(json.dumps(attributes.get(name), sort_keys=True,
+                            default=str) for name in key_names)
+
+
+def _key_id(key):
+    """A hashable identifier of a key given as a dict of native values"""
+    return tuple(sorted(key.items()))
+
+
+def _new_scan_checkpoint(table_name, segments):
+    """An empty checkpoint for a parallel scan"""
+    return {'table': table_name, 'segments': segments, 'last_keys': {},
+            'done': []}
+
+
+def _scan_segment(ddb, table_name, segment, segments, start_key, kwargs):
+    """Scans a table segment, producing (segment, items, last_key) tuples.
+
+    The last_key is encoded with _encode_key so that it can be checkpointed.
+    """
+    kwargs = dict(kwargs, TableName=table_name, Segment=segment,
+                  TotalSegments=segments)
+    while True:
+        if start_key:
+            kwargs['ExclusiveStartKey'] = _decode_key(start_key)
+        resp = ddb.client.scan(**kwargs)
+        start_key = resp.get('LastEvaluatedKey')
+        if start_key:
+            start_key = _encode_key(start_key)
+        yield (segment, [deserialize(i) for i in resp.get('Items', [])],
+               start_key)
+        if not start_key:
+            break
+
+
+def _scan_segment_in_process(config_file, active_profile, *args):
+    """Scans a table segment using a facade created in this process"""
+    ddb = Dynamodb(config_file=config_file, active_profile=active_profile)
+    return _scan_segment(ddb, *args)
+
+
+def _encode_key(key):
+    """Makes a DynamoDB key serializable as JSON"""
+    return {k: {'B': base64.b64encode(v['B']).decode()} if 'B' in v else v
+            for k, v in key.items()}
+
+
+def _decode_key(key):
+    """Reverts _encode_key"""
+    return {k: {'B': base64.b64decode(v['B'])} if 'B' in v else v
+            for k, v in key.items()}
@@ -7,13 +7,10 @@ from collections import namedtuple
 import json
 import logging
 import os
-import requests
-from requests.adapters import ConnectTimeout
-from requests.exceptions import ConnectionError
 
 from . import utils
-from .iam import Iam
 from .aws import AwsFacade
+from .columnar import TAG_PREFIX
 from .exceptions import InvalidInstanceMetadataFieldError
 
 
@@ -46,6 +43,7 @@ def get_instance_profile_role():
     if info:
         profile_id = info.get('InstanceProfileId')
         if profile_id:
+            from .iam import Iam
             iam = Iam()
             iprofile = iam.get_instance_profile_by_id(profile_id)
             roles = iprofile.roles_attribute
@@ -56,6 +54,8 @@ def get_instance_profile_role():
 
 def in_ec2():
     """Returns true if running within an EC2 instance"""
+    import requests
+    from requests.exceptions import ConnectionError, ConnectTimeout
     try:
         requests.get("http://169.254.169.254/latest/meta-data/hostname",
                      timeout=1)
@@ -68,6 +68,8 @@ def get_instance_metadata(field):
     """Gets instance meta-data from the currently running EC2 instances"""
     if not in_ec2():
         return
+    import requests
+    from requests.exceptions import ConnectionError, ConnectTimeout
     try:
         resp = requests.get("http://169.254.169.254/latest/meta-data/" + field,
                             timeout=1)
@@ -84,8 +86,18 @@ class Ec2(AwsFacade):
     def service(self):
         return 'ec2'
 
-    def get_ami_by_tag(self, tags, owners=['self']):
-        """Returns the AMIs that match the provided tags"""
+    def get_ami_by_tag(self, tags, owners=['self'], fields=None):
+        """Returns the AMIs that match the provided tags.
+
+        :param fields: If set, a columnar Listing of these fields and of the
+            tags of the matching AMIs is returned instead of their
+            descriptions, see AwsFacade.get_listing.
+        """
+        if fields is not None:
+            listing = self.get_listing('Image', fields, tags=list(tags),
+                                       Owners=owners)
+            return listing.filter({TAG_PREFIX + k: v
+                                   for k, v in tags.items()})
         imgs = self.client.describe_images(Owners=owners).get('Images', [])
         sel_imgs = []
         for img in imgs:
@@ -98,6 +110,12 @@ class Ec2(AwsFacade):
                 sel_imgs.append(img)
         return sel_imgs
 
+    def wait_for_instances(self, instance_ids, state='running',
+                           timeout=None):
+        """Produces futures of the instances reaching a state: running,
+        stopped or terminated"""
+        return self.wait_for('instance_' + state, instance_ids, timeout)
+
     def get_ami_by_name(self, name):
         """Returns AMIs with a matching Name tag"""
         return filter(utils.tag_filter('Name', name),
@@ -47,3 +47,13 @@ class NoUpdatesError(LoggedException):
 class StackNotFoundError(LoggedException):
     """Could not find the requested stack in Cloudformation."""
     pass
+
+
+class CassetteError(LoggedException):
+    """An API call could not be recorded or replayed"""
+    pass
+
+
+class BudgetExceededError(LoggedException):
+    """More API calls were made than allowed by a budget"""
+    pass
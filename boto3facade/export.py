@@ -0,0 +1,150 @@
+"""Streaming export of resource listings to NDJSON and CSV files."""
+
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+
+from . import utils
+from .columnar import TAG_PREFIX, _get_field
+
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+FORMATS = (NDJSON, CSV)
+COMPRESSIONS = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+# Number of items fetched ahead of the item being written
+PREFETCH = 1000
+
+
+def export(items, path, format=None, fields=None, tags=None,
+           compression=None, prefetch=PREFETCH):
+    """Writes a listing of resources to a file, one item at a time.
+
+    The listing is consumed in a separate thread, at most prefetch items
+    ahead of the writer, so that fetching pages and writing overlap while
+    memory does not grow with the size of the listing.
+
+    :param items: An iterable of resource descriptions (dicts) or boto3
+        resources, such as the ones produced by the facades.
+    :param path: The path of the file, or a file object. Text file objects
+        are written as is, binary ones are compressed if needed.
+    :param format: ndjson or csv. By default guessed from the path.
+    :param fields: The names of the fields that are written, with dotted
+        names for nested fields. By default all the fields for NDJSON, and
+        the fields of the first item for CSV.
+    :param tags: The keys of the tags that are written as tag:<key> fields,
+        or True for all of them (NDJSON only). Tags are then not written as
+        a Tags field.
+    :param compression: gzip, bz2 or xz. By default guessed from the path.
+
+    Produces the number of items written.
+    """
+    name = path if isinstance(path, str) else getattr(path, 'name', '')
+    if not isinstance(name, str):
+        # File objects opened from a file descriptor are named by it
+        name = ''
+    text = not isinstance(path, str) and not _is_binary(path)
+    if text and compression is not None:
+        raise ValueError("Cannot compress to a text file object")
+    stem = name
+    if compression is None and not text:
+        for extension, compression_name in EXTENSIONS.items():
+            if name.endswith(extension):
+                compression, stem = compression_name, name[:-len(extension)]
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError("Invalid compression: {}".format(compression))
+    format = format or (CSV if stem.endswith('.csv') else NDJSON)
+    if format not in FORMATS:
+        raise ValueError("Invalid export format: {}".format(format))
+    if format == CSV and tags is True:
+        raise ValueError("The tag keys are needed to export CSV")
+
+    rows = (_row(item, fields, tags) for item in
+            utils.merge_streams([lambda: items], max_workers=1,
+                                maxsize=prefetch))
+    if text:
+        return _write(rows, path, format, fields, tags)
+    if compression is not None:
+        # Closing a compressed file does not close a file object it wraps
+        f = COMPRESSIONS[compression](path, 'wt', newline='')
+    elif isinstance(path, str):
+        f = open(path, 'w', newline='')
+    else:
+        f = io.TextIOWrapper(path, newline='')
+        try:
+            return _write(rows, f, format, fields, tags)
+        finally:
+            # Leave the binary file object open
+            f.flush()
+            f.detach()
+    with f:
+        return _write(rows, f, format, fields, tags)
+
+
+def dumps(items, **kwargs):
+    """Produces the export of a listing as a string"""
+    f = io.StringIO()
+    export(items, f, **kwargs)
+    return f.getvalue()
+
+
+def _is_binary(f):
+    """True if a file object is written with bytes"""
+    return isinstance(f, (io.RawIOBase, io.BufferedIOBase)) or \
+        'b' in getattr(f, 'mode', '')
+
+
+def _write(rows, f, format, fields, tags):
+    """Writes rows to a file, producing their number"""
+    count = 0
+    if format == NDJSON:
+        for row in rows:
+            f.write(json.dumps(utils.to_json_types(row), default=str))
+            f.write('\n')
+            count += 1
+        return count
+    writer = None
+    for row in rows:
+        if writer is None:
+            columns = list(fields or [k for k in row
+                                      if not k.startswith(TAG_PREFIX)])
+            columns += [TAG_PREFIX + key for key in tags or []]
+            writer = csv.DictWriter(f, columns, extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow({k: _csv_value(v) for k, v in row.items()})
+        count += 1
+    return count
+
+
+def _row(item, fields, tags):
+    """The fields of an item that are exported"""
+    if not isinstance(item, dict):
+        # A boto3 resource
+        if item.meta.data is None:
+            item.load()
+        item = item.meta.data
+    if fields is None:
+        row = dict(item)
+        if tags is not None:
+            row.pop('Tags', None)
+    else:
+        row = {name: _get_field(item, name) for name in fields}
+    if tags is not None:
+        item_tags = utils.unroll_tags(item.get('Tags') or [])
+        keys = item_tags if tags is True else tags
+        for key in keys:
+            row[TAG_PREFIX + key] = item_tags.get(key)
+    return row
+
+
+def _csv_value(value):
+    """The representation of a field value in a CSV cell"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(utils.to_json_types(value), default=str)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
@@ -0,0 +1,172 @@
+"""Concurrent queries across AWS accounts and regions."""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import threading
+
+from .aws import new_session
+from . import utils
+
+
+# Number of threads shared by all the queries of a Fanout
+FANOUT_WORKERS = 32
+
+
+Target = namedtuple('Target', 'profile region')
+FanoutResult = namedtuple('FanoutResult', 'target value error')
+
+
+class Fanout(object):
+    """Runs facade methods concurrently for many (profile, region) targets.
+
+    A Fanout keeps a pool of threads and a facade (with its session and
+    clients) per facade class and target, which are reused by all the
+    queries it runs. It can be used as a context manager, which shuts the
+    pool down on exit.
+
+    :param max_workers: Number of threads of the pool.
+    :param service_limits: An optional dict with the maximum number of
+        concurrent calls per service, e.g. {'ec2': 8}. The limits apply to
+        all the queries that run at the same time.
+    :param facade_kwargs: Keyword arguments used to create every facade,
+        e.g. config_file. A SingleFlight or an Inventory given here is
+        shared by the facades of all targets, which keep their entries apart
+        since they are scoped by the identity of the session of the target.
+    """
+    def __init__(self, max_workers=FANOUT_WORKERS, service_limits=None,
+                 **facade_kwargs):
+        self.max_workers = max_workers
+        self.service_limits = dict(service_limits or {})
+        self.facade_kwargs = facade_kwargs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._sessions = {}
+        self._facades = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Shuts down the pool of threads"""
+        self._executor.shutdown(wait=True)
+
+    def facade(self, facade_class, target):
+        """Produces the facade of a class for a target"""
+        target = Target(*target)
+        key = (facade_class, target)
+        with self._lock:
+            facade = self._facades.get(key)
+            session = self._sessions.get(target)
+        if facade is not None:
+            return facade
+        # Sessions and facades are created without holding the lock, so that
+        # targets do not wait for each other
+        if session is None:
+            session = _target_session(target)
+        facade = facade_class(session=session, **self.facade_kwargs)
+        with self._lock:
+            self._sessions.setdefault(target, session)
+            return self._facades.setdefault(key, facade)
+
+    def run(self, facade_class, method, targets, *args, **kwargs):
+        """Calls a facade method for every target.
+
+        :param method: The name of a method or property, or the method or
+            property itself, e.g. Ec2.get_vpc_by_name or
+            Cloudformation.stack_statuses.
+
+        Additional arguments are passed to the method. Produces a
+        FanoutResult for every target as soon as it is available. Results
+        that are iterators are turned into lists, so that the iteration
+        happens concurrently too. If the call fails for a target its error
+        is the exception.
+        """
+        targets = [Target(*t) for t in targets]
+        if not targets:
+            return
+        service = self._service(facade_class, targets)
+        semaphore = self._semaphore(service)
+        window = min(self.max_workers,
+                     self.service_limits.get(service, self.max_workers))
+
+        def call(target):
+            with semaphore:
+                try:
+                    facade = self.facade(facade_class, target)
+                    return FanoutResult(target, _call(facade, method, args,
+                                                      kwargs), None)
+                except Exception as error:
+                    return FanoutResult(target, None, error)
+
+        pending = set()
+        for target in targets:
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(utils.submit(self._executor, call, target))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def _service(self, facade_class, targets):
+        """The service of a facade class, from the facade of the first target
+        for which one can be created"""
+        for target in targets:
+            try:
+                return self.facade(facade_class, target).service
+            except Exception:
+                # The error is reported in the result of the target
+                continue
+
+    def _semaphore(self, service):
+        """The semaphore that limits the concurrent calls to a service"""
+        with self._lock:
+            semaphore = self._semaphores.get(service)
+            if semaphore is None:
+                limit = self.service_limits.get(service, self.max_workers)
+                semaphore = self._semaphores[service] = \
+                    threading.BoundedSemaphore(limit)
+            return semaphore
+
+
+def fanout(facade_class, method, targets, *args, **kwargs):
+    """Calls a facade method for every (profile, region) target.
+
+    A shortcut for Fanout.run with a pool that is used for this query only.
+    Keyword arguments max_workers, service_limits and facade_kwargs (a
+    dict) configure the Fanout; the others are passed to the method.
+    """
+    options = {k: kwargs.pop(k) for k in ('max_workers', 'service_limits')
+               if k in kwargs}
+    options.update(kwargs.pop('facade_kwargs', {}))
+    with Fanout(**options) as pool:
+        for result in pool.run(facade_class, method, targets, *args,
+                               **kwargs):
+            yield result
+
+
+def _target_session(target):
+    """Creates the boto3 session of a target"""
+    if target.profile in (None, '', 'default'):
+        return new_session(region_name=target.region)
+    return new_session(profile_name=target.profile,
+                       region_name=target.region)
+
+
+def _call(facade, method, args, kwargs):
+    """Calls a method of a facade, or reads one of its properties"""
+    if not isinstance(method, property) and not callable(method):
+        method = getattr(type(facade), method)
+    if isinstance(method, property):
+        value = method.fget(facade)
+    else:
+        value = method(facade, *args, **kwargs)
+    if hasattr(value, '__next__'):
+        value = list(value)
+    return value
@@ -0,0 +1,171 @@
+"""Persistent local inventory of the resources described by the facades."""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import utils
+
+
+DEFAULT_INVENTORY_FILE = os.path.join(os.path.expanduser('~'),
+                                      '.boto3facade.inventory.db')
+# Inventory entries older than this (in seconds) are refreshed before being
+# used
+INVENTORY_MAX_AGE = 15 * 60
+# Inventory entries older than this are used, but refreshed in the background
+INVENTORY_REFRESH_AGE = 60
+
+DEFAULT_LOGGER = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory (
+    scope TEXT NOT NULL,
+    region TEXT NOT NULL,
+    restype TEXT NOT NULL,
+    params TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    items TEXT NOT NULL,
+    PRIMARY KEY (scope, region, restype, params)
+)
+"""
+
+
+class Inventory(object):
+    """A SQLite store of describe results shared by processes.
+
+    Results are stored per scope (the identity the calls are made as, see
+    AwsFacade.scope), region, resource type and describe parameters, with
+    the time they were fetched. Entries that are less than refresh_age
+    seconds old are used as they are. Older entries are still used, and
+    refreshed in a background thread, until they are max_age seconds old:
+    then they are refreshed before being used.
+    """
+    def __init__(self, path=DEFAULT_INVENTORY_FILE,
+                 max_age=INVENTORY_MAX_AGE,
+                 refresh_age=INVENTORY_REFRESH_AGE, logger=DEFAULT_LOGGER):
+        self.path = path
+        self.max_age = max_age
+        self.refresh_age = min(refresh_age, max_age)
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._refreshing = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     timeout=30)
+        with self._lock, self._conn:
+            # Readers in other processes are not blocked by writers
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(SCHEMA)
+
+    def close(self):
+        """Waits for the background refreshes and closes the store"""
+        self.join()
+        with self._lock:
+            self._conn.close()
+
+    def join(self):
+        """Waits for the background refreshes to complete"""
+        while True:
+            with self._lock:
+                threads = list(self._refreshing.values())
+            if not threads:
+                return
+            for thread in threads:
+                thread.join()
+
+    def fetch(self, key, load, update=None, max_age=None):
+        """Produces the items of an inventory entry.
+
+        :param key: A (scope, region, restype, params) tuple, where params
+            is a dict of describe parameters.
+        :param load: A function that describes all the items of the entry.
+        :param update: An optional function that produces the current
+            items of the entry from its stored items, e.g. by describing only
+            the items that have changed since they were stored. By default
+            load is used.
+        :param max_age: Overrides the max_age of the inventory, e.g. 0 to
+            refresh the entry before using it.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        key = _key(key)
+        entry = self._get(key)
+        if entry is not None:
+            age = time.time() - entry[0]
+            if age < min(self.refresh_age, max_age):
+                return entry[1]
+            if age < max_age:
+                self._refresh_in_background(key, entry[1], load, update)
+                return entry[1]
+        return self._refresh(key, entry and entry[1], load, update)
+
+    def invalidate(self, scope=None, region=None, restype=None):
+        """Removes the entries that match a scope, region and type"""
+        conditions, values = [], []
+        for column, value in (('scope', scope), ('region', region),
+                              ('restype', restype)):
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                values.append(value)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM inventory' + where, values)
+
+    def discard(self, key):
+        """Removes an inventory entry, given its (scope, region, restype,
+        params) key"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM inventory WHERE scope = ? AND region = ? AND '
+                'restype = ? AND params = ?', _key(key))
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT fetched, items FROM inventory WHERE scope = ? AND '
+                'region = ? AND restype = ? AND params = ?', key).fetchone()
+        if row is not None:
+            return row[0], utils.from_json_types(json.loads(row[1]))
+
+    def _put(self, key, fetched, items):
+        data = json.dumps(utils.to_json_types(items))
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO inventory VALUES (?, ?, ?, ?, ?, ?)',
+                key + (fetched, data))
+
+    def _refresh(self, key, items, load, update):
+        fetched = time.time()
+        if items is not None and update is not None:
+            items = update(items)
+        else:
+            items = load()
+        self._put(key, fetched, items)
+        return items
+
+    def _refresh_in_background(self, key, items, load, update):
+        def refresh():
+            try:
+                self._refresh(key, items, load, update)
+            except Exception as error:
+                msg = "Failed to refresh the inventory of {}: {}".format(
+                    key, error)
+                self.logger.warning(msg)
+            finally:
+                with self._lock:
+                    del self._refreshing[key]
+
+        with self._lock:
+            if key in self._refreshing:
+                return
+            thread = self._refreshing[key] = threading.Thread(target=refresh)
+            thread.daemon = True
+            thread.start()
+
+
+def _key(key):
+    """The database key of an inventory entry"""
+    scope, region, restype, params = key
+    return (scope or '', region or '', restype,
+            json.dumps(params or {}, sort_keys=True, default=repr))
@@ -1,10 +1,601 @@
 """Kinesis facade."""
 
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import queue
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
 from boto3facade.aws import AwsFacade
+from boto3facade.metrics import THROTTLING_ERRORS
+from boto3facade import utils
+
+
+# Limits of a single PutRecords call
+PUT_RECORDS_MAX_RECORDS = 500
+PUT_RECORDS_MAX_BYTES = 5 * 1024 * 1024
+# Maximum size of a record (data and partition key)
+RECORD_MAX_BYTES = 1024 * 1024
+# Defaults for Kinesis.producer
+PRODUCER_LINGER = 0.1  # seconds
+PRODUCER_MAX_BUFFERED_RECORDS = 10000
+PRODUCER_MAX_BUFFERED_BYTES = 50 * 1024 * 1024
+PRODUCER_MAX_ATTEMPTS = 8
+# Maximum size of a KPL aggregated record
+AGGREGATE_MAX_BYTES = 51200
+# Prefix of every record aggregated with the KPL format
+AGGREGATION_MAGIC = b'\xf3\x89\x9a\xc2'
+# A shard can serve 5 GetRecords calls per second
+GET_RECORDS_INTERVAL = 0.2  # seconds
+# Defaults for Kinesis.consumer
+CONSUMER_POLL_INTERVAL = 1.0  # seconds
+CONSUMER_QUEUE_SIZE = 100
+CONSUMER_CHECKPOINT_INTERVAL = 5.0  # seconds
+# Maximum number of shards read at the same time by default. Threads are
+# only started for the shards being read.
+CONSUMER_MAX_WORKERS = 500
+# Checkpoint of a shard that has been read completely
+SHARD_END = 'SHARD_END'
 
 
 class Kinesis(AwsFacade):
     @property
     def service(self):
         return 'kinesis'
+
+    def producer(self, stream_name, **kwargs):
+        """Creates a Producer that writes buffered records to a stream.
+
+        Keyword arguments are passed to the Producer constructor.
+        """
+        return Producer(self, stream_name, **kwargs)
+
+    def consumer(self, stream_name, **kwargs):
+        """Creates a Consumer that reads all shards of a stream in parallel.
+
+        Keyword arguments are passed to the Consumer constructor.
+        """
+        return Consumer(self, stream_name, **kwargs)
+
+    def list_shards(self, stream_name):
+        """Produces the description of every shard of a stream"""
+        resp = self.client.list_shards(StreamName=stream_name)
+        shards = resp.get('Shards', [])
+        while resp.get('NextToken'):
+            resp = self.client.list_shards(NextToken=resp['NextToken'])
+            shards += resp.get('Shards', [])
+        return shards
+
+
+class Producer(object):
+    """Buffers records and sends them to a stream with PutRecords calls.
+
+    Records are sent by background threads when there are enough of them to
+    fill a PutRecords call, or when the oldest buffered record has waited
+    for linger seconds. Use it as a context manager, or call close() to send
+    the remaining records. Records that could not be written are kept in
+    the failed attribute as PutRecords entries. PutRecords calls are only
+    retried when they are throttled or fail with a server error: other
+    errors are raised by the next flush() or close().
+    """
+    def __init__(self, kinesis, stream_name, linger=PRODUCER_LINGER,
+                 max_buffered_records=PRODUCER_MAX_BUFFERED_RECORDS,
+                 max_buffered_bytes=PRODUCER_MAX_BUFFERED_BYTES,
+                 aggregate=False, max_attempts=PRODUCER_MAX_ATTEMPTS,
+                 max_workers=1):
+        """
+        :param linger: Maximum number of seconds a record waits in the
+            buffer before being sent.
+        :param max_buffered_records: put() blocks while the buffer holds
+            these many records.
+        :param max_buffered_bytes: put() blocks while the buffer holds
+            these many bytes.
+        :param aggregate: If True small records are packed in KPL aggregated
+            records, which consumers must deaggregate (see deaggregate).
+            All records in an aggregated record go to the shard of the first
+            record's partition key.
+        :param max_attempts: Attempts made for records that fail to be put.
+        :param max_workers: Number of PutRecords calls sent concurrently.
+            Records are only guaranteed to be written in order with 1.
+        """
+        self.kinesis = kinesis
+        self.stream_name = stream_name
+        self.linger = linger
+        self.max_buffered_records = max_buffered_records
+        self.max_buffered_bytes = max_buffered_bytes
+        self.aggregate = aggregate
+        self.max_attempts = max_attempts
+        self.failed = []
+        self._error = None
+        self._buffer = deque()
+        self._nb_bytes = 0
+        self._in_flight = 0
+        self._flushing = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._run)
+                         for _ in range(max_workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def put(self, data, partition_key, explicit_hash_key=None):
+        """Adds a record to the buffer, blocking while the buffer is full"""
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        size = len(data) + len(partition_key.encode('utf-8'))
+        if size > RECORD_MAX_BYTES:
+            raise ValueError("Record of {} bytes exceeds the maximum record "
+                             "size".format(size))
+        with self._cond:
+            while self._buffer and not self._closed and (
+                    len(self._buffer) >= self.max_buffered_records or
+                    self._nb_bytes + size > self.max_buffered_bytes):
+                self._cond.wait()
+            if self._closed:
+                raise ValueError("Producer for {} is closed".format(
+                    self.stream_name))
+            self._buffer.append((data, partition_key, explicit_hash_key,
+                                 size, time.time()))
+            self._nb_bytes += size
+            self._cond.notify_all()
+
+    def flush(self):
+        """Blocks until all buffered records have been sent.
+
+        Raises the first error that was not retried since the last flush.
+        """
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            while self._buffer or self._in_flight:
+                self._cond.wait()
+            self._flushing = False
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Sends all buffered records and stops the background threads"""
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            for thread in self._threads:
+                thread.join()
+
+    def _run(self):
+        """Takes batches from the buffer and sends them until closed"""
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._buffer:
+                        return
+                    timeout = self._batch_wait()
+                    if timeout == 0:
+                        break
+                    self._cond.wait(timeout)
+                records = self._take_batch()
+                self._in_flight += 1
+                self._cond.notify_all()
+            try:
+                self._send(records)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _batch_wait(self):
+        """Seconds to wait before a batch must be sent (None: forever)"""
+        if not self._buffer:
+            return
+        if self._flushing or self._closed or \
+                len(self._buffer) >= PUT_RECORDS_MAX_RECORDS or \
+                self._nb_bytes >= PUT_RECORDS_MAX_BYTES:
+            return 0
+        return max(0, self._buffer[0][4] + self.linger - time.time())
+
+    def _take_batch(self):
+        """Removes from the buffer the records of one PutRecords call"""
+        records, nb_bytes = [], 0
+        while self._buffer and len(records) < PUT_RECORDS_MAX_RECORDS:
+            if self.aggregate:
+                entries, size = self._peek_aggregate()
+            else:
+                entries, size = [self._buffer[0]], self._buffer[0][3]
+            if records and nb_bytes + size > PUT_RECORDS_MAX_BYTES:
+                break
+            for _ in entries:
+                self._buffer.popleft()
+            self._nb_bytes -= sum(e[3] for e in entries)
+            nb_bytes += size
+            if len(entries) > 1:
+                data = aggregate_records([e[:3] for e in entries])
+            else:
+                data = entries[0][0]
+            record = {'Data': data, 'PartitionKey': entries[0][1]}
+            if entries[0][2] is not None:
+                record['ExplicitHashKey'] = entries[0][2]
+            records.append(record)
+        return records
+
+    def _peek_aggregate(self):
+        """Selects the buffered records that fit in an aggregated record"""
+        entries, size = [], len(AGGREGATION_MAGIC) + 16
+        for entry in self._buffer:
+            # Approximate protobuf overhead of a record and its keys
+            entry_size = entry[3] + 16
+            if entries and size + entry_size > AGGREGATE_MAX_BYTES:
+                break
+            entries.append(entry)
+            size += entry_size
+        return entries, size
+
+    def _send(self, records):
+        """Sends a PutRecords call, retrying the records that failed"""
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                time.sleep(utils.backoff_delay(attempt))
+            try:
+                resp = self.kinesis.client.put_records(
+                    StreamName=self.stream_name, Records=records)
+            except Exception as error:
+                self.kinesis.config.logger.error(error)
+                if _retriable(error):
+                    continue
+                with self._cond:
+                    self.failed += records
+                    self._error = self._error or error
+                return
+            if not resp.get('FailedRecordCount'):
+                return
+            records = [record for record, result
+                       in zip(records, resp['Records'])
+                       if 'ErrorCode' in result]
+        msg = "Failed to put {} records in stream {}".format(
+            len(records), self.stream_name)
+        self.kinesis.config.logger.error(msg)
+        with self._cond:
+            self.failed += records
+
+
+def _retriable(error):
+    """True if a failed call may succeed when it is made again"""
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response.get('Error', {}).get('Code')
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in THROTTLING_ERRORS or (status or 0) >= 500
+
+
+class Consumer(object):
+    """Reads the records of all shards of a stream with parallel readers.
+
+    Iterating over a Consumer produces the GetRecords record dicts, with an
+    additional ShardId key. A shard is only read after its parent shards
+    have been read completely, so records with the same partition key are
+    produced in order across reshardings. The shards are listed again
+    whenever a shard ends, so that the child shards of a resharding that
+    happens while reading are read too.
+    """
+    def __init__(self, kinesis, stream_name, checkpoint_store=None,
+                 iterator_type='TRIM_HORIZON', timestamp=None,
+                 stop_at_latest=True, max_workers=None,
+                 queue_size=CONSUMER_QUEUE_SIZE,
+                 poll_interval=CONSUMER_POLL_INTERVAL,
+                 checkpoint_interval=CONSUMER_CHECKPOINT_INTERVAL,
+                 deaggregate=False):
+        """
+        :param checkpoint_store: A path to a local checkpoint file, or an
+            object with load() and save(checkpoints) methods such as
+            utils.FileCheckpointStore. The sequence number of the last
+            consumed record of every shard is saved to it, and reading
+            resumes after it.
+        :param iterator_type: Where to start reading shards that have no
+            checkpoint: TRIM_HORIZON, LATEST or AT_TIMESTAMP.
+        :param timestamp: The timestamp to use with AT_TIMESTAMP.
+        :param stop_at_latest: If True reading stops when all shards have
+            been read up to their latest record. Otherwise open shards are
+            polled every poll_interval seconds, forever.
+        :param max_workers: Number of shards read concurrently. By default
+            all shards (up to CONSUMER_MAX_WORKERS) are read at the same
+            time. When polling more open shards than workers, a shard that
+            has been read up to its latest record hands its worker over to
+            the shards waiting for one.
+        :param queue_size: Maximum number of GetRecords responses waiting
+            to be consumed.
+        :param checkpoint_interval: Minimum number of seconds between
+            checkpoint saves.
+        :param deaggregate: If True KPL aggregated records are unpacked.
+            Unpacked records share a SequenceNumber and have an additional
+            SubSequenceNumber key.
+        """
+        if isinstance(checkpoint_store, str):
+            checkpoint_store = utils.FileCheckpointStore(checkpoint_store)
+        self.kinesis = kinesis
+        self.stream_name = stream_name
+        self.checkpoint_store = checkpoint_store
+        self.iterator_type = iterator_type
+        self.timestamp = timestamp
+        self.stop_at_latest = stop_at_latest
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.deaggregate = deaggregate
+
+    def __iter__(self):
+        shards = self.kinesis.list_shards(self.stream_name)
+        shard_ids = {shard['ShardId'] for shard in shards}
+        by_id = {shard['ShardId']: shard for shard in shards}
+        if self.checkpoint_store is not None:
+            checkpoints = self.checkpoint_store.load()
+        else:
+            checkpoints = {}
+        done = {shard_id for shard_id, seq in checkpoints.items()
+                if seq == SHARD_END}
+        pending = [shard for shard in shards
+                   if shard['ShardId'] not in done]
+        running = set()
+        # The iterators of the shards handed over, and when to poll them
+        resume = {}
+        out = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        workers = self.max_workers or CONSUMER_MAX_WORKERS
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+        def crowded():
+            return len(running) > workers
+
+        def add_new_shards():
+            for shard in self.kinesis.list_shards(self.stream_name):
+                if shard['ShardId'] not in shard_ids:
+                    shard_ids.add(shard['ShardId'])
+                    by_id[shard['ShardId']] = shard
+                    if shard['ShardId'] not in done:
+                        pending.append(shard)
+
+        def start_ready_shards():
+            ready = []
+            for shard in list(pending):
+                parents = {shard.get('ParentShardId'),
+                           shard.get('AdjacentParentShardId')}
+                if parents & shard_ids <= done:
+                    pending.remove(shard)
+                    ready.append(shard['ShardId'])
+            # All ready shards are running before any reader checks whether
+            # shards are waiting for a worker
+            running.update(ready)
+            for shard_id in ready:
+                utils.submit(executor, self._read_shard, shard_id,
+                             checkpoints.get(shard_id), out, stop, crowded,
+                             resume)
+
+        try:
+            start_ready_shards()
+            last_save = time.time()
+            while running:
+                item = out.get()
+                if isinstance(item, utils.Failure):
+                    raise item.error
+                shard_id, records, seq, finished, shard_end = item
+                for record in records:
+                    yield record
+                if seq is not None:
+                    checkpoints[shard_id] = seq
+                if finished:
+                    running.discard(shard_id)
+                if finished and not shard_end and not self.stop_at_latest:
+                    # The shard was handed over to the shards waiting for a
+                    # worker: it waits for one in turn
+                    pending.append(by_id[shard_id])
+                    start_ready_shards()
+                if shard_end:
+                    checkpoints[shard_id] = SHARD_END
+                    done.add(shard_id)
+                    # The shard has been closed by a resharding
+                    add_new_shards()
+                    start_ready_shards()
+                if self.checkpoint_store is not None and \
+                        time.time() - last_save >= self.checkpoint_interval:
+                    self.checkpoint_store.save(checkpoints)
+                    last_save = time.time()
+            if self.checkpoint_store is not None:
+                self.checkpoint_store.save(checkpoints)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def _shard_iterator(self, shard_id, seq):
+        """Gets an iterator that starts after seq, or at the initial
+        position if there is no sequence number"""
+        kwargs = {'StreamName': self.stream_name, 'ShardId': shard_id}
+        if seq is not None:
+            kwargs.update(ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+                          StartingSequenceNumber=seq)
+        else:
+            kwargs['ShardIteratorType'] = self.iterator_type
+            if self.timestamp is not None:
+                kwargs['Timestamp'] = self.timestamp
+        resp = self.kinesis.client.get_shard_iterator(**kwargs)
+        return resp['ShardIterator']
+
+    def _read_shard(self, shard_id, seq, out, stop, crowded=None,
+                    resume=None):
+        """Reads a shard, handing over GetRecords responses through out.
+
+        When polling, a reader that has caught up returns if crowded() is
+        true, leaving the iterator of the shard and the time of its next
+        poll in resume.
+        """
+        try:
+            if resume is not None and shard_id in resume:
+                iterator, next_poll = resume.pop(shard_id)
+                stop.wait(max(0, next_poll - time.time()))
+            else:
+                iterator = self._shard_iterator(shard_id, seq)
+            last_call = 0
+            while not stop.is_set():
+                delay = last_call + GET_RECORDS_INTERVAL - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                last_call = time.time()
+                try:
+                    resp = self.kinesis.client.get_records(
+                        ShardIterator=iterator)
+                except ClientError as error:
+                    code = error.response.get('Error', {}).get('Code')
+                    if code != 'ExpiredIteratorException':
+                        raise
+                    iterator = self._shard_iterator(shard_id, seq)
+                    continue
+                records = resp.get('Records', [])
+                if records:
+                    seq = records[-1]['SequenceNumber']
+                iterator = resp.get('NextShardIterator')
+                caught_up = not records and \
+                    resp.get('MillisBehindLatest') == 0
+                shard_end = iterator is None
+                handed_over = caught_up and not shard_end and \
+                    not self.stop_at_latest and crowded is not None and \
+                    crowded()
+                if handed_over:
+                    resume[shard_id] = (iterator,
+                                        time.time() + self.poll_interval)
+                finished = shard_end or handed_over or \
+                    (caught_up and self.stop_at_latest)
+                item = (shard_id, self._unpack(shard_id, records),
+                        seq if records else None, finished, shard_end)
+                if not utils.put_unless_stopped(out, item, stop) or finished:
+                    return
+                if caught_up:
+                    stop.wait(self.poll_interval)
+        except Exception as error:
+            utils.put_unless_stopped(out, utils.Failure(error), stop)
+
+    def _unpack(self, shard_id, records):
+        """Adds the ShardId to records, deaggregating them if required"""
+        unpacked = []
+        for record in records:
+            record['ShardId'] = shard_id
+            if not self.deaggregate:
+                unpacked.append(record)
+                continue
+            parts = deaggregate(record['Data'], record['PartitionKey'])
+            for index, (data, partition_key, _) in enumerate(parts):
+                unpacked.append(dict(record, Data=data,
+                                     PartitionKey=partition_key,
+                                     SubSequenceNumber=index))
+        return unpacked
+
+
+def _varint(value):
+    """Encodes an integer as a protobuf varint"""
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(buf, pos):
+    """Decodes a protobuf varint, producing (value, next_position)"""
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _bytes_field(number, payload):
+    """Encodes a length-delimited protobuf field"""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _varint_field(number, value):
+    """Encodes a varint protobuf field"""
+    return _varint(number << 3) + _varint(value)
+
+
+def _read_fields(buf):
+    """Decodes the (number, value) fields of a protobuf message"""
+    pos = 0
+    while pos < len(buf):
+        tag, pos = _read_varint(buf, pos)
+        number, wire_type = tag >> 3, tag & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value, pos = buf[pos:pos + length], pos + length
+        else:
+            raise ValueError("Unsupported protobuf wire type {}".format(
+                wire_type))
+        yield number, value
+
+
+def aggregate_records(records):
+    """Packs (data, partition_key, explicit_hash_key) tuples in one record
+    using the aggregation format of the Kinesis Producer Library"""
+    keys, key_index = [], {}
+    hash_keys, hash_key_index = [], {}
+    body = []
+    for data, partition_key, explicit_hash_key in records:
+        if partition_key not in key_index:
+            key_index[partition_key] = len(keys)
+            keys.append(partition_key)
+        record = _varint_field(1, key_index[partition_key])
+        if explicit_hash_key is not None:
+            if explicit_hash_key not in hash_key_index:
+                hash_key_index[explicit_hash_key] = len(hash_keys)
+                hash_keys.append(explicit_hash_key)
+            record += _varint_field(2, hash_key_index[explicit_hash_key])
+        record += _bytes_field(3, data)
+        body.append(_bytes_field(3, record))
+    message = b''.join(
+        [_bytes_field(1, k.encode('utf-8')) for k in keys] +
+        [_bytes_field(2, k.encode('utf-8')) for k in hash_keys] + body)
+    return AGGREGATION_MAGIC + message + hashlib.md5(message).digest()
+
+
+def deaggregate(data, partition_key=None):
+    """Unpacks a KPL aggregated record.
+
+    Produces a list of (data, partition_key, explicit_hash_key) tuples. Data
+    that is not an aggregated record is produced as a single tuple.
+    """
+    message = data[len(AGGREGATION_MAGIC):-16]
+    if not data.startswith(AGGREGATION_MAGIC) or \
+            hashlib.md5(message).digest() != data[-16:]:
+        return [(data, partition_key, None)]
+    keys, hash_keys, records = [], [], []
+    for number, value in _read_fields(message):
+        if number == 1:
+            keys.append(value.decode('utf-8'))
+        elif number == 2:
+            hash_keys.append(value.decode('utf-8'))
+        elif number == 3:
+            fields = dict(_read_fields(value))
+            hash_key = fields.get(2)
+            records.append((fields[3], keys[fields[1]],
+                            None if hash_key is None else hash_keys[hash_key]))
+    return records
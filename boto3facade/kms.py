@@ -1,10 +1,284 @@
 """Kms facade."""
 
 
+from collections import namedtuple, OrderedDict
+import json
+import os
+import struct
+import threading
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+
 from boto3facade.aws import AwsFacade
+from boto3facade.exceptions import InitError
+from boto3facade import utils
+
+
+# Defaults for the data key cache
+DATA_KEY_MAX_AGE = 300  # seconds
+DATA_KEY_MAX_MESSAGES = 2 ** 32
+DATA_KEY_MAX_BYTES = 2 ** 63 - 1
+DATA_KEY_CACHE_CAPACITY = 1000
+# Format version of the messages produced by Kms.envelope_encrypt
+ENVELOPE_VERSION = 1
+NONCE_SIZE = 12
+# Number of concurrent calls made by the bulk operations
+BULK_WORKERS = 10
+# Requests per second made by the bulk operations. This is the lowest of the
+# regional quotas that are shared by all symmetric cryptographic operations.
+BULK_REQUEST_RATE = 5500
+
+
+BulkResult = namedtuple('BulkResult', 'value error')
+
+
+class DataKeyCache(object):
+    """A thread-safe local cache of KMS data keys.
+
+    Data keys used for encryption are reused until they are max_age seconds
+    old, or have encrypted max_messages messages or max_bytes bytes. Keys
+    are cached per KMS key and encryption context. Plaintext data keys
+    obtained by decrypting an encrypted data key are cached too, so that
+    decrypting the same encrypted key again does not call KMS.
+    """
+    def __init__(self, max_age=DATA_KEY_MAX_AGE,
+                 max_messages=DATA_KEY_MAX_MESSAGES,
+                 max_bytes=DATA_KEY_MAX_BYTES,
+                 capacity=DATA_KEY_CACHE_CAPACITY):
+        """
+        :param capacity: Maximum number of data keys cached for encryption,
+            and of decrypted data keys cached. The least recently used keys
+            are evicted.
+        """
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.capacity = capacity
+        self._encryption_keys = OrderedDict()
+        self._decryption_keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_encryption_key(self, key_id, context, nb_bytes):
+        """Produces a (plaintext, ciphertext_blob) data key that can still
+        encrypt nb_bytes, or None. The usage of the key is recorded."""
+        cache_key = (key_id, _context_key(context))
+        with self._lock:
+            entry = self._encryption_keys.get(cache_key)
+            if entry is None:
+                return
+            if entry['expires'] < time.time() or \
+                    entry['messages'] + 1 > self.max_messages or \
+                    entry['bytes'] + nb_bytes > self.max_bytes:
+                del self._encryption_keys[cache_key]
+                return
+            self._encryption_keys.move_to_end(cache_key)
+            entry['messages'] += 1
+            entry['bytes'] += nb_bytes
+            return entry['plaintext'], entry['ciphertext_blob']
+
+    def put_encryption_key(self, key_id, context, plaintext, ciphertext_blob,
+                           nb_bytes):
+        """Caches a new data key that has been used to encrypt nb_bytes"""
+        cache_key = (key_id, _context_key(context))
+        with self._lock:
+            self._encryption_keys[cache_key] = {
+                'plaintext': plaintext, 'ciphertext_blob': ciphertext_blob,
+                'expires': time.time() + self.max_age, 'messages': 1,
+                'bytes': nb_bytes}
+            self._encryption_keys.move_to_end(cache_key)
+            while len(self._encryption_keys) > self.capacity:
+                self._encryption_keys.popitem(last=False)
+        self.put_decryption_key(ciphertext_blob, context, plaintext)
+
+    def get_decryption_key(self, ciphertext_blob, context):
+        """Produces the cached plaintext of an encrypted data key, or None"""
+        cache_key = (ciphertext_blob, _context_key(context))
+        with self._lock:
+            entry = self._decryption_keys.get(cache_key)
+            if entry is None:
+                return
+            if entry[0] < time.time():
+                del self._decryption_keys[cache_key]
+                return
+            self._decryption_keys.move_to_end(cache_key)
+            return entry[1]
+
+    def put_decryption_key(self, ciphertext_blob, context, plaintext):
+        """Caches the plaintext of an encrypted data key"""
+        cache_key = (ciphertext_blob, _context_key(context))
+        with self._lock:
+            self._decryption_keys[cache_key] = (time.time() + self.max_age,
+                                                plaintext)
+            self._decryption_keys.move_to_end(cache_key)
+            while len(self._decryption_keys) > self.capacity:
+                self._decryption_keys.popitem(last=False)
+
+    def clear(self):
+        """Forgets all cached data keys"""
+        with self._lock:
+            self._encryption_keys.clear()
+            self._decryption_keys.clear()
 
 
 class Kms(AwsFacade):
+    def __init__(self, *args, **kwargs):
+        """
+        :param cache: An optional DataKeyCache used for envelope encryption.
+        """
+        self.cache = kwargs.pop('cache', None)
+        super(Kms, self).__init__(*args, **kwargs)
+
     @property
     def service(self):
         return 'kms'
+
+    def generate_data_key(self, key_id, context=None, nb_bytes=0):
+        """Produces a (plaintext, ciphertext_blob) AES-256 data key.
+
+        :param nb_bytes: Number of bytes that will be encrypted with the
+            key, which counts towards the usage limits of cached keys.
+        """
+        if self.cache is not None:
+            data_key = self.cache.get_encryption_key(key_id, context,
+                                                     nb_bytes)
+            if data_key is not None:
+                return data_key
+        resp = self.client.generate_data_key(
+            KeyId=key_id, KeySpec='AES_256', EncryptionContext=context or {})
+        if self.cache is not None:
+            self.cache.put_encryption_key(key_id, context, resp['Plaintext'],
+                                          resp['CiphertextBlob'], nb_bytes)
+        return resp['Plaintext'], resp['CiphertextBlob']
+
+    def decrypt_data_key(self, ciphertext_blob, context=None):
+        """Produces the plaintext of an encrypted data key"""
+        if self.cache is not None:
+            plaintext = self.cache.get_decryption_key(ciphertext_blob,
+                                                      context)
+            if plaintext is not None:
+                return plaintext
+        resp = self.client.decrypt(CiphertextBlob=ciphertext_blob,
+                                   EncryptionContext=context or {})
+        if self.cache is not None:
+            self.cache.put_decryption_key(ciphertext_blob, context,
+                                          resp['Plaintext'])
+        return resp['Plaintext']
+
+    def envelope_encrypt(self, key_id, plaintext, context=None):
+        """Encrypts data locally with AES-GCM and a KMS data key.
+
+        The encryption context is used as additional authenticated data.
+        Produces a message that contains the encrypted data key, which
+        envelope_decrypt can decrypt.
+        """
+        aesgcm = _require_aesgcm(self.config.logger)
+        key, ciphertext_blob = self.generate_data_key(key_id, context,
+                                                      len(plaintext))
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = aesgcm(key).encrypt(nonce, plaintext, _aad(context))
+        return (struct.pack('>BH', ENVELOPE_VERSION, len(ciphertext_blob)) +
+                ciphertext_blob + nonce + ciphertext)
+
+    def envelope_decrypt(self, message, context=None):
+        """Decrypts a message produced by envelope_encrypt"""
+        aesgcm = _require_aesgcm(self.config.logger)
+        version, blob_size = struct.unpack('>BH', message[:3])
+        if version != ENVELOPE_VERSION:
+            raise ValueError("Unsupported envelope version {}".format(
+                version))
+        ciphertext_blob = message[3:3 + blob_size]
+        nonce = message[3 + blob_size:3 + blob_size + NONCE_SIZE]
+        ciphertext = message[3 + blob_size + NONCE_SIZE:]
+        key = self.decrypt_data_key(ciphertext_blob, context)
+        return aesgcm(key).decrypt(nonce, ciphertext, _aad(context))
+
+    def encrypt_many(self, key_id, plaintexts, context=None,
+                     max_workers=BULK_WORKERS, rate=BULK_REQUEST_RATE):
+        """Encrypts many plaintexts (of up to 4 KB) with concurrent calls.
+
+        Produces a list of BulkResult, in the order of plaintexts. The value
+        of a result is the CiphertextBlob, unless the call failed: then
+        error is the exception and value is None.
+        """
+        requests = ({'KeyId': key_id, 'Plaintext': p,
+                     'EncryptionContext': context or {}} for p in plaintexts)
+        return self._call_many('encrypt', requests, 'CiphertextBlob',
+                               max_workers, rate)
+
+    def decrypt_many(self, ciphertext_blobs, context=None,
+                     max_workers=BULK_WORKERS, rate=BULK_REQUEST_RATE):
+        """Decrypts many ciphertexts with concurrent calls.
+
+        Produces a list of BulkResult with the Plaintext of every ciphertext
+        (see encrypt_many).
+        """
+        requests = ({'CiphertextBlob': c, 'EncryptionContext': context or {}}
+                    for c in ciphertext_blobs)
+        return self._call_many('decrypt', requests, 'Plaintext', max_workers,
+                               rate)
+
+    def re_encrypt_many(self, ciphertext_blobs, destination_key_id,
+                        context=None, destination_context=None,
+                        max_workers=BULK_WORKERS, rate=BULK_REQUEST_RATE):
+        """Re-encrypts many ciphertexts under another key with concurrent
+        calls.
+
+        The destination context defaults to the source context. Produces a
+        list of BulkResult with the new CiphertextBlob of every ciphertext
+        (see encrypt_many).
+        """
+        if destination_context is None:
+            destination_context = context
+        requests = ({'CiphertextBlob': c,
+                     'SourceEncryptionContext': context or {},
+                     'DestinationKeyId': destination_key_id,
+                     'DestinationEncryptionContext': destination_context or {}}
+                    for c in ciphertext_blobs)
+        return self._call_many('re_encrypt', requests, 'CiphertextBlob',
+                               max_workers, rate)
+
+    def _call_many(self, operation, requests, result_key, max_workers, rate):
+        """Makes many calls of an operation on a pool of threads, keeping the
+        request rate below rate calls per second"""
+        limiter = utils.RateLimiter(rate) if rate else None
+        method = getattr(self.client, operation)
+
+        def call(request):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                return BulkResult(method(**request)[result_key], None)
+            except (BotoCoreError, ClientError) as error:
+                return BulkResult(None, error)
+
+        results = list(utils.parallel_map(call, requests,
+                                          max_workers=max_workers,
+                                          ordered=True))
+        nb_errors = sum(1 for r in results if r.error is not None)
+        if nb_errors:
+            msg = "{} of {} {} calls failed".format(nb_errors, len(results),
+                                                    operation)
+            self.config.logger.error(msg)
+        return results
+
+
+def _context_key(context):
+    """A hashable representation of an encryption context"""
+    return tuple(sorted((context or {}).items()))
+
+
+def _aad(context):
+    """The additional authenticated data for an encryption context"""
+    return json.dumps(context or {}, sort_keys=True).encode('utf-8')
+
+
+def _require_aesgcm(logger):
+    """Imports AES-GCM from the optional cryptography package"""
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        msg = ("Envelope encryption requires the cryptography package: "
+               "pip install boto3facade[kms]")
+        raise InitError(msg, logger=logger)
+    return AESGCM
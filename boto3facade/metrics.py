@@ -0,0 +1,377 @@
+"""Instrumentation of the API calls made by the facades."""
+
+import contextlib
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+
+from . import utils
+
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+# Error codes returned by AWS when a request is throttled
+THROTTLING_ERRORS = {'Throttling', 'ThrottlingException',
+                     'ThrottledException', 'RequestThrottledException',
+                     'TooManyRequestsException',
+                     'ProvisionedThroughputExceededException',
+                     'RequestLimitExceeded', 'BandwidthLimitExceeded',
+                     'LimitExceededException', 'RequestThrottled',
+                     'SlowDown', 'EC2ThrottledException'}
+# Names of the counters of every operation
+OPERATION_COUNTERS = ('calls', 'errors', 'attempts', 'retries', 'throttles',
+                      'bytes_sent', 'bytes_received')
+# Names of the counters of every facade method
+METHOD_COUNTERS = ('calls', 'errors', 'api_calls')
+
+DEFAULT_LOGGER = logging.getLogger(__name__)
+
+
+class _Histogram(object):
+    """A latency histogram with cumulative buckets"""
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': [[bound, count] for bound, count
+                            in zip(LATENCY_BUCKETS, self.counts)]}
+
+
+class _Stats(object):
+    """Counters and latency histogram of an operation or a method"""
+    __slots__ = ('counters', 'latency')
+
+    def __init__(self, counters):
+        self.counters = dict.fromkeys(counters, 0)
+        self.latency = _Histogram()
+
+    def snapshot(self):
+        return dict(self.counters, latency=self.latency.snapshot())
+
+
+class Metrics(object):
+    """A thread-safe registry of metrics about the API calls of facades.
+
+    For every service and operation it counts the calls, the errors, the
+    HTTP attempts, the retries and throttled attempts, and the bytes sent
+    and received, and keeps a histogram of the call latencies. The calls of
+    the facade methods decorated with timed are recorded too, along with the
+    number of API calls they made.
+
+    :param sinks: Objects with an emit(snapshot) method, to which report
+        sends the metrics.
+    """
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self._operations = {}
+        self._methods = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def register(self, client):
+        """Records the API calls made with a botocore client"""
+        events = client.meta.events
+        unique_id = 'boto3facade-metrics-{}'.format(id(self))
+        # The call starts before any other handler can answer it
+        events.register_first('before-call.*.*', self._before_call,
+                              unique_id=unique_id + '-before')
+        events.register('after-call.*.*', self._after_call,
+                        unique_id=unique_id + '-after')
+        events.register('after-call-error.*.*', self._after_call_error,
+                        unique_id=unique_id + '-error')
+        events.register('request-created.*.*', self._request_created,
+                        unique_id=unique_id + '-request')
+        events.register('needs-retry.*.*', self._needs_retry,
+                        unique_id=unique_id + '-retry')
+        return client
+
+    def snapshot(self):
+        """Produces a copy of the metrics recorded so far.
+
+        The snapshot is a dict with an 'operations' dict of
+        {service: {operation: stats}} and a 'methods' dict of
+        {method: stats}. The stats are counters and a 'latency' histogram.
+        """
+        with self._lock:
+            operations = {}
+            for (service, operation), stats in self._operations.items():
+                operations.setdefault(service, {})[operation] = \
+                    stats.snapshot()
+            methods = {name: stats.snapshot()
+                       for name, stats in self._methods.items()}
+        return {'operations': operations, 'methods': methods}
+
+    def reset(self):
+        """Forgets all the metrics recorded so far"""
+        with self._lock:
+            self._operations.clear()
+            self._methods.clear()
+
+    def report(self):
+        """Sends a snapshot of the metrics to every sink"""
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.emit(snapshot)
+        return snapshot
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Records a call of a facade method (or any other block of code)"""
+        stack = self._method_stack()
+        stack.append(name)
+        start = time.time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            stack.pop()
+            with self._lock:
+                stats = self._method_stats(name)
+                stats.counters['calls'] += 1
+                stats.counters['errors'] += failed
+                stats.latency.observe(time.time() - start)
+
+    def _method_stack(self):
+        """The methods being timed in the current thread, innermost last"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _method_stats(self, name):
+        stats = self._methods.get(name)
+        if stats is None:
+            stats = self._methods[name] = _Stats(METHOD_COUNTERS)
+        return stats
+
+    def _operation_stats(self, event_name):
+        key = tuple(event_name.split('.')[1:3])
+        stats = self._operations.get(key)
+        if stats is None:
+            stats = self._operations[key] = _Stats(OPERATION_COUNTERS)
+        return stats
+
+    def _before_call(self, context, **kwargs):
+        context['metrics_start'] = time.time()
+
+    def _end_call(self, event_name, context, failed):
+        latency = time.time() - context.pop('metrics_start', time.time())
+        stack = self._method_stack()
+        with self._lock:
+            stats = self._operation_stats(event_name)
+            stats.counters['calls'] += 1
+            stats.counters['errors'] += failed
+            stats.latency.observe(latency)
+            if stack:
+                self._method_stats(stack[-1]).counters['api_calls'] += 1
+
+    def _after_call(self, event_name, http_response, parsed, context,
+                    **kwargs):
+        self._end_call(event_name, context,
+                       failed=http_response.status_code >= 300)
+
+    def _after_call_error(self, event_name, context, **kwargs):
+        self._end_call(event_name, context, failed=True)
+
+    def _request_created(self, event_name, request, **kwargs):
+        nb_bytes = _body_size(request.body)
+        with self._lock:
+            self._operation_stats(event_name).counters['bytes_sent'] += \
+                nb_bytes
+
+    def _needs_retry(self, event_name, response, operation, attempts,
+                     **kwargs):
+        # Called after every HTTP attempt, including the last one
+        nb_bytes, throttled = 0, False
+        if response is not None:
+            http, parsed = response
+            nb_bytes = _response_size(http, operation)
+            code = parsed.get('Error', {}).get('Code')
+            throttled = code in THROTTLING_ERRORS
+        with self._lock:
+            counters = self._operation_stats(event_name).counters
+            counters['attempts'] += 1
+            counters['retries'] += attempts > 1
+            counters['throttles'] += throttled
+            counters['bytes_received'] += nb_bytes
+
+
+def timed(method):
+    """Decorates a facade method so that its calls are recorded in the
+    metrics of the facade, if it has any"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = getattr(self, 'metrics', None)
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        name = '{}.{}'.format(type(self).__name__, method.__name__)
+        with metrics.timer(name):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class LoggingSink(object):
+    """Logs a line for every operation and method in a snapshot"""
+    def __init__(self, logger=DEFAULT_LOGGER, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def emit(self, snapshot):
+        for name, stats in _flatten(snapshot):
+            latency = stats['latency']
+            mean = latency['sum'] / latency['count'] if latency['count'] \
+                else 0
+            counters = ' '.join('{}={}'.format(k, v)
+                                for k, v in sorted(stats.items())
+                                if k != 'latency')
+            self.logger.log(self.level, "%s %s mean_latency=%.3fs", name,
+                            counters, mean)
+
+
+class StatsdSink(object):
+    """Sends metrics to a StatsD server over UDP.
+
+    Counters are sent as increments since the previous report, and the mean
+    latency over that period as a timing in milliseconds.
+    """
+    def __init__(self, host='localhost', port=8125, prefix='boto3facade'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._previous = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, snapshot):
+        lines = []
+        for name, stats in _flatten(snapshot):
+            previous = self._previous.get(name, {})
+            for counter, value in sorted(stats.items()):
+                if counter == 'latency':
+                    continue
+                delta = value - previous.get(counter, 0)
+                if delta:
+                    lines.append('{}.{}.{}:{}|c'.format(self.prefix, name,
+                                                        counter, delta))
+            latency = stats['latency']
+            old = previous.get('latency', {'count': 0, 'sum': 0.0})
+            count = latency['count'] - old['count']
+            if count > 0:
+                mean = (latency['sum'] - old['sum']) / count
+                lines.append('{}.{}.latency:{:.3f}|ms'.format(
+                    self.prefix, name, mean * 1000))
+            self._previous[name] = stats
+        # Keep datagrams small enough to not be fragmented
+        for batch in utils.chunked(lines, 10):
+            self._socket.sendto('\n'.join(batch).encode('utf-8'),
+                                self.address)
+
+
+class PrometheusSink(object):
+    """Writes metrics to a file in the Prometheus text format, e.g. for the
+    textfile collector of the node exporter"""
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, snapshot):
+        utils.atomic_write(self.path, to_prometheus(snapshot))
+
+
+def to_prometheus(snapshot, prefix='boto3facade'):
+    """Formats a snapshot in the Prometheus text exposition format"""
+    lines = []
+    for kind, counters, label_names in (
+            ('operation', OPERATION_COUNTERS, ('service', 'operation')),
+            ('method', METHOD_COUNTERS, ('method',))):
+        series = [(dict(zip(label_names, key)), stats)
+                  for key, stats in _series(snapshot, kind)]
+        for counter in counters:
+            metric = '{}_{}_{}_total'.format(prefix, kind, counter)
+            lines.append('# TYPE {} counter'.format(metric))
+            for labels, stats in series:
+                lines.append('{}{{{}}} {}'.format(metric, _labels(labels),
+                                                  stats[counter]))
+        metric = '{}_{}_latency_seconds'.format(prefix, kind)
+        lines.append('# TYPE {} histogram'.format(metric))
+        for labels, stats in series:
+            latency = stats['latency']
+            for bound, count in latency['buckets']:
+                lines.append('{}_bucket{{{}}} {}'.format(
+                    metric, _labels(dict(labels, le=repr(bound))), count))
+            lines.append('{}_bucket{{{}}} {}'.format(
+                metric, _labels(dict(labels, le='+Inf')), latency['count']))
+            lines.append('{}_sum{{{}}} {}'.format(metric, _labels(labels),
+                                                  latency['sum']))
+            lines.append('{}_count{{{}}} {}'.format(metric, _labels(labels),
+                                                    latency['count']))
+    return '\n'.join(lines) + '\n'
+
+
+# The registry used by the facades unless they are given another one
+default_metrics = Metrics()
+
+
+def _series(snapshot, kind):
+    """Produces (label values, stats) for the operations or methods"""
+    if kind == 'operation':
+        for service, operations in sorted(snapshot['operations'].items()):
+            for operation, stats in sorted(operations.items()):
+                yield (service, operation), stats
+    else:
+        for method, stats in sorted(snapshot['methods'].items()):
+            yield (method,), stats
+
+
+def _flatten(snapshot):
+    """Produces (dotted name, stats) for every operation and method"""
+    for key, stats in _series(snapshot, 'operation'):
+        yield '.'.join(key), stats
+    for key, stats in _series(snapshot, 'method'):
+        yield key[0], stats
+
+
+def _labels(labels):
+    """Formats the labels of a Prometheus sample"""
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                     .replace('"', '\\"'))
+                    for k, v in sorted(labels.items()))
+
+
+def _body_size(body):
+    """Number of bytes in the body of a request"""
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    # A file-like object
+    try:
+        return os.fstat(body.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def _response_size(http, operation):
+    """Number of bytes in the body of a response"""
+    length = http.headers.get('content-length')
+    if length is not None and length.isdigit():
+        return int(length)
+    if operation.has_streaming_output:
+        return 0
+    return len(http.content or b'')
@@ -1,7 +1,6 @@
 """Redshift facade."""
 
 
-from . import ec2
 from .aws import AwsFacade
 from .exceptions import CredentialsError
 
@@ -31,12 +30,19 @@ class Redshift(AwsFacade):
                        if c["ClusterIdentifier"] == identifier],
                       key=lambda c: c["SnapshotCreateTime"], reverse=True)
 
+    def wait_for_clusters(self, identifiers, state='available',
+                          timeout=None):
+        """Produces futures of the clusters reaching a state: available or
+        deleted"""
+        return self.wait_for('cluster_' + state, identifiers, timeout)
+
     def get_subnet_group_by_name(self, name, **kwargs):
         """Get the Redshift subnet group with the given name"""
         raise NotImplementedError()
 
     def get_copy_credentials(self):
         """Produce the credentials parameter for the copy command"""
+        from . import ec2
         # Attempt to get temporary (role) creds
         creds = ec2.get_temporary_credentials()
         if creds is not None:
@@ -1,11 +1,44 @@
 """S3 facade."""
 
+from collections import deque, namedtuple
+import calendar
+import time
+
 from .aws import AwsFacade
 from .utils import log_exception
+from . import utils
 
 from botocore.exceptions import ClientError
 
 
+# Maximum number of keys accepted by a single DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+# Number of DeleteObjects requests that are sent concurrently
+DELETE_WORKERS = 10
+# Number of attempts made to delete a key that fails with a transient error
+DELETE_MAX_ATTEMPTS = 5
+# Per-key error codes in a DeleteObjects response that are worth retrying
+RETRIABLE_DELETE_ERRORS = {'InternalError', 'ServiceUnavailable', 'SlowDown',
+                           'RequestTimeout', 'OperationAborted'}
+# Number of shards that are listed concurrently by S3.iter_objects
+LIST_WORKERS = 10
+# Shard discovery stops once there are these many shards per worker
+SHARDS_PER_WORKER = 4
+# Levels with more keys and prefixes than this are not split any further
+LEVEL_MAX_KEYS = 1000
+# Larger than any character of a key, so that prefix + KEY_END is larger
+# than all the keys under prefix
+KEY_END = chr(0x10ffff)
+
+
+DeleteResult = namedtuple('DeleteResult', 'deleted errors')
+# The rest of a level that had too many keys to be split, which is listed
+# from the continuation token where its splitting stopped. All its keys are
+# larger than after.
+_LevelRest = namedtuple('_LevelRest', 'prefix delimiter token after')
+ObjectRecord = namedtuple('ObjectRecord', 'key size etag mtime')
+
+
 class S3(AwsFacade):
     @property
     def service(self):
@@ -19,3 +52,249 @@ class S3(AwsFacade):
     def exists(s3_bucket, s3_key):
         """Returns True if a key exists in a bucket"""
         pass
+
+    def delete_many(self, s3_bucket, keys, max_workers=DELETE_WORKERS,
+                    max_attempts=DELETE_MAX_ATTEMPTS):
+        """Deletes keys from a bucket using batched DeleteObjects requests.
+
+        :param keys: An iterable of key names, (key, version_id) tuples or
+            {'Key': ..., 'VersionId': ...} dicts. It is consumed lazily.
+        :param max_workers: Number of batches that are deleted concurrently.
+        :param max_attempts: Attempts made for keys that fail transiently.
+
+        Returns a DeleteResult with the number of deleted keys and the list
+        of per-key errors (dicts with Key, VersionId, Code and Message).
+        """
+        def delete_batch(objects):
+            return self._delete_batch(s3_bucket, objects, max_attempts)
+
+        batches = utils.chunked((_delete_spec(k) for k in keys),
+                                DELETE_BATCH_SIZE)
+        deleted, errors = 0, []
+        for result in utils.parallel_map(delete_batch, batches,
+                                         max_workers=max_workers):
+            deleted += result.deleted
+            errors += result.errors
+        if errors:
+            msg = "Failed to delete {} keys from bucket {}".format(
+                len(errors), s3_bucket)
+            self.config.logger.error(msg)
+        return DeleteResult(deleted, errors)
+
+    def delete_prefix(self, s3_bucket, prefix, all_versions=False, **kwargs):
+        """Deletes every key under a prefix.
+
+        :param all_versions: If True every version and delete marker under
+            the prefix is deleted too, so that nothing is left behind in
+            versioned buckets.
+
+        The listing is streamed and deleted as it is produced. Additional
+        keyword arguments are passed to delete_many.
+        """
+        if all_versions:
+            keys = self._iter_versions(s3_bucket, prefix)
+        else:
+            keys = self._iter_keys(s3_bucket, prefix)
+        return self.delete_many(s3_bucket, keys, **kwargs)
+
+    def _iter_keys(self, s3_bucket, prefix):
+        """Produces the names of all keys under a prefix"""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key']
+
+    def _iter_versions(self, s3_bucket, prefix):
+        """Produces (key, version_id) for all versions under a prefix"""
+        paginator = self.client.get_paginator('list_object_versions')
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+            for obj in page.get('Versions', []) + \
+                    page.get('DeleteMarkers', []):
+                yield obj['Key'], obj['VersionId']
+
+    def iter_objects(self, s3_bucket, prefix='', delimiter='/',
+                     max_workers=LIST_WORKERS, ordered=False, compact=False):
+        """Lists all the objects under a prefix using parallel listings.
+
+        The key space is first split into disjoint shards using delimiter
+        listings. The shards are then listed concurrently and merged into a
+        single stream of objects.
+
+        :param ordered: If True objects are produced in lexicographic order
+            of their keys, as a sequential listing would.
+        :param compact: If True objects are produced as ObjectRecord tuples
+            (key, size, etag, mtime) instead of response dicts. The mtime is
+            a POSIX timestamp.
+        """
+        shards = self._discover_shards(s3_bucket, prefix, delimiter,
+                                       max_shards=SHARDS_PER_WORKER *
+                                       max_workers)
+        if not ordered:
+            # Objects found during discovery go into as few pages as possible
+            shards.sort(key=lambda shard: isinstance(shard, dict))
+
+        def producers():
+            # Consecutive objects found during discovery are grouped in pages
+            # so that they are handed over as a single item
+            objects = []
+            for shard in shards:
+                if isinstance(shard, dict):
+                    objects.append(shard)
+                    continue
+                if objects:
+                    yield _static_pages(utils.chunked(objects,
+                                                      LEVEL_MAX_KEYS))
+                    objects = []
+                if isinstance(shard, _LevelRest):
+                    yield _level_rest_pages(self, s3_bucket, shard)
+                else:
+                    yield _listing_pages(self, s3_bucket, shard)
+            if objects:
+                yield _static_pages(utils.chunked(objects, LEVEL_MAX_KEYS))
+
+        pages = utils.merge_streams(producers(), max_workers=max_workers,
+                                    ordered=ordered)
+        for page in pages:
+            for obj in page:
+                yield _compact_record(obj) if compact else obj
+
+    def _discover_shards(self, s3_bucket, prefix, delimiter, max_shards):
+        """Splits the key space under a prefix into disjoint shards.
+
+        Produces a list sorted by key that contains prefixes (the shards to
+        be listed), the rest of the levels that had too many keys to be
+        split and the object dicts that were found while splitting.
+        """
+        pending = deque([prefix])
+        shards = []
+        nb_prefixes = 0
+        while pending and nb_prefixes + len(pending) < max_shards:
+            current = pending.popleft()
+            objects, prefixes, token = self._list_level(s3_bucket, current,
+                                                        delimiter)
+            shards += objects
+            pending.extend(prefixes)
+            if token is not None:
+                # Too many keys at this level: the rest of it is listed as a
+                # whole, after the keys that have been listed already
+                after = max([o['Key'] for o in objects] +
+                            [p + KEY_END for p in prefixes])
+                shards.append(_LevelRest(current, delimiter, token, after))
+                nb_prefixes += 1
+        shards += pending
+        # A key that is not under a prefix is either smaller or larger than
+        # all the keys under that prefix, so sorting shards and objects by
+        # key keeps the lexicographic order of a sequential listing.
+        return sorted(shards, key=_shard_order)
+
+    def _list_level(self, s3_bucket, prefix, delimiter):
+        """Lists the objects and common prefixes directly under a prefix.
+
+        Stops once more than LEVEL_MAX_KEYS objects and prefixes have been
+        listed.
+        Produces the objects, the prefixes and the continuation token of the
+        rest of the level (None if the whole level has been listed).
+        """
+        objects, prefixes = [], []
+        params = dict(Bucket=s3_bucket, Prefix=prefix, Delimiter=delimiter)
+        while True:
+            page = self.client.list_objects_v2(**params)
+            objects += page.get('Contents', [])
+            prefixes += [p['Prefix'] for p in page.get('CommonPrefixes', [])]
+            token = page.get('NextContinuationToken') \
+                if page.get('IsTruncated') else None
+            if token is None or \
+                    len(objects) + len(prefixes) > LEVEL_MAX_KEYS:
+                return objects, prefixes, token
+            params['ContinuationToken'] = token
+
+    def _delete_batch(self, s3_bucket, objects, max_attempts):
+        """Deletes up to 1000 keys, retrying the keys that fail transiently"""
+        deleted, errors = 0, []
+        for attempt in range(max_attempts):
+            if attempt > 0:
+                time.sleep(utils.backoff_delay(attempt))
+            resp = self.client.delete_objects(
+                Bucket=s3_bucket,
+                Delete={'Objects': objects, 'Quiet': True})
+            failed = resp.get('Errors', [])
+            deleted += len(objects) - len(failed)
+            retriable = [e for e in failed
+                         if e.get('Code') in RETRIABLE_DELETE_ERRORS]
+            errors += [e for e in failed
+                       if e.get('Code') not in RETRIABLE_DELETE_ERRORS]
+            if not retriable:
+                break
+            objects = [_delete_spec((e['Key'], e.get('VersionId')))
+                       for e in retriable]
+        else:
+            errors += retriable
+        return DeleteResult(deleted, errors)
+
+
+def _static_pages(pages):
+    """A shard producer for pages that have already been listed"""
+    pages = list(pages)
+    return lambda: pages
+
+
+def _shard_order(shard):
+    """The position of a shard in a listing ordered by key"""
+    if isinstance(shard, dict):
+        return shard['Key'], 0
+    if isinstance(shard, _LevelRest):
+        return shard.after, 1
+    return shard, 0
+
+
+def _level_rest_pages(s3, s3_bucket, shard):
+    """A shard producer that lists the rest of a level, in order of keys"""
+    def producer():
+        params = dict(Bucket=s3_bucket, Prefix=shard.prefix,
+                      Delimiter=shard.delimiter, ContinuationToken=shard.token)
+        while True:
+            page = s3.client.list_objects_v2(**params)
+            entries = [(o['Key'], o) for o in page.get('Contents', [])] + \
+                [(p['Prefix'], None) for p in page.get('CommonPrefixes', [])]
+            objects = []
+            for key, obj in sorted(entries, key=lambda e: e[0]):
+                if obj is not None:
+                    objects.append(obj)
+                    continue
+                if objects:
+                    yield objects
+                    objects = []
+                for listed in _listing_pages(s3, s3_bucket, key)():
+                    yield listed
+            if objects:
+                yield objects
+            if not page.get('IsTruncated'):
+                return
+            params['ContinuationToken'] = page['NextContinuationToken']
+    return producer
+
+
+def _listing_pages(s3, s3_bucket, prefix):
+    """A shard producer that lists all the objects under a prefix"""
+    def producer():
+        paginator = s3.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+            yield page.get('Contents', [])
+    return producer
+
+
+def _compact_record(obj):
+    """Produces an ObjectRecord from a ListObjectsV2 object dict"""
+    return ObjectRecord(obj['Key'], obj.get('Size'), obj.get('ETag'),
+                        calendar.timegm(obj['LastModified'].utctimetuple()))
+
+
+def _delete_spec(key):
+    """Produces an ObjectIdentifier for a DeleteObjects request"""
+    if isinstance(key, dict):
+        return key
+    if isinstance(key, tuple):
+        key, version_id = key
+        if version_id:
+            return {'Key': key, 'VersionId': version_id}
+    return {'Key': key}
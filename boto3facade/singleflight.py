@@ -0,0 +1,197 @@
+"""Coalescing of identical read-only API calls made concurrently."""
+
+from collections import OrderedDict
+import copy
+import functools
+import json
+import threading
+import time
+
+
+# Prefixes of the operations that are considered read-only
+READ_ONLY_PREFIXES = ('Describe', 'List', 'Get')
+# Operations with a read-only prefix whose calls produce a new result every
+# time, and must not be coalesced
+NOT_COALESCED = frozenset([
+    'GetRandomPassword', 'GetSessionToken', 'GetFederationToken',
+    'GetAuthorizationToken', 'GetCredentialsForIdentity', 'GetOpenIdToken',
+    'GetOpenIdTokenForDeveloperIdentity'])
+# Seconds that a call waits for an identical call in progress. If the call in
+# progress has not completed by then the waiting call is made on its own.
+MAX_WAIT = 300
+# Maximum number of memoized results
+MEMO_MAX_ITEMS = 1000
+
+
+class _Flight(object):
+    """A call in progress, and its outcome once it completes"""
+    def __init__(self):
+        self.done = threading.Event()
+        # Number of calls waiting for the outcome
+        self.waiters = 0
+        self.http = None
+        self.parsed = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Makes concurrent identical read-only calls share a single API call.
+
+    A call is identical to another one in progress when it is made for the
+    same scope (the identity the calls are made as, see AwsFacade.scope),
+    region, service, operation and parameters.
+    The first call is made normally and the others wait for its outcome:
+    they get a copy of its response, or raise the same error.
+
+    Only the operations whose name starts with one of read_only_prefixes,
+    that are not excluded and that do not stream their input or output, are
+    coalesced.
+
+    :param ttl: Seconds during which a successful response is reused by
+        identical calls made after it completed. By default responses are
+        only shared by calls that were in progress at the same time.
+    :param exclude: The names of the operations that are never coalesced.
+    """
+    def __init__(self, ttl=0, max_wait=MAX_WAIT, max_items=MEMO_MAX_ITEMS,
+                 read_only_prefixes=READ_ONLY_PREFIXES,
+                 exclude=NOT_COALESCED):
+        self.ttl = ttl
+        self.read_only_prefixes = tuple(read_only_prefixes)
+        self.exclude = frozenset(exclude)
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self._flights = {}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        # The flights led by the calls in progress in every thread
+        self._local = threading.local()
+
+    def register(self, client, scope=None):
+        """Coalesces the read-only calls made with a botocore client.
+
+        :param scope: Identifies who the client makes its calls as. Calls of
+            clients of different scopes are never coalesced.
+        """
+        events = client.meta.events
+        service_id = client.meta.service_model.service_id.hyphenize()
+        scope = (scope, service_id, client.meta.region_name)
+        unique_id = 'boto3facade-singleflight-{}'.format(id(self))
+
+        def set_key(params, model, context, **kwargs):
+            if self._is_read_only(model):
+                context['singleflight_key'] = (scope, model.name,
+                                               _params_key(params))
+
+        # The handlers run after any other handler, so that a call only
+        # becomes the leader of a flight right before it is sent
+        events.register_last('before-parameter-build.*.*', set_key,
+                             unique_id=unique_id + '-key')
+        events.register_last('before-call.*.*', self._before_call,
+                             unique_id=unique_id + '-before')
+        events.register('after-call.*.*', self._after_call,
+                        unique_id=unique_id + '-after')
+        events.register('after-call-error.*.*', self._after_call_error,
+                        unique_id=unique_id + '-error')
+        # A call can fail after it leads a flight without any event, e.g.
+        # when a later before-call handler raises: its flight is landed
+        # when the call returns
+        client._make_api_call = functools.partial(self._make_api_call,
+                                                  client._make_api_call)
+        return client
+
+    def clear(self):
+        """Forgets all memoized responses"""
+        with self._lock:
+            self._memo.clear()
+
+    def _make_api_call(self, make_api_call, *args, **kwargs):
+        led = self._local.__dict__.setdefault('led', [])
+        depth = len(led)
+        try:
+            return make_api_call(*args, **kwargs)
+        except Exception as error:
+            for key, flight in led[depth:]:
+                if not flight.done.is_set():
+                    self._land(key, flight, error=error)
+            raise
+        finally:
+            del led[depth:]
+
+    def _before_call(self, context, **kwargs):
+        key = context.get('singleflight_key')
+        if key is None:
+            return
+        with self._lock:
+            memoized = self._memo.get(key)
+            if memoized is not None:
+                expires, http, parsed = memoized
+                if expires > time.time():
+                    return http, copy.deepcopy(parsed)
+                del self._memo[key]
+            flight = self._flights.get(key)
+            if flight is None:
+                # This call leads the flight: the API call is made
+                context['singleflight_flight'] = self._flights[key] = \
+                    _Flight()
+                self._local.__dict__.setdefault('led', []).append(
+                    (key, self._flights[key]))
+                return
+            flight.waiters += 1
+        if not flight.done.wait(self.max_wait):
+            with self._lock:
+                # The leader is stuck: later calls do not wait for it
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            return
+        if flight.error is not None:
+            raise flight.error
+        return flight.http, copy.deepcopy(flight.parsed)
+
+    def _after_call(self, http_response, parsed, context, **kwargs):
+        flight = context.pop('singleflight_flight', None)
+        if flight is None:
+            return
+        self._land(context['singleflight_key'], flight, http=http_response,
+                   parsed=parsed, memoize=http_response.status_code < 300)
+
+    def _after_call_error(self, exception, context, **kwargs):
+        flight = context.pop('singleflight_flight', None)
+        if flight is None:
+            return
+        self._land(context['singleflight_key'], flight, error=exception)
+
+    def _land(self, key, flight, http=None, parsed=None, error=None,
+              memoize=False):
+        """Completes a flight and releases the calls waiting for it"""
+        memoize = memoize and self.ttl > 0
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            # No call joins the flight from now on
+            shared = flight.waiters > 0 or memoize
+        flight.http, flight.error = http, error
+        if shared and parsed is not None:
+            # The caller of the flight may change the response it gets
+            flight.parsed = copy.deepcopy(parsed)
+        if memoize:
+            with self._lock:
+                now = time.time()
+                self._memo[key] = (now + self.ttl, flight.http, flight.parsed)
+                self._memo.move_to_end(key)
+                # Entries are stored in order of expiration
+                while self._memo and (len(self._memo) > self.max_items or
+                                      next(iter(self._memo.values()))[0] <=
+                                      now):
+                    self._memo.popitem(last=False)
+        flight.done.set()
+
+    def _is_read_only(self, model):
+        """True if an operation can be coalesced"""
+        return model.name.startswith(self.read_only_prefixes) and \
+            model.name not in self.exclude and \
+            not model.has_streaming_input and not model.has_streaming_output
+
+
+def _params_key(params):
+    """A hashable representation of the parameters of a call"""
+    return json.dumps(params, sort_keys=True, default=repr)
@@ -1,7 +1,29 @@
 """Common utilities."""
 
+import base64
+from collections import deque
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import contextvars
+import datetime
+import functools
+import json
+import os
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+
 import inflection
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: file locks are not supported
+    fcntl = None
+
 
 def log_exception(exception):
     def log_exception_decorator(func):
@@ -48,3 +70,351 @@ def property_filter(key, value):
         else:
             return getattr(r, inflection.underscore(key)) == value
     return filtfunc
+
+
+def parse_bool(value):
+    """Parses a boolean configuration value such as yes, off, true or 0"""
+    states = {'1': True, 'yes': True, 'true': True, 'on': True,
+              '0': False, 'no': False, 'false': False, 'off': False}
+    try:
+        return states[str(value).strip().lower()]
+    except KeyError:
+        raise ValueError("Not a boolean: {}".format(value))
+
+
+def chunked(iterable, size):
+    """Splits an iterable into lists of at most size elements"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def backoff_delay(attempt, base=0.05, cap=5.0):
+    """Produces a jittered exponential backoff delay (in seconds)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def submit(executor, func, *args, **kwargs):
+    """Submits a call to a pool of threads, to run in a copy of the context
+    of the caller so that the active budgets count its API calls"""
+    from .budget import hand_over
+    context = contextvars.copy_context()
+    context.run(hand_over)
+    return executor.submit(context.run, func, *args, **kwargs)
+
+
+def parallel_map(func, iterable, max_workers=10, ordered=False):
+    """Applies func to every item of iterable using a pool of threads.
+
+    The iterable is consumed lazily: at most 2 * max_workers items are in
+    flight at any given time, so arbitrarily long streams can be processed
+    in constant memory. Results are produced in completion order, unless
+    ordered is True.
+    """
+    max_pending = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(submit(executor, func, item))
+            if len(pending) < max_pending:
+                continue
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield future.result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Failure(object):
+    """Carries an exception raised by a producer thread to the consuming
+    thread"""
+    def __init__(self, error):
+        self.error = error
+
+
+class _Done(object):
+    """Signals that a producer has produced all its items"""
+    pass
+
+
+def put_unless_stopped(out, item, stop):
+    """Puts an item in a bounded queue unless the consumer has stopped.
+
+    :param stop: An event that is set when the consumer stops consuming.
+
+    Produces False if the item was not put because the consumer stopped.
+    """
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _run_producer(producer, out, stop):
+    """Hands over the items of a producer to a consumer through a queue"""
+    if stop.is_set():
+        return
+    try:
+        for item in producer():
+            if not put_unless_stopped(out, item, stop):
+                return
+    except Exception as error:
+        put_unless_stopped(out, Failure(error), stop)
+    put_unless_stopped(out, _Done(), stop)
+
+
+def _report_failure(future, out, stop):
+    """Hands over the error of a producer that could not be run at all, e.g.
+    because it could not be pickled"""
+    if not future.cancelled() and future.exception() is not None:
+        put_unless_stopped(out, Failure(future.exception()), stop)
+
+
+def merge_streams(producers, max_workers=10, ordered=False, maxsize=100,
+                  processes=False):
+    """Runs producers concurrently and merges their output in one stream.
+
+    :param producers: An iterable of callables, each of them returning an
+        iterable of items. Every producer runs in a thread of a pool of
+        max_workers threads and hands its items over through a queue that
+        holds at most maxsize items, so that fast producers block instead
+        of exhausting memory.
+    :param ordered: If True the items of a producer are all produced before
+        the items of the next one (in the order of producers), while the
+        next max_workers - 1 producers are already prefetching. Otherwise
+        items are produced as soon as they are available.
+    :param processes: If True producers run in a pool of processes instead.
+        Producers and their items must then be picklable.
+
+    Producers are only taken from the iterable when a worker is free to run
+    them, so it may be long and lazy.
+
+    Exceptions raised by a producer are re-raised in the consuming thread.
+    """
+    if processes:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        manager = multiprocessing.Manager()
+        make_queue, stop = manager.Queue, manager.Event()
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        # Contexts cannot be handed over to other processes
+        run = executor.submit
+    else:
+        manager = None
+        make_queue, stop = queue.Queue, threading.Event()
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        run = functools.partial(submit, executor)
+
+    def consume(out):
+        item = out.get()
+        if isinstance(item, Failure):
+            raise item.error
+        return item
+
+    producers = iter(producers)
+    try:
+        if ordered:
+            window = deque()
+
+            def start_next():
+                producer = next(producers, None)
+                if producer is not None:
+                    window.append(make_queue(maxsize))
+                    run(
+                        _run_producer, producer, window[-1], stop
+                    ).add_done_callback(functools.partial(
+                        _report_failure, out=window[-1], stop=stop))
+
+            for _ in range(max_workers):
+                start_next()
+            while window:
+                item = consume(window[0])
+                if isinstance(item, _Done):
+                    window.popleft()
+                    start_next()
+                else:
+                    yield item
+        else:
+            out = make_queue(maxsize)
+
+            def start_next():
+                producer = next(producers, None)
+                if producer is None:
+                    return 0
+                run(
+                    _run_producer, producer, out, stop
+                ).add_done_callback(functools.partial(
+                    _report_failure, out=out, stop=stop))
+                return 1
+
+            running = sum(start_next() for _ in range(max_workers))
+            while running:
+                item = consume(out)
+                if isinstance(item, _Done):
+                    running += start_next() - 1
+                else:
+                    yield item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+        if manager is not None:
+            manager.shutdown()
+
+
+def to_json_types(obj):
+    """Converts an API response into something that JSON can represent.
+
+    Datetimes and bytes are converted into dicts with a single $datetime or
+    $bytes key.
+    """
+    if isinstance(obj, dict):
+        return {k: to_json_types(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_json_types(v) for v in obj]
+    if isinstance(obj, datetime.datetime):
+        return {'$datetime': obj.isoformat()}
+    if isinstance(obj, (bytes, bytearray)):
+        return {'$bytes': base64.b64encode(obj).decode('ascii')}
+    return obj
+
+
+def from_json_types(obj):
+    """The reverse of to_json_types"""
+    if isinstance(obj, list):
+        return [from_json_types(v) for v in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if len(obj) == 1:
+        (key, value), = obj.items()
+        if key == '$datetime':
+            return datetime.datetime.fromisoformat(value)
+        if key == '$bytes':
+            return base64.b64decode(value)
+    return {k: from_json_types(v) for k, v in obj.items()}
+
+
+def atomic_write(path, text, fsync=False):
+    """Replaces the contents of a file so that readers never see a partial
+    write: the text is written to a temporary file that is then renamed"""
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if os.path.isfile(path):
+            # Keep the permissions of the replaced file
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Holds an exclusive lock on a lock file while in the context.
+
+    The lock is advisory and only excludes other processes (and threads)
+    that use file_lock with the same path. The lock file is removed when
+    the lock is released. It is a no-op on platforms without fcntl.
+    """
+    if fcntl is None:
+        yield
+        return
+    while True:
+        f = open(path, 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                locked = os.path.samestat(os.fstat(f.fileno()),
+                                          os.stat(path))
+            except FileNotFoundError:
+                locked = False
+        except:
+            f.close()
+            raise
+        if locked:
+            break
+        # The previous holder removed the file while we were waiting: lock
+        # the file that is now at the path instead
+        f.close()
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+class FileCheckpointStore(object):
+    """Keeps a dict of checkpoints in a local JSON file.
+
+    Any object with the same load, save and clear methods can be used
+    wherever a checkpoint store is expected.
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+    def load(self):
+        """Produces the saved checkpoints, or an empty dict"""
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, checkpoints):
+        """Saves the checkpoints, replacing the previous ones"""
+        atomic_write(self.path, json.dumps(checkpoints))
+
+    def clear(self):
+        """Removes all saved checkpoints"""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class RateLimiter(object):
+    """A thread-safe token bucket that limits the rate of some operation"""
+    def __init__(self, rate, burst=None):
+        """Allows rate tokens per second, with bursts of up to burst tokens"""
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until the requested number of tokens is available.
+
+        Requests larger than the bucket are allowed once the bucket is full,
+        and are paid back before any other request is allowed.
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._last) * self.rate)
+                self._last = now
+                needed = min(tokens, self.burst)
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                delay = (needed - self._tokens) / self.rate
+            time.sleep(delay)
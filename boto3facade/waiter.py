@@ -0,0 +1,339 @@
+"""Batched waits on the states of AWS resources."""
+
+from collections import namedtuple
+from concurrent.futures import Future
+import logging
+import threading
+import time
+
+from botocore.exceptions import ClientError
+import jmespath
+
+from . import utils
+from .exceptions import AwsError
+
+
+# Default number of seconds after which a wait fails
+WAIT_TIMEOUT = 30 * 60
+# Bounds of the number of seconds between two polls of the same resources
+MIN_INTERVAL = 1
+MAX_INTERVAL = 60
+# Maximum number of resource ids described in one call
+BATCH_SIZE = 100
+
+DEFAULT_LOGGER = logging.getLogger(__name__)
+
+
+WaitSpec = namedtuple('WaitSpec', 'operation id_param items id_field state '
+                                  'success failure missing expected')
+
+
+def wait_spec(operation, id_param, items, id_field, state, success,
+              failure=(), missing=None, expected=60):
+    """Produces the description of a wait on the state of resources.
+
+    :param operation: The describe operation, e.g. describe_instances.
+    :param id_param: The parameter of the operation that takes a list of
+        resource ids, e.g. InstanceIds. If None all the resources are
+        described (page by page) and the waited ones are picked.
+    :param items: A JMESPath expression that produces the described
+        resources from a response, e.g. Reservations[].Instances[].
+    :param id_field: The field of a described resource that holds its id.
+    :param state: A JMESPath expression that produces the state of a
+        described resource, e.g. State.Name.
+    :param success: The states that end the wait successfully.
+    :param failure: The states that make the wait fail.
+    :param missing: 'success' or 'failure' if a resource that is not
+        described ends the wait. By default the wait goes on, since newly
+        created resources may not be described yet.
+    :param expected: The number of seconds a transition usually takes,
+        which sets how often resources are polled.
+    """
+    return WaitSpec(operation, id_param, jmespath.compile(items), id_field,
+                    jmespath.compile(state), frozenset(success),
+                    frozenset(failure), missing, expected)
+
+
+WAITS = {
+    'instance_running': wait_spec(
+        'describe_instances', 'InstanceIds', 'Reservations[].Instances[]',
+        'InstanceId', 'State.Name', ['running'],
+        # Not stopped: right after a start, instances may still be
+        # described as stopped
+        ['shutting-down', 'terminated', 'stopping'], expected=30),
+    'instance_stopped': wait_spec(
+        'describe_instances', 'InstanceIds', 'Reservations[].Instances[]',
+        'InstanceId', 'State.Name', ['stopped'],
+        ['shutting-down', 'terminated'], expected=60),
+    'instance_terminated': wait_spec(
+        'describe_instances', 'InstanceIds', 'Reservations[].Instances[]',
+        'InstanceId', 'State.Name', ['terminated'], missing='success',
+        expected=60),
+    'image_available': wait_spec(
+        'describe_images', 'ImageIds', 'Images[]', 'ImageId', 'State',
+        ['available'], ['failed', 'invalid', 'error', 'deregistered'],
+        expected=300),
+    'snapshot_completed': wait_spec(
+        'describe_snapshots', 'SnapshotIds', 'Snapshots[]', 'SnapshotId',
+        'State', ['completed'], ['error'], expected=600),
+    'cluster_available': wait_spec(
+        'describe_clusters', None, 'Clusters[]', 'ClusterIdentifier',
+        'ClusterStatus', ['available'], ['deleting'], expected=600),
+    'cluster_deleted': wait_spec(
+        'describe_clusters', None, 'Clusters[]', 'ClusterIdentifier',
+        'ClusterStatus', [], missing='success', expected=600),
+    'cluster_snapshot_available': wait_spec(
+        'describe_cluster_snapshots', None, 'Snapshots[]',
+        'SnapshotIdentifier', 'Status', ['available'], ['failed', 'deleted'],
+        expected=600),
+}
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def default_engine():
+    """The waiter engine used by the facades by default"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = WaiterEngine()
+        return _engine
+
+
+class _Group(object):
+    """The pending waits on resources of the same client and spec"""
+    def __init__(self, client, spec):
+        self.client = client
+        self.spec = spec
+        # Resource id -> list of (future, started, deadline)
+        self.waits = {}
+        self.next_poll = 0
+        # Ids that were not found. They are left out of the batched calls,
+        # which they would fail, and described one by one at the longest
+        # interval.
+        self.unknown = set()
+        self.next_unknown_poll = 0
+
+
+class WaiterEngine(object):
+    """Waits on the states of many resources with few describe calls.
+
+    Waits on resources of the same client and spec are grouped, and every
+    resource of a group is polled with the same batched describe calls (up
+    to batch_size ids per call). Resources that are not found are polled
+    one by one, every max_interval. Groups are polled every tenth of the
+    expected transition time, or of the time the oldest wait has lasted
+    when it is longer, within min_interval and max_interval. Polls are made
+    by a background thread, and wait() produces futures.
+    """
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 batch_size=BATCH_SIZE, logger=DEFAULT_LOGGER):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self.logger = logger
+        self._groups = {}
+        self._changed = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def wait(self, client, spec, resource_id, timeout=WAIT_TIMEOUT):
+        """Waits on the state of a resource.
+
+        :param spec: A WaitSpec, or the name of one in WAITS such as
+            instance_running.
+
+        Produces a Future of the last description of the resource (None if
+        it ended the wait by not being described). The future fails with
+        AwsError if the resource reaches a failure state or if the wait
+        times out.
+        """
+        spec = WAITS[spec] if isinstance(spec, str) else spec
+        future = Future()
+        now = time.time()
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("The waiter engine is closed")
+            group = self._groups.get((client, spec))
+            if group is None:
+                group = self._groups[(client, spec)] = _Group(client, spec)
+                # The first poll comes after the shortest interval
+                group.next_poll = now + self.min_interval
+            group.waits.setdefault(resource_id, []).append(
+                (future, now, now + timeout))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._changed.notify()
+        return future
+
+    def close(self):
+        """Stops polling and cancels the pending waits"""
+        with self._changed:
+            self._closed = True
+            groups, self._groups = self._groups, {}
+            self._changed.notify()
+        for group in groups.values():
+            for waits in group.waits.values():
+                for future, _, _ in waits:
+                    future.cancel()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while True:
+                    if self._closed:
+                        return
+                    now = time.time()
+                    due = [g for g in self._groups.values()
+                           if g.next_poll <= now]
+                    if due:
+                        break
+                    next_poll = min((g.next_poll
+                                     for g in self._groups.values()),
+                                    default=None)
+                    self._changed.wait(None if next_poll is None
+                                       else next_poll - now)
+            for group in due:
+                try:
+                    self._poll(group)
+                except Exception as error:
+                    # Failed polls are retried at the next tick
+                    self.logger.warning(
+                        "Failed to poll {}: {}".format(group.spec.operation,
+                                                       error))
+                self._schedule(group)
+
+    def _schedule(self, group):
+        """Sets the time of the next poll of a group, or drops it"""
+        now = time.time()
+        with self._changed:
+            for resource_id, waits in list(group.waits.items()):
+                waits[:] = [w for w in waits if not w[0].done()]
+                for future, _, deadline in waits:
+                    if deadline <= now:
+                        _settle(future, error=AwsError(
+                            "Timed out waiting for {} to reach {}".format(
+                                resource_id, _states(group.spec.success)),
+                            logger=self.logger))
+                waits[:] = [w for w in waits if not w[0].done()]
+                if not waits:
+                    del group.waits[resource_id]
+                    group.unknown.discard(resource_id)
+            if not group.waits:
+                self._groups.pop((group.client, group.spec), None)
+                return
+            age = now - min(w[1] for waits in group.waits.values()
+                            for w in waits)
+            interval = max(group.spec.expected, age) / 10.0
+            group.next_poll = now + min(self.max_interval,
+                                        max(self.min_interval, interval))
+
+    def _poll(self, group):
+        """Describes the resources of a group and ends the waits that are
+        over"""
+        now = time.time()
+        with self._changed:
+            ids = list(group.waits)
+        if group.next_unknown_poll <= now:
+            group.next_unknown_poll = now + self.max_interval
+        else:
+            ids = [i for i in ids if i not in group.unknown]
+        found = {}
+        for item in self._describe(group, ids):
+            found[item.get(group.spec.id_field)] = item
+        for resource_id in ids:
+            item = found.get(resource_id)
+            if item is None:
+                outcome = group.spec.missing
+                state = 'missing'
+            else:
+                state = group.spec.state.search(item)
+                outcome = ('success' if state in group.spec.success else
+                           'failure' if state in group.spec.failure else None)
+            if outcome is not None:
+                self._end(group, resource_id, outcome, item, state)
+
+    def _end(self, group, resource_id, outcome, item, state):
+        """Ends the waits on a resource"""
+        with self._changed:
+            waits = group.waits.get(resource_id, [])
+        for future, _, _ in waits:
+            if outcome == 'success':
+                _settle(future, result=item)
+            else:
+                _settle(future, error=AwsError(
+                    "{} reached state {} instead of {}".format(
+                        resource_id, state, _states(group.spec.success)),
+                    logger=self.logger))
+
+    def _describe(self, group, ids):
+        """Produces the descriptions of the resources of a group"""
+        client, spec = group.client, group.spec
+        method = getattr(client, spec.operation)
+        if spec.id_param is None:
+            if client.can_paginate(spec.operation):
+                pages = client.get_paginator(spec.operation).paginate()
+            else:
+                pages = [method()]
+            for page in pages:
+                for item in spec.items.search(page) or []:
+                    yield item
+            return
+        known = [i for i in ids if i not in group.unknown]
+        for batch in utils.chunked(known, self.batch_size):
+            try:
+                items = spec.items.search(method(**{spec.id_param: batch}))
+            except ClientError as error:
+                if not _not_found(error):
+                    raise
+                # One unknown id fails the whole batch: describe the
+                # resources one by one to find the unknown ones
+                if len(batch) == 1:
+                    group.unknown.update(batch)
+                    items = []
+                else:
+                    items = self._describe_each(group, batch)
+            for item in items or []:
+                yield item
+        for item in self._describe_each(
+                group, [i for i in ids if i in group.unknown]):
+            yield item
+
+    def _describe_each(self, group, ids):
+        """Describes resources one by one, keeping track of the unknown
+        ones"""
+        method = getattr(group.client, group.spec.operation)
+        items = []
+        for resource_id in ids:
+            try:
+                items += group.spec.items.search(
+                    method(**{group.spec.id_param: [resource_id]})) or []
+                group.unknown.discard(resource_id)
+            except ClientError as error:
+                if not _not_found(error):
+                    raise
+                group.unknown.add(resource_id)
+        return items
+
+
+def _settle(future, result=None, error=None):
+    """Sets the outcome of a future, unless the caller has cancelled it"""
+    if future.done() or not future.set_running_or_notify_cancel():
+        return
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+def _not_found(error):
+    """True if an API error is about resources that do not exist (yet)"""
+    return 'NotFound' in error.response.get('Error', {}).get('Code', '')
+
+
+def _states(states):
+    """The description of a set of states in messages"""
+    return ' or '.join(sorted(states)) or 'no state'
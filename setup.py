@@ -31,9 +31,10 @@ setup(
     url="http://github.com/findhotel/boto3facade",
     license="MIT",
     classifiers=[
-        "Programming Language :: Python :: 2",
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
     ],
+    python_requires=">=3.7",
     install_requires=[
         "click>=5.1",
         "boto3",
@@ -43,4 +44,7 @@ setup(
         "wrapt",
         "retrying"
     ],
+    extras_require={
+        "kms": ["cryptography"]
+    },
 )
@@ -0,0 +1,64 @@
+"""Tests the asyncio facades."""
+import asyncio
+import datetime
+
+import pytest
+from botocore.stub import Stubber
+
+from boto3facade import aio
+from boto3facade.cloudformation import Cloudformation
+from boto3facade.ec2 import Ec2
+
+
+def stack(status):
+    return {'StackName': 'stack', 'StackStatus': status,
+            'CreationTime': datetime.datetime(2020, 1, 1)}
+
+
+@pytest.yield_fixture
+def stubbed_cf(random_file_path):
+    cf = Cloudformation(config_file=random_file_path)
+    with Stubber(cf.client) as stubber:
+        yield aio.wrap(cf), stubber
+
+
+def test_properties_and_waiters(stubbed_cf, monkeypatch):
+    monkeypatch.setattr('boto3facade.cloudformation.CACHE_TIMEOUT', -1)
+    acf, stubber = stubbed_cf
+    for status in ('CREATE_IN_PROGRESS', 'CREATE_IN_PROGRESS',
+                   'CREATE_COMPLETE'):
+        stubber.add_response('describe_stacks', {'Stacks': [stack(status)]})
+
+    async def main():
+        statuses = await acf.stack_statuses()
+        assert statuses == {'stack': 'CREATE_IN_PROGRESS'}
+        return await acf.wait_for_status_change(
+            'stack', 'CREATE_IN_PROGRESS', interval=0)
+
+    assert asyncio.run(main()) == 'CREATE_COMPLETE'
+    stubber.assert_no_pending_responses()
+
+
+def test_botocore_waiter(stubbed_cf):
+    acf, stubber = stubbed_cf
+    for status in ('CREATE_IN_PROGRESS', 'CREATE_COMPLETE'):
+        stubber.add_response('describe_stacks', {'Stacks': [stack(status)]},
+                             {'StackName': 'stack'})
+    resp = asyncio.run(acf.wait('stack_create_complete', delay=0,
+                                StackName='stack'))
+    assert resp['Stacks'][0]['StackStatus'] == 'CREATE_COMPLETE'
+
+
+def test_iter_resources_is_paginated(random_file_path):
+    ec2 = Ec2(config_file=random_file_path)
+    aec2 = aio.wrap(ec2)
+    with Stubber(ec2.client) as stubber:
+        stubber.add_response('describe_vpcs', {'Vpcs': [{'VpcId': 'vpc-1'}],
+                                               'NextToken': 'token'})
+        stubber.add_response('describe_vpcs', {'Vpcs': [{'VpcId': 'vpc-2'}]},
+                             {'NextToken': 'token'})
+
+        async def main():
+            return [vpc.id async for vpc in aec2.iter_resources('Vpc')]
+
+        assert asyncio.run(main()) == ['vpc-1', 'vpc-2']
@@ -2,9 +2,11 @@
 """Tests the generic AWS facade."""
 import pytest
 
+from boto3facade import aws, utils
 from boto3facade.ec2 import Ec2
+from boto3facade.kinesis import Kinesis
 from boto3facade.aws import Credentials
-from boto3facade.exceptions import CredentialsError
+from boto3facade.exceptions import CredentialsError, InvalidConfiguration
 
 
 @pytest.fixture
@@ -28,3 +30,59 @@ def test_get_credentials_for_empty_profile(ec2_without_creds, monkeypatch):
     monkeypatch.delenv("AWS_ACCESS_KEY_ID", raising=False)
     with pytest.raises(CredentialsError):
         ec2_without_creds.get_credentials()
+
+
+def test_get_credentials_inherits_default_section(random_file_path, tmpdir,
+                                                  monkeypatch):
+    monkeypatch.delenv('AWS_ACCESS_KEY_ID', raising=False)
+    monkeypatch.setenv('HOME', str(tmpdir))
+    tmpdir.mkdir('.aws').join('credentials').write(
+        '[DEFAULT]\naws_access_key_id = AKIADEFAULT\n'
+        'aws_secret_access_key = secret\n[test]\nregion = eu-west-1\n')
+    facade = Ec2(config_file=random_file_path, active_profile='test')
+    facade.config.set_profile_option('test', 'aws_profile', 'test')
+    assert facade.get_credentials() == ('AKIADEFAULT', 'secret')
+    facade.config.activate_profile('DEFAULT')
+    with pytest.raises(CredentialsError):
+        facade.get_credentials()
+
+
+def test_sessions_share_warm_models(random_file_path, monkeypatch):
+    aws.warm_models(['kinesis'], resources=False)
+
+    def load_file(*args, **kwargs):
+        raise AssertionError("Model loaded from disk")
+
+    monkeypatch.setattr('botocore.loaders.JSONFileLoader.load_file',
+                        load_file)
+    facades = [Kinesis(config_file=random_file_path) for _ in range(2)]
+    loaders = {id(f.session._session.get_component('data_loader'))
+               for f in facades}
+    assert len(loaders) == 1
+    assert facades[0].client.meta.service_model.service_name == 'kinesis'
+
+
+def test_connection_options_from_profile(random_file_path):
+    facade = Kinesis(config_file=random_file_path)
+    facade.config.set_profile_option('default', 'max_pool_connections', '64')
+    facade.config.set_profile_option('default', 'read_timeout', '2.5')
+    facade.config.set_profile_option('default', 'tcp_keepalive', 'yes')
+    config = facade.botocore_config
+    assert config.max_pool_connections == 64
+    assert config.read_timeout == 2.5
+    assert config.tcp_keepalive is True
+    assert config.connect_timeout == 60
+
+
+def test_invalid_connection_option(random_file_path):
+    facade = Kinesis(config_file=random_file_path)
+    facade.config.set_profile_option('default', 'max_pool_connections', 'x')
+    with pytest.raises(InvalidConfiguration):
+        facade.botocore_config
+
+
+def test_client_is_created_once_across_threads(random_file_path):
+    facade = Kinesis(config_file=random_file_path)
+    clients = list(utils.parallel_map(lambda _: facade.client, range(16),
+                                      max_workers=16))
+    assert len({id(c) for c in clients}) == 1
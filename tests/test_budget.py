@@ -0,0 +1,59 @@
+"""Tests the accounting of API calls."""
+import logging
+
+import pytest
+from botocore.stub import Stubber
+
+from boto3facade.budget import Budget
+from boto3facade.cloudformation import Cloudformation
+from boto3facade.exceptions import BudgetExceededError
+from boto3facade.s3 import S3
+
+
+@pytest.yield_fixture
+def stubbed_cf(random_file_path):
+    """A Cloudformation facade that does not see any stack"""
+    cf = Cloudformation(config_file=random_file_path)
+    with Stubber(cf.client) as stubber:
+        for _ in range(5):
+            stubber.add_response('describe_stacks', {'Stacks': []})
+        yield cf
+
+
+def test_calls_are_attributed_to_facade_method(stubbed_cf):
+    with Budget() as budget:
+        assert not stubbed_cf.stack_ok('stack')
+        stubbed_cf.flush_cache()
+        stubbed_cf.client.describe_stacks()
+    report = budget.report()
+    assert report['totals']['calls'] == 5
+    assert report['by_method']['Cloudformation.stack_ok']['calls'] == 4
+    assert report['by_method']['Cloudformation.stack_ok']['pages'] == 4
+    assert report['by_method']['direct']['calls'] == 1
+
+
+def test_budget_raises_when_exceeded(stubbed_cf):
+    with pytest.raises(BudgetExceededError):
+        with Budget(max_calls=2):
+            stubbed_cf.stack_ok('stack')
+
+
+def test_budget_warns_when_exceeded(stubbed_cf, caplog):
+    with caplog.at_level(logging.WARNING):
+        with Budget(max_pages=1, action='warn') as budget:
+            stubbed_cf.stack_ok('stack')
+    assert budget.report()['totals']['pages'] == 4
+    assert caplog.text.count('budget exceeded') == 1
+
+
+def test_calls_of_pool_workers_are_counted(random_file_path):
+    s3 = S3(config_file=random_file_path)
+    with Stubber(s3.client) as stubber:
+        stubber.add_response('list_objects_v2', {
+            'Contents': [{'Key': 'p/a'}], 'IsTruncated': False})
+        stubber.add_response('delete_objects', {})
+        with pytest.raises(BudgetExceededError):
+            with Budget(max_calls=1) as budget:
+                s3.delete_prefix('bucket', 'p/')
+    report = budget.report()
+    assert report['by_method']['S3.delete_prefix']['calls'] == 2
@@ -0,0 +1,58 @@
+"""Tests the recording and replaying of API calls."""
+import datetime
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from dateutil.tz import tzutc
+
+from boto3facade.cassette import Cassette, RECORD, REPLAY
+from boto3facade.exceptions import CassetteError
+from boto3facade.kinesis import Kinesis
+
+
+SUMMARY = {'StreamDescriptionSummary': {
+    'StreamName': 'stream', 'StreamARN': 'arn', 'StreamStatus': 'ACTIVE',
+    'RetentionPeriodHours': 24, 'EnhancedMonitoring': [],
+    'OpenShardCount': 1,
+    'StreamCreationTimestamp': datetime.datetime(2020, 1, 1,
+                                                 tzinfo=tzutc())}}
+
+
+def test_record_and_replay(random_file_path, tmpdir):
+    path = str(tmpdir.join('calls.ndjson.gz'))
+    with Cassette(path, mode=RECORD) as cassette:
+        kinesis = Kinesis(config_file=random_file_path, cassette=cassette)
+        with Stubber(kinesis.client) as stubber:
+            stubber.add_response('describe_stream_summary', SUMMARY,
+                                 {'StreamName': 'stream'})
+            stubber.add_client_error('describe_stream_summary',
+                                     'ResourceNotFoundException',
+                                     expected_params={'StreamName': 'other'})
+            stubber.add_response('get_shard_iterator', {'ShardIterator': 'a'})
+            stubber.add_response('get_shard_iterator', {'ShardIterator': 'b'})
+            recorded = kinesis.client.describe_stream_summary(
+                StreamName='stream')
+            with pytest.raises(ClientError):
+                kinesis.client.describe_stream_summary(StreamName='other')
+            for _ in range(2):
+                kinesis.client.get_shard_iterator(
+                    StreamName='stream', ShardId='0',
+                    ShardIteratorType='LATEST')
+
+    kinesis = Kinesis(config_file=random_file_path,
+                      cassette=Cassette(path, mode=REPLAY, latency_scale=0))
+    replayed = kinesis.client.describe_stream_summary(StreamName='stream')
+    assert replayed['StreamDescriptionSummary'] == \
+        recorded['StreamDescriptionSummary']
+    with pytest.raises(ClientError) as error:
+        kinesis.client.describe_stream_summary(StreamName='other')
+    assert error.value.response['Error']['Code'] == \
+        'ResourceNotFoundException'
+    # Identical calls are replayed in order, then the last one is repeated
+    iterators = [kinesis.client.get_shard_iterator(
+        StreamName='stream', ShardId='0',
+        ShardIteratorType='LATEST')['ShardIterator'] for _ in range(3)]
+    assert iterators == ['a', 'b', 'b']
+    with pytest.raises(CassetteError):
+        kinesis.client.list_streams()
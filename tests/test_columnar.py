@@ -0,0 +1,80 @@
+"""Tests the columnar listings of resources."""
+from botocore.stub import Stubber
+
+from boto3facade.columnar import Listing
+from boto3facade.ec2 import Ec2
+
+
+def _vpc(i, state='available', **tags):
+    return {'VpcId': 'vpc-{}'.format(i), 'State': state, 'IsDefault': i == 0,
+            'CidrBlock': '10.{}.0.0/16'.format(i),
+            'Tags': [{'Key': k, 'Value': v} for k, v in tags.items()]}
+
+
+ITEMS = [_vpc(0, Name='default'), _vpc(1, 'pending', Env='dev'),
+         _vpc(2, Env='dev', Name='two'), _vpc(3, Env='prod')]
+
+
+def test_columns_and_tags():
+    listing = Listing.from_items(ITEMS, ['VpcId', 'State', 'IsDefault'],
+                                 tags=True)
+    assert len(listing) == 4
+    assert listing.column('tag:Env') == [None, 'dev', 'dev', 'prod']
+    assert listing.column('tag:Name') == ['default', None, 'two', None]
+    assert listing.column('IsDefault') == [True, False, False, False]
+    assert list(listing)[2] == {'VpcId': 'vpc-2', 'State': 'available',
+                                'IsDefault': False, 'tag:Name': 'two',
+                                'tag:Env': 'dev'}
+    # Repeated values are stored once
+    assert len(listing._values) < 4 * len(listing.columns)
+
+
+def test_filter_and_group_by():
+    listing = Listing.from_items(ITEMS, ['VpcId', 'State', 'CidrBlock'],
+                                 tags=['Env'])
+    dev = listing.filter({'tag:Env': 'dev'}, State='available')
+    assert dev.column('VpcId') == ['vpc-2']
+    prefixed = listing.filter(CidrBlock=lambda v: v.startswith('10.1'))
+    assert prefixed.column('VpcId') == ['vpc-1']
+    assert len(listing.filter({'tag:Owner': 'me'})) == 0
+    assert len(listing.filter({'tag:Env': None})) == 1
+    groups = listing.group_by('tag:Env')
+    assert {k: v.column('VpcId') for k, v in groups.items()} == {
+        None: ['vpc-0'], 'dev': ['vpc-1', 'vpc-2'], 'prod': ['vpc-3']}
+    assert listing.filter(State='available').count_by('tag:Env') == {
+        None: 1, 'dev': 1, 'prod': 1}
+
+
+def test_get_listing(random_file_path):
+    ec2 = Ec2(config_file=random_file_path)
+    with Stubber(ec2.client) as stubber:
+        stubber.add_response('describe_vpcs', {'Vpcs': ITEMS})
+        listing = ec2.get_listing('Vpc', ['VpcId'], tags=['Name'])
+    assert listing.filter({'tag:Name': 'two'}).column('VpcId') == ['vpc-2']
+
+
+def test_get_listing_of_instances_follows_pages(random_file_path):
+    ec2 = Ec2(config_file=random_file_path)
+    with Stubber(ec2.client) as stubber:
+        stubber.add_response('describe_instances', {
+            'Reservations': [{'Instances': [{'InstanceId': 'i-0'},
+                                            {'InstanceId': 'i-1'}]}],
+            'NextToken': 'page-2'})
+        stubber.add_response('describe_instances', {
+            'Reservations': [{'Instances': [{'InstanceId': 'i-2'}]},
+                             {'Instances': [{'InstanceId': 'i-3'}]}]},
+            {'NextToken': 'page-2'})
+        listing = ec2.get_listing('Instance', ['InstanceId'])
+    assert listing.column('InstanceId') == ['i-0', 'i-1', 'i-2', 'i-3']
+
+
+def test_get_ami_by_tag_listing(random_file_path):
+    ec2 = Ec2(config_file=random_file_path)
+    images = [{'ImageId': 'ami-0', 'Tags': [{'Key': 'Role', 'Value': 'web'}]},
+              {'ImageId': 'ami-1', 'Tags': [{'Key': 'Role', 'Value': 'db'}]},
+              {'ImageId': 'ami-2'}]
+    with Stubber(ec2.client) as stubber:
+        stubber.add_response('describe_images', {'Images': images},
+                             {'Owners': ['self']})
+        listing = ec2.get_ami_by_tag({'Role': 'db'}, fields=['ImageId'])
+    assert listing.column('ImageId') == ['ami-1']
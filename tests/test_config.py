@@ -8,6 +8,8 @@ import tempfile
 import os
 from boto3facade.ec2 import Ec2
 from boto3facade.redshift import Redshift
+import boto3facade.config
+import boto3facade.utils
 from boto3facade.config import Config
 from boto3facade.exceptions import InvalidConfiguration
 
@@ -160,3 +162,67 @@ def test_configure_new_local_profile(configured_config, monkeypatch):
 def test_constructor_with_config_object(vanilla_config):
     rs = Redshift(config=vanilla_config)
     assert rs.config.config_file == vanilla_config.config_file
+
+
+def test_batch_saves_once(vanilla_config, monkeypatch):
+    writes = []
+    atomic_write = boto3facade.utils.atomic_write
+    monkeypatch.setattr('boto3facade.utils.atomic_write',
+                        lambda *args, **kwargs: writes.append(args) or
+                        atomic_write(*args, **kwargs))
+    with vanilla_config.batch():
+        for i in range(5):
+            vanilla_config.set_profile_option('default', 'opt{}'.format(i),
+                                              str(i))
+    assert len(writes) == 1
+    reloaded = Config(config_file=vanilla_config.config_file)
+    assert reloaded.get_profile_option('default', 'opt4') == '4'
+
+
+def test_batch_discards_changes_on_error(vanilla_config):
+    with pytest.raises(ValueError):
+        with vanilla_config.batch():
+            vanilla_config.set_profile_option('default', 'opt', 'value')
+            raise ValueError()
+    assert vanilla_config.get_profile_option('default', 'opt') is None
+    reloaded = Config(config_file=vanilla_config.config_file)
+    assert reloaded.get_profile_option('default', 'opt') is None
+
+
+def test_batch_applies_changes_to_latest_file(vanilla_config):
+    other = Config(config_file=vanilla_config.config_file)
+    other.set_profile_option('default', 'other', 'value')
+    with vanilla_config.batch():
+        vanilla_config.set_profile_option('default', 'opt', 'value')
+    reloaded = Config(config_file=vanilla_config.config_file)
+    assert reloaded.get_profile_option('default', 'other') == 'value'
+    assert reloaded.get_profile_option('default', 'opt') == 'value'
+    assert not os.path.exists(vanilla_config.config_file + '.lock')
+
+
+def test_parsed_files_are_cached(vanilla_config, monkeypatch):
+    path = vanilla_config.config_file
+    data = boto3facade.config.read_ini(path)
+    monkeypatch.setattr('configparser.ConfigParser.read',
+                        lambda *args: pytest.fail("File parsed again"))
+    assert boto3facade.config.read_ini(path) is data
+    Config(config_file=path)
+    # Saving updates the cache instead of forcing a parse
+    vanilla_config.set_profile_option('default', 'opt', 'value')
+    assert boto3facade.config.read_ini(path)['profile:default']['opt'] == \
+        'value'
+
+
+def test_load_merges_the_file_into_the_configuration(vanilla_config):
+    vanilla_config.initialize_profile('unsaved')
+    vanilla_config.load()
+    assert vanilla_config.config.has_section('profile:unsaved')
+
+
+def test_initialize_profile_does_not_write_the_file(vanilla_config):
+    vanilla_config.initialize_profile('unsaved')
+    assert 'profile:unsaved' not in boto3facade.config.read_ini(
+        vanilla_config.config_file)
+    vanilla_config.set_profile_option('other', 'bucket', 'b')
+    assert 'profile:unsaved' in boto3facade.config.read_ini(
+        vanilla_config.config_file)
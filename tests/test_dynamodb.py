@@ -0,0 +1,176 @@
+"""Tests the Dynamodb facade."""
+import os
+import time
+
+import pytest
+from botocore.stub import Stubber
+
+import boto3facade.dynamodb as dynamodb
+from boto3facade import utils
+
+
+@pytest.yield_fixture(scope='function')
+def stubbed_dynamodb(random_file_path):
+    """A Dynamodb facade whose client is stubbed"""
+    obj = dynamodb.Dynamodb(config_file=random_file_path)
+    with Stubber(obj.client) as stubber:
+        yield obj, stubber
+
+
+def test_batch_write_chunks_requests(stubbed_dynamodb):
+    ddb, stubber = stubbed_dynamodb
+    requests = [dynamodb.put_request({'id': str(i)}) for i in range(30)]
+    for batch in (requests[:25], requests[25:]):
+        stubber.add_response('batch_write_item', {},
+                             {'RequestItems': {'table': batch}})
+    result = ddb.batch_write('table', iter(requests), max_workers=1,
+                             key_names=['id'])
+    assert result.written == 30
+    assert result.unprocessed == []
+    stubber.assert_no_pending_responses()
+
+
+def test_batch_write_retries_unprocessed_items(stubbed_dynamodb, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    ddb, stubber = stubbed_dynamodb
+    requests = [dynamodb.put_request({'id': 'a'}),
+                dynamodb.delete_request({'id': 'b'})]
+    stubber.add_response('describe_table', {'Table': {'KeySchema': [
+        {'AttributeName': 'id', 'KeyType': 'HASH'}]}},
+        {'TableName': 'table'})
+    stubber.add_response('batch_write_item',
+                         {'UnprocessedItems': {'table': requests[1:]}})
+    stubber.add_response('batch_write_item', {},
+                         {'RequestItems': {'table': requests[1:]}})
+    result = ddb.batch_write('table', requests, write_capacity=100)
+    assert result.written == 2
+    assert result.unprocessed == []
+
+
+def test_write_batches_enforce_size_limit(monkeypatch):
+    monkeypatch.setattr(dynamodb, 'WRITE_BATCH_MAX_BYTES', 100)
+    requests = [dynamodb.put_request({'id': str(i) * 20}) for i in range(3)]
+    batches = list(dynamodb._write_batches(requests))
+    assert [len(b) for b, _, _ in batches] == [1, 1, 1]
+    too_large = dynamodb.put_request({'id': 'x' * 100})
+    with pytest.raises(ValueError):
+        list(dynamodb._write_batches([too_large]))
+
+
+def test_write_batches_keep_last_write_of_a_key():
+    requests = [dynamodb.put_request({'id': 'a', 'v': 1}),
+                dynamodb.put_request({'id': 'b', 'v': 1}),
+                dynamodb.delete_request({'id': 'a'})]
+    batches = list(dynamodb._write_batches(requests, ['id']))
+    assert batches == [(requests[1:], 2, 0)]
+
+
+def test_write_batches_start_a_round_on_rewritten_keys():
+    requests = [dynamodb.put_request({'id': str(i)}) for i in range(60)]
+    requests.append(dynamodb.delete_request({'id': '3'}))
+    batches = list(dynamodb._write_batches(requests, ['id']))
+    assert [(len(b), r) for b, _, r in batches] == [(25, 0), (25, 0),
+                                                    (11, 1)]
+
+
+def test_batch_write_orders_writes_to_the_same_key(stubbed_dynamodb):
+    ddb, _ = stubbed_dynamodb
+    requests = [dynamodb.put_request({'id': str(i), 'v': 1})
+                for i in range(26)]
+    requests.append(dynamodb.put_request({'id': '0', 'v': 2}))
+    sent = []
+
+    def write_batch(table_name, batch, limiter, max_attempts):
+        if len(batch[0]) == 25:
+            # The first batch is the slowest
+            time.sleep(0.2)
+        sent.append(batch[0])
+        return dynamodb.BatchWriteResult(len(batch[0]), [])
+
+    ddb._write_batch = write_batch
+    result = ddb.batch_write('table', requests, key_names=['id'])
+    assert result.written == 27
+    assert sent == [requests[:25], requests[25:]]
+
+
+def test_parallel_scan(stubbed_dynamodb, random_file_path):
+    ddb, stubber = stubbed_dynamodb
+    checkpoint_file = random_file_path + '.scan'
+    params = {'TableName': 'table', 'Segment': 0, 'TotalSegments': 1,
+              'ProjectionExpression': 'id'}
+    stubber.add_response('scan', {'Items': [{'id': {'N': '1'}}],
+                                  'LastEvaluatedKey': {'id': {'N': '1'}}},
+                         params)
+    stubber.add_response('scan', {'Items': [{'id': {'N': '2'}}]},
+                         dict(params, ExclusiveStartKey={'id': {'N': '1'}}))
+    items = list(ddb.parallel_scan('table', segments=1,
+                                   checkpoint_file=checkpoint_file,
+                                   ProjectionExpression='id'))
+    assert items == [{'id': 1}, {'id': 2}]
+    assert not os.path.isfile(checkpoint_file)
+
+
+def test_parallel_scan_resumes_from_checkpoint(stubbed_dynamodb,
+                                               random_file_path):
+    ddb, stubber = stubbed_dynamodb
+    store = utils.FileCheckpointStore(random_file_path + '.scan')
+    store.save({'table': 'table', 'segments': 2, 'done': [0],
+                'last_keys': {'1': {'id': {'B': 'YQ=='}}}})
+    stubber.add_response('scan', {'Items': [{'id': {'S': 'b'}}]},
+                         {'TableName': 'table', 'Segment': 1,
+                          'TotalSegments': 2,
+                          'ExclusiveStartKey': {'id': {'B': b'a'}}})
+    items = list(ddb.parallel_scan('table', segments=2,
+                                   checkpoint_file=store.path))
+    assert items == [{'id': 'b'}]
+    stubber.assert_no_pending_responses()
+
+
+def test_get_many_deduplicates_and_caches(random_file_path):
+    cache = dynamodb.ReadCache(table_limits={'table': 10})
+    ddb = dynamodb.Dynamodb(config_file=random_file_path, cache=cache)
+    with Stubber(ddb.client) as stubber:
+        stubber.add_response(
+            'batch_get_item',
+            {'Responses': {'table': [{'id': {'S': 'a'}, 'v': {'N': '1'}}]}},
+            {'RequestItems': {'table': {'Keys': [{'id': {'S': 'a'}},
+                                                 {'id': {'S': 'b'}}]}}})
+        result = ddb.get_many('table',
+                              [{'id': 'a'}, {'id': 'b'}, {'id': 'a'}])
+        assert result.items == [{'id': 'a', 'v': 1}, None,
+                                {'id': 'a', 'v': 1}]
+        assert result.unprocessed == []
+        # Modifying a produced item does not modify the cached one
+        result.items[0]['v'] = 2
+        # Served from the cache: no additional API calls
+        assert ddb.get_many('table', [{'id': 'b'}, {'id': 'a'}]).items == \
+            [None, {'id': 'a', 'v': 1}]
+    stats = cache.stats()['table']
+    assert (stats['hits'], stats['misses'], stats['size']) == (2, 2, 2)
+
+
+def test_get_many_reports_unprocessed_keys(random_file_path, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    cache = dynamodb.ReadCache()
+    ddb = dynamodb.Dynamodb(config_file=random_file_path, cache=cache)
+    with Stubber(ddb.client) as stubber:
+        stubber.add_response(
+            'batch_get_item',
+            {'Responses': {'table': [{'id': {'S': 'a'}}]},
+             'UnprocessedKeys': {'table': {'Keys': [{'id': {'S': 'b'}}]}}})
+        result = ddb.get_many('table', [{'id': 'a'}, {'id': 'b'}],
+                              max_attempts=1)
+    assert result == ([{'id': 'a'}, None], [{'id': 'b'}])
+    # Unprocessed keys are not cached as missing items
+    assert cache.get('table', (('id', 'b'),)) is dynamodb.ReadCache.MISS
+
+
+def test_read_cache_evicts_and_expires(monkeypatch):
+    cache = dynamodb.ReadCache(max_items=2, ttl=10)
+    for i in range(3):
+        cache.put('table', i, {'id': i})
+    assert cache.get('table', 0) is dynamodb.ReadCache.MISS
+    assert cache.get('table', 2) == {'id': 2}
+    now = time.time()
+    monkeypatch.setattr('time.time', lambda: now + 11)
+    assert cache.get('table', 2) is dynamodb.ReadCache.MISS
@@ -0,0 +1,60 @@
+"""Tests the streaming export of resource listings."""
+import csv
+import datetime
+import gzip
+import io
+import json
+
+import pytest
+from dateutil.tz import tzutc
+
+from boto3facade import export
+
+
+CREATED = datetime.datetime(2020, 1, 1, tzinfo=tzutc())
+
+
+def _items(n):
+    for i in range(n):
+        yield {'ImageId': 'ami-{}'.format(i), 'CreationDate': CREATED,
+               'State': {'Name': 'available'},
+               'Tags': [{'Key': 'Name', 'Value': 'image{}'.format(i)}]}
+
+
+def test_export_ndjson_gzip(tmpdir):
+    path = str(tmpdir.join('images.ndjson.gz'))
+    assert export.export(_items(3), path, tags=True) == 3
+    with gzip.open(path, 'rt') as f:
+        rows = [json.loads(line) for line in f]
+    assert rows[2]['tag:Name'] == 'image2'
+    assert rows[2]['CreationDate'] == {'$datetime': CREATED.isoformat()}
+    assert 'Tags' not in rows[2]
+
+
+def test_export_csv_projection(tmpdir):
+    path = str(tmpdir.join('images.csv'))
+    assert export.export(_items(2), path, fields=['ImageId', 'State.Name'],
+                         tags=['Name', 'Owner']) == 2
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    assert rows[1] == {'ImageId': 'ami-1', 'State.Name': 'available',
+                       'tag:Name': 'image1', 'tag:Owner': ''}
+
+
+def test_dumps_csv_nested_values():
+    text = export.dumps(_items(1), format='csv')
+    header, row = list(csv.reader(text.splitlines()))
+    assert header == ['ImageId', 'CreationDate', 'State', 'Tags']
+    assert row[1] == CREATED.isoformat()
+    assert json.loads(row[2]) == {'Name': 'available'}
+
+
+def test_export_to_binary_file_objects():
+    f = io.BytesIO()
+    assert export.export(_items(2), f, compression='gzip') == 2
+    assert len(gzip.decompress(f.getvalue()).splitlines()) == 2
+    f = io.BytesIO()
+    export.export(_items(1), f, format='csv')
+    assert f.getvalue().startswith(b'ImageId,')
+    with pytest.raises(ValueError):
+        export.export(_items(1), io.StringIO(), compression='gzip')
@@ -0,0 +1,87 @@
+"""Tests the concurrent queries across accounts and regions."""
+import contextlib
+
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ProfileNotFound
+from botocore.stub import Stubber
+
+from boto3facade.fanout import Fanout, Target
+from boto3facade.kinesis import Kinesis
+from boto3facade.singleflight import SingleFlight
+
+
+class Streams(Kinesis):
+    def stream_names(self, prefix):
+        resp = self.client.list_streams()
+        return (s for s in resp['StreamNames'] if s.startswith(prefix))
+
+
+def test_results_are_tagged_with_their_target(random_file_path):
+    regions = ['eu-west-1', 'us-east-1', 'ap-south-1']
+    targets = [('default', r) for r in regions] + \
+        [('nonexistent-profile', 'eu-west-1')]
+    with Fanout(service_limits={'kinesis': 2},
+                config_file=random_file_path) as pool, \
+            contextlib.ExitStack() as stack:
+        for region in regions:
+            facade = pool.facade(Streams, ('default', region))
+            assert facade.client.meta.region_name == region
+            stubber = stack.enter_context(Stubber(facade.client))
+            stubber.add_response('list_streams', {
+                'StreamNames': ['a-' + region, 'b-' + region],
+                'HasMoreStreams': False})
+        results = {r.target: r for r in pool.run(Streams, 'stream_names',
+                                                  targets, 'a-')}
+    assert set(results) == {Target(*t) for t in targets}
+    for region in regions:
+        result = results[Target('default', region)]
+        assert result.value == ['a-' + region]
+        assert result.error is None
+    failed = results[Target('nonexistent-profile', 'eu-west-1')]
+    assert isinstance(failed.error, ProfileNotFound)
+
+
+class RegionalStreams(Streams):
+    """Streams whose facade cannot be created in us-east-1"""
+    def __init__(self, session=None, **kwargs):
+        if session.region_name == 'us-east-1':
+            raise ValueError("Unsupported region")
+        super().__init__(session=session, **kwargs)
+
+
+def test_service_limits_apply_when_first_target_fails(random_file_path):
+    targets = [('default', 'us-east-1'), ('default', 'eu-west-1')]
+    with Fanout(service_limits={'kinesis': 1},
+                config_file=random_file_path) as pool:
+        facade = pool.facade(RegionalStreams, targets[1])
+        with Stubber(facade.client) as stubber:
+            stubber.add_response('list_streams', {
+                'StreamNames': ['a'], 'HasMoreStreams': False})
+            results = list(pool.run(RegionalStreams, 'stream_names',
+                                    targets, 'a'))
+    assert sorted(type(r.error).__name__ for r in results) == \
+        ['NoneType', 'ValueError']
+    assert list(pool._semaphores) == ['kinesis']
+
+
+def test_shared_stores_are_scoped_per_target(random_file_path, tmpdir,
+                                             monkeypatch):
+    credentials = tmpdir.join('credentials')
+    credentials.write('[a]\naws_access_key_id = AKIAA\n'
+                      'aws_secret_access_key = secret\n'
+                      '[b]\naws_access_key_id = AKIAB\n'
+                      'aws_secret_access_key = secret\n')
+    monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', str(credentials))
+    targets = [('a', 'eu-west-1'), ('b', 'eu-west-1')]
+    with Fanout(max_workers=1, single_flight=SingleFlight(ttl=60),
+                config_file=random_file_path) as pool:
+        for profile, region in targets:
+            # Answers in place of the HTTP request, after the handlers of
+            # the facade
+            pool.facade(Streams, (profile, region)).client.meta.events \
+                .register_last('before-call.*.*', lambda p=profile, **kw: (
+                    AWSResponse('https://kinesis', 200, {}, None),
+                    {'StreamNames': ['a-' + p], 'HasMoreStreams': False}))
+        results = {r.target.profile: r.value for r in
+                   pool.run(Streams, 'stream_names', targets, 'a-')}
+    assert results == {'a': ['a-a'], 'b': ['a-b']}
@@ -0,0 +1,145 @@
+"""Tests the persistent inventory of resources."""
+import datetime
+import threading
+
+from botocore.stub import Stubber
+from dateutil.tz import tzutc
+
+from boto3facade.aws import new_session
+from boto3facade.cloudformation import Cloudformation
+from boto3facade.ec2 import Ec2
+from boto3facade.inventory import Inventory
+
+
+KEY = ('profile', 'eu-west-1', 'Vpc', {'Filters': []})
+CREATED = datetime.datetime(2020, 1, 1, tzinfo=tzutc())
+
+
+def _stack(name, status='CREATE_COMPLETE', **kwargs):
+    """A stack description, or the summary of a stack"""
+    return dict(StackId='arn:' + name, StackName=name, StackStatus=status,
+                CreationTime=CREATED, **kwargs)
+
+
+def test_fetch_is_shared_by_inventories(tmpdir):
+    path = str(tmpdir.join('inventory.db'))
+    calls = []
+
+    def load():
+        calls.append(1)
+        return [{'VpcId': 'vpc-1', 'CreatedAt': CREATED, 'Data': b'x'}]
+
+    first = Inventory(path).fetch(KEY, load)
+    second = Inventory(path).fetch(KEY, load)
+    assert first == second
+    assert second[0]['CreatedAt'] == CREATED
+    assert len(calls) == 1
+    # Other parameters are another entry
+    Inventory(path).fetch(KEY[:3] + ({'Filters': [1]},), load)
+    assert len(calls) == 2
+
+
+def test_stale_entry_is_refreshed_in_background(tmpdir):
+    inventory = Inventory(str(tmpdir.join('inventory.db')), refresh_age=0)
+    inventory.fetch(KEY, lambda: [1])
+    loading = threading.Event()
+
+    def load():
+        loading.wait()
+        return [2]
+
+    # The stale entry is used while it is being refreshed
+    assert inventory.fetch(KEY, load) == [1]
+    loading.set()
+    inventory.join()
+    inventory.refresh_age = 60
+    assert inventory.fetch(KEY, load) == [2]
+    inventory.close()
+
+
+def test_old_entry_is_refreshed_before_use(tmpdir):
+    inventory = Inventory(str(tmpdir.join('inventory.db')), max_age=0)
+    inventory.fetch(KEY, lambda: [1])
+    assert inventory.fetch(KEY, lambda: [2]) == [2]
+    inventory.invalidate(restype='Vpc')
+    assert inventory.fetch(KEY, lambda: [3], max_age=60) == [3]
+
+
+def test_resources_from_inventory(random_file_path, tmpdir):
+    inventory = Inventory(str(tmpdir.join('inventory.db')))
+    vpc = {'VpcId': 'vpc-1', 'CidrBlock': '10.0.0.0/16', 'State': 'available'}
+    for _ in range(2):
+        ec2 = Ec2(config_file=random_file_path, inventory=inventory)
+        with Stubber(ec2.client) as stubber:
+            if _ == 0:
+                stubber.add_response('describe_vpcs', {'Vpcs': [vpc]})
+            vpcs = list(ec2._get_resource('Vpc'))
+            stubber.assert_no_pending_responses()
+        # Attributes are read from the description, without other calls
+        assert [v.cidr_block for v in vpcs] == ['10.0.0.0/16']
+
+
+def test_stacks_are_updated_incrementally(random_file_path, tmpdir):
+    inventory = Inventory(str(tmpdir.join('inventory.db')), refresh_age=0)
+    cf = Cloudformation(config_file=random_file_path, inventory=inventory)
+    updated = datetime.datetime(2020, 2, 1, tzinfo=tzutc())
+    with Stubber(cf.client) as stubber:
+        stubber.add_response('describe_stacks', {'Stacks': [
+            _stack('a'), _stack('b'), _stack('c')]})
+        assert len(cf.stacks) == 3
+        # b has been updated, c deleted and d created since
+        stubber.add_response('list_stacks', {'StackSummaries': [
+            _stack('a'),
+            _stack('b', 'UPDATE_COMPLETE', LastUpdatedTime=updated),
+            _stack('d')]})
+        stubber.add_response('describe_stacks', {'Stacks': [_stack(
+            'b', 'UPDATE_COMPLETE', LastUpdatedTime=updated)]},
+            {'StackName': 'arn:b'})
+        stubber.add_response('describe_stacks', {'Stacks': [_stack('d')]},
+                             {'StackName': 'arn:d'})
+        cf.flush_cache()
+        assert cf.stack_statuses == {'a': 'CREATE_COMPLETE',
+                                     'b': 'UPDATE_COMPLETE',
+                                     'd': 'CREATE_COMPLETE'}
+        stubber.assert_no_pending_responses()
+
+
+def test_stack_changes_refresh_inventory(random_file_path, tmpdir,
+                                         monkeypatch):
+    monkeypatch.setattr('boto3facade.cloudformation.CACHE_TIMEOUT', 0)
+    monkeypatch.setattr('boto3facade.cloudformation.time.sleep',
+                        lambda seconds: None)
+    inventory = Inventory(str(tmpdir.join('inventory.db')))
+    cf = Cloudformation(config_file=random_file_path, inventory=inventory)
+    with Stubber(cf.client) as stubber:
+        stubber.add_response('describe_stacks', {'Stacks': []})
+        stubber.add_response('create_stack', {'StackId': 'arn:s'})
+        stubber.add_response('describe_stacks', {'Stacks': [
+            _stack('s', 'CREATE_IN_PROGRESS')]})
+        stubber.add_response('list_stacks', {'StackSummaries': [
+            _stack('s')]})
+        stubber.add_response('describe_stacks', {'Stacks': [_stack('s')]},
+                             {'StackName': 'arn:s'})
+        cf.create_stack('s', '{}', [], {}, wait=True)
+        stubber.assert_no_pending_responses()
+    assert cf.stack_statuses == {'s': 'CREATE_COMPLETE'}
+
+
+def test_sessions_of_other_accounts_do_not_share_entries(random_file_path,
+                                                         tmpdir):
+    inventory = Inventory(str(tmpdir.join('inventory.db')))
+    vpcs = {}
+    for key_id in ('AKIAFIRST', 'AKIASECOND'):
+        session = new_session(aws_access_key_id=key_id,
+                              aws_secret_access_key='secret',
+                              region_name='eu-west-1')
+        ec2 = Ec2(config_file=random_file_path, session=session,
+                  inventory=inventory)
+        with Stubber(ec2.client) as stubber:
+            stubber.add_response('describe_vpcs', {'Vpcs': [
+                {'VpcId': 'vpc-' + key_id}]})
+            vpcs[key_id] = [v['VpcId'] for v in
+                            ec2._describe_resources('Vpc')]
+            stubber.assert_no_pending_responses()
+    assert vpcs == {'AKIAFIRST': ['vpc-AKIAFIRST'],
+                    'AKIASECOND': ['vpc-AKIASECOND']}
@@ -0,0 +1,218 @@
+"""Tests the Kinesis facade."""
+import itertools
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber, ANY
+
+import boto3facade.kinesis as kinesis
+
+
+@pytest.yield_fixture(scope='function')
+def stubbed_kinesis(random_file_path):
+    """A Kinesis facade whose client is stubbed"""
+    obj = kinesis.Kinesis(config_file=random_file_path)
+    with Stubber(obj.client) as stubber:
+        yield obj, stubber
+
+
+def test_producer_batches_records(stubbed_kinesis):
+    kin, stubber = stubbed_kinesis
+    records = [{'Data': b'a', 'PartitionKey': '1'},
+               {'Data': b'b', 'PartitionKey': '2'}]
+    stubber.add_response(
+        'put_records',
+        {'Records': [{}, {}]},
+        {'StreamName': 'stream', 'Records': records})
+    with kin.producer('stream', linger=60) as producer:
+        producer.put(b'a', '1')
+        producer.put('b', '2')
+    stubber.assert_no_pending_responses()
+    assert producer.failed == []
+
+
+def test_producer_retries_failed_records(stubbed_kinesis, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    kin, stubber = stubbed_kinesis
+    stubber.add_response(
+        'put_records',
+        {'FailedRecordCount': 1,
+         'Records': [{'SequenceNumber': '1', 'ShardId': 's'},
+                     {'ErrorCode': 'ProvisionedThroughputExceededException',
+                      'ErrorMessage': 'Slow down'}]})
+    stubber.add_response(
+        'put_records', {'Records': [{}]},
+        {'StreamName': 'stream',
+         'Records': [{'Data': b'b', 'PartitionKey': '2'}]})
+    with kin.producer('stream', linger=60) as producer:
+        producer.put(b'a', '1')
+        producer.put(b'b', '2')
+    stubber.assert_no_pending_responses()
+
+
+def test_producer_retries_only_transient_errors(stubbed_kinesis,
+                                               monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    kin, stubber = stubbed_kinesis
+    stubber.add_client_error('put_records', 'InternalFailure',
+                             http_status_code=500)
+    stubber.add_response('put_records', {'Records': [{}]})
+    stubber.add_client_error('put_records', 'ResourceNotFoundException',
+                             http_status_code=400)
+    producer = kin.producer('stream', linger=60)
+    producer.put(b'a', '1')
+    producer.flush()
+    producer.put(b'b', '2')
+    with pytest.raises(ClientError):
+        producer.close()
+    stubber.assert_no_pending_responses()
+    assert producer.failed == [{'Data': b'b', 'PartitionKey': '2'}]
+
+
+def test_producer_aggregates_records(stubbed_kinesis):
+    kin, stubber = stubbed_kinesis
+    stubber.add_response(
+        'put_records', {'Records': [{}]},
+        {'StreamName': 'stream',
+         'Records': [{'Data': ANY, 'PartitionKey': '1'}]})
+    with kin.producer('stream', linger=60, aggregate=True) as producer:
+        for i in range(10):
+            producer.put(str(i), str(i % 3 + 1))
+    stubber.assert_no_pending_responses()
+
+
+def test_aggregation_roundtrip():
+    records = [(b'a', '1', None), (b'b', '2', '42'), (b'c', '1', None)]
+    data = kinesis.aggregate_records(records)
+    assert kinesis.deaggregate(data) == records
+    assert kinesis.deaggregate(b'raw', '1') == [(b'raw', '1', None)]
+
+
+def _record(seq, data):
+    return {'SequenceNumber': seq, 'Data': data, 'PartitionKey': 'pk'}
+
+
+def test_consumer_reads_parents_first(stubbed_kinesis, tmpdir, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    kin, stubber = stubbed_kinesis
+    seq_range = {'StartingSequenceNumber': '0'}
+    hash_range = {'StartingHashKey': '0', 'EndingHashKey': '1'}
+    parent = {'ShardId': 'parent', 'HashKeyRange': hash_range,
+              'SequenceNumberRange': seq_range}
+    child = {'ShardId': 'child', 'ParentShardId': 'parent',
+             'HashKeyRange': hash_range, 'SequenceNumberRange': seq_range}
+    stubber.add_response('list_shards', {'Shards': [child, parent]},
+                         {'StreamName': 'stream'})
+    stubber.add_response('get_shard_iterator', {'ShardIterator': 'it1'},
+                         {'StreamName': 'stream', 'ShardId': 'parent',
+                          'ShardIteratorType': 'TRIM_HORIZON'})
+    stubber.add_response('get_records',
+                         {'Records': [_record('1', b'a')]},
+                         {'ShardIterator': 'it1'})
+    # Shards are listed again when a shard ends
+    stubber.add_response('list_shards', {'Shards': [child, parent]},
+                         {'StreamName': 'stream'})
+    stubber.add_response('get_shard_iterator', {'ShardIterator': 'it2'},
+                         {'StreamName': 'stream', 'ShardId': 'child',
+                          'ShardIteratorType': 'TRIM_HORIZON'})
+    stubber.add_client_error('get_records', 'ExpiredIteratorException')
+    stubber.add_response('get_shard_iterator', {'ShardIterator': 'it3'},
+                         {'StreamName': 'stream', 'ShardId': 'child',
+                          'ShardIteratorType': 'TRIM_HORIZON'})
+    stubber.add_response('get_records',
+                         {'Records': [_record('2', b'b')],
+                          'NextShardIterator': 'it4',
+                          'MillisBehindLatest': 0},
+                         {'ShardIterator': 'it3'})
+    stubber.add_response('get_records',
+                         {'Records': [], 'NextShardIterator': 'it5',
+                          'MillisBehindLatest': 0},
+                         {'ShardIterator': 'it4'})
+    consumer = kin.consumer('stream',
+                            checkpoint_store=str(tmpdir.join('shards.json')))
+    records = list(consumer)
+    assert [(r['ShardId'], r['Data']) for r in records] == \
+        [('parent', b'a'), ('child', b'b')]
+    assert consumer.checkpoint_store.load() == {'parent': kinesis.SHARD_END,
+                                                'child': '2'}
+    stubber.assert_no_pending_responses()
+
+
+def test_consumer_follows_resharding(stubbed_kinesis, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    kin, stubber = stubbed_kinesis
+    seq_range = {'StartingSequenceNumber': '0'}
+    hash_range = {'StartingHashKey': '0', 'EndingHashKey': '1'}
+    parent = {'ShardId': 'parent', 'HashKeyRange': hash_range,
+              'SequenceNumberRange': seq_range}
+    stubber.add_response('list_shards', {'Shards': [parent]},
+                         {'StreamName': 'stream'})
+    stubber.add_response('get_shard_iterator', {'ShardIterator': 'it1'},
+                         {'StreamName': 'stream', 'ShardId': 'parent',
+                          'ShardIteratorType': 'TRIM_HORIZON'})
+    stubber.add_response('get_records', {'Records': [_record('1', b'a')]},
+                         {'ShardIterator': 'it1'})
+    # The parent shard was split while it was being read
+    stubber.add_response('list_shards', {'Shards': [parent] + [
+        {'ShardId': name, 'ParentShardId': 'parent',
+         'HashKeyRange': hash_range, 'SequenceNumberRange': seq_range}
+        for name in ('child1', 'child2')]}, {'StreamName': 'stream'})
+    for name in ('child1', 'child2'):
+        stubber.add_response('get_shard_iterator', {'ShardIterator': name},
+                             {'StreamName': 'stream', 'ShardId': name,
+                              'ShardIteratorType': 'TRIM_HORIZON'})
+        stubber.add_response('get_records',
+                             {'Records': [_record('2', b'b')],
+                              'NextShardIterator': 'next'},
+                             {'ShardIterator': name})
+        stubber.add_response('get_records',
+                             {'Records': [], 'NextShardIterator': 'next',
+                              'MillisBehindLatest': 0},
+                             {'ShardIterator': 'next'})
+    records = list(kin.consumer('stream', max_workers=1))
+    assert [(r['ShardId'], r['Data']) for r in records] == \
+        [('parent', b'a'), ('child1', b'b'), ('child2', b'b')]
+    stubber.assert_no_pending_responses()
+
+
+def test_consumer_rotates_open_shards_through_workers(stubbed_kinesis,
+                                                      monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    kin, stubber = stubbed_kinesis
+    seq_range = {'StartingSequenceNumber': '0'}
+    hash_range = {'StartingHashKey': '0', 'EndingHashKey': '1'}
+    shards = [{'ShardId': name, 'HashKeyRange': hash_range,
+               'SequenceNumberRange': seq_range} for name in ('a', 'b')]
+    stubber.add_response('list_shards', {'Shards': shards},
+                         {'StreamName': 'stream'})
+    for name, seq in (('a', '1'), ('b', '2')):
+        stubber.add_response('get_shard_iterator', {'ShardIterator': name},
+                             {'StreamName': 'stream', 'ShardId': name,
+                              'ShardIteratorType': 'TRIM_HORIZON'})
+        stubber.add_response('get_records',
+                             {'Records': [_record(seq, name.encode())],
+                              'NextShardIterator': name + '1',
+                              'MillisBehindLatest': 0},
+                             {'ShardIterator': name})
+        stubber.add_response('get_records',
+                             {'Records': [], 'NextShardIterator': name + '2',
+                              'MillisBehindLatest': 0},
+                             {'ShardIterator': name + '1'})
+    # The first shard is polled again once the second one has caught up
+    stubber.add_response('get_records',
+                         {'Records': [_record('3', b'c')],
+                          'NextShardIterator': 'a3'},
+                         {'ShardIterator': 'a2'})
+    consumer = kin.consumer('stream', stop_at_latest=False, max_workers=1,
+                            poll_interval=0.01)
+    records = list(itertools.islice(consumer, 3))
+    assert [(r['ShardId'], r['Data']) for r in records] == \
+        [('a', b'a'), ('b', b'b'), ('a', b'c')]
+
+
+def test_consumer_deaggregates_records():
+    consumer = kinesis.Consumer(None, 'stream', deaggregate=True)
+    data = kinesis.aggregate_records([(b'a', '1', None), (b'b', '2', None)])
+    records = consumer._unpack('shard', [_record('1', data)])
+    assert [(r['Data'], r['PartitionKey'], r['SubSequenceNumber'])
+            for r in records] == [(b'a', '1', 0), (b'b', '2', 1)]
@@ -0,0 +1,92 @@
+"""Tests the Kms facade."""
+import os
+
+import pytest
+from botocore.stub import Stubber
+
+import boto3facade.kms as kms
+
+
+@pytest.yield_fixture(scope='function')
+def stubbed_kms(random_file_path):
+    """A Kms facade with a data key cache, whose client is stubbed"""
+    obj = kms.Kms(config_file=random_file_path,
+                  cache=kms.DataKeyCache(max_messages=2))
+    with Stubber(obj.client) as stubber:
+        yield obj, stubber
+
+
+def _data_key(blob):
+    return {'KeyId': 'key', 'Plaintext': os.urandom(32),
+            'CiphertextBlob': blob}
+
+
+def test_data_keys_are_reused(stubbed_kms):
+    k, stubber = stubbed_kms
+    context = {'purpose': 'test'}
+    params = {'KeyId': 'key', 'KeySpec': 'AES_256',
+              'EncryptionContext': context}
+    stubber.add_response('generate_data_key', _data_key(b'blob1'), params)
+    stubber.add_response('generate_data_key', _data_key(b'blob2'), params)
+    blobs = [k.generate_data_key('key', context)[1] for _ in range(3)]
+    # A data key can only encrypt two messages
+    assert blobs == [b'blob1', b'blob1', b'blob2']
+    stubber.assert_no_pending_responses()
+
+
+def test_envelope_roundtrip_without_decrypt_calls(stubbed_kms):
+    pytest.importorskip('cryptography')
+    k, stubber = stubbed_kms
+    stubber.add_response('generate_data_key', _data_key(b'blob'))
+    messages = [k.envelope_encrypt('key', b'secret', {'a': 'b'})
+                for _ in range(2)]
+    assert [k.envelope_decrypt(m, {'a': 'b'}) for m in messages] == \
+        [b'secret', b'secret']
+    stubber.assert_no_pending_responses()
+
+
+def test_decrypted_data_keys_are_cached(stubbed_kms):
+    k, stubber = stubbed_kms
+    stubber.add_response('decrypt', {'Plaintext': b'key'},
+                         {'CiphertextBlob': b'blob',
+                          'EncryptionContext': {}})
+    assert k.decrypt_data_key(b'blob') == b'key'
+    assert k.decrypt_data_key(b'blob') == b'key'
+    stubber.assert_no_pending_responses()
+
+
+def test_encryption_keys_are_evicted():
+    cache = kms.DataKeyCache(capacity=2)
+    for i in range(3):
+        cache.put_encryption_key('key', {'n': str(i)}, b'key', b'blob', 0)
+    assert cache.get_encryption_key('key', {'n': '0'}, 0) is None
+    assert cache.get_encryption_key('key', {'n': '2'}, 0) == (b'key',
+                                                              b'blob')
+
+
+def test_encrypt_many_reports_failures_in_order(stubbed_kms):
+    k, stubber = stubbed_kms
+    for i in range(3):
+        if i == 1:
+            stubber.add_client_error('encrypt', 'KMSInvalidStateException')
+        else:
+            stubber.add_response(
+                'encrypt', {'CiphertextBlob': str(i).encode()},
+                {'KeyId': 'key', 'Plaintext': str(i).encode(),
+                 'EncryptionContext': {}})
+    results = k.encrypt_many('key', [str(i).encode() for i in range(3)],
+                             max_workers=1)
+    assert [r.value for r in results] == [b'0', None, b'2']
+    assert results[1].error.response['Error']['Code'] == \
+        'KMSInvalidStateException'
+
+
+def test_re_encrypt_many(stubbed_kms):
+    k, stubber = stubbed_kms
+    stubber.add_response(
+        're_encrypt', {'CiphertextBlob': b'new'},
+        {'CiphertextBlob': b'old', 'SourceEncryptionContext': {'a': 'b'},
+         'DestinationKeyId': 'key2',
+         'DestinationEncryptionContext': {'a': 'b'}})
+    results = k.re_encrypt_many([b'old'], 'key2', context={'a': 'b'})
+    assert results == [kms.BulkResult(b'new', None)]
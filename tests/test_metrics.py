@@ -0,0 +1,111 @@
+"""Tests the instrumentation of API calls."""
+import logging
+import socket
+
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.stub import Stubber
+
+from boto3facade import metrics
+from boto3facade.kinesis import Kinesis
+
+
+class RawResponse(object):
+    """The raw body of a fake HTTP response"""
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+@pytest.fixture
+def registry():
+    return metrics.Metrics()
+
+
+@pytest.fixture
+def kinesis(random_file_path, registry, monkeypatch):
+    """A Kinesis facade whose HTTP requests get canned responses"""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'key_id')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'secret_key')
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    return Kinesis(config_file=random_file_path, metrics=registry,
+                   single_flight=False)
+
+
+def respond_with(facade, *responses):
+    """Answers the HTTP requests of a facade with (status, body) pairs"""
+    responses = list(responses)
+
+    def send(request, **kwargs):
+        status, body = responses.pop(0)
+        return AWSResponse(request.url, status,
+                           {'content-length': str(len(body))},
+                           RawResponse(body))
+
+    facade.client.meta.events.register('before-send.*.*', send)
+
+
+def test_operation_metrics(kinesis, registry):
+    throttled = b'{"__type": "ThrottlingException", "message": "Slow down"}'
+    listed = b'{"StreamNames": [], "HasMoreStreams": false}'
+    respond_with(kinesis, (400, throttled), (200, listed))
+    kinesis.client.list_streams()
+    stats = registry.snapshot()['operations']['kinesis']['ListStreams']
+    assert (stats['calls'], stats['errors'], stats['attempts'],
+            stats['retries'], stats['throttles']) == (1, 0, 2, 1, 1)
+    assert stats['bytes_received'] == len(throttled) + len(listed)
+    assert stats['bytes_sent'] > 0
+    assert stats['latency']['count'] == 1
+
+
+def test_method_metrics(random_file_path, registry):
+    class Facade(Kinesis):
+        @metrics.timed
+        def list_twice(self):
+            self.client.list_streams()
+            self.client.list_streams()
+
+    facade = Facade(config_file=random_file_path, metrics=registry)
+    with Stubber(facade.client) as stubber:
+        for _ in range(2):
+            stubber.add_response('list_streams', {'StreamNames': [],
+                                                  'HasMoreStreams': False})
+        facade.list_twice()
+    stats = registry.snapshot()['methods']['Facade.list_twice']
+    assert (stats['calls'], stats['errors'], stats['api_calls']) == (1, 0, 2)
+
+
+def test_sinks(registry, tmpdir, caplog):
+    with registry.timer('method'):
+        pass
+    path = str(tmpdir.join('boto3facade.prom'))
+    registry.sinks = [metrics.LoggingSink(),
+                      metrics.PrometheusSink(path)]
+    with caplog.at_level(logging.INFO):
+        registry.report()
+    assert 'method' in caplog.text
+    with open(path) as f:
+        text = f.read()
+    assert 'boto3facade_method_calls_total{method="method"} 1' in text
+    assert 'boto3facade_method_latency_seconds_count{method="method"} 1' \
+        in text
+
+
+def test_statsd_sink_sends_increments(registry):
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    sink = metrics.StatsdSink(*server.getsockname())
+    with registry.timer('method'):
+        pass
+    sink.emit(registry.snapshot())
+    assert 'boto3facade.method.calls:1|c' in \
+        server.recv(4096).decode('utf-8')
+    with registry.timer('method'):
+        pass
+    sink.emit(registry.snapshot())
+    assert 'boto3facade.method.calls:1|c' in \
+        server.recv(4096).decode('utf-8')
+    server.close()
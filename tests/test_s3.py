@@ -5,9 +5,11 @@
 import pytest
 import boto3facade.s3
 from boto3.exceptions import S3UploadFailedError
+from botocore.stub import Stubber
 import tempfile
 import os
 import uuid
+import datetime
 
 
 @pytest.fixture(scope='module')
@@ -49,3 +51,138 @@ def test_cp_invalid_bucket(s3, local_file, s3key):
     s3bucket = str(uuid.uuid4())
     with pytest.raises(S3UploadFailedError):
         s3.cp(local_file, s3bucket, s3key)
+
+
+@pytest.yield_fixture(scope='function')
+def stubbed_s3(random_file_path):
+    """A S3 facade whose client is stubbed"""
+    obj = boto3facade.s3.S3(config_file=random_file_path)
+    with Stubber(obj.client) as stubber:
+        yield obj, stubber
+
+
+def test_delete_many(stubbed_s3):
+    s3, stubber = stubbed_s3
+    keys = ["key{}".format(i) for i in range(1500)]
+    for batch in (keys[:1000], keys[1000:]):
+        stubber.add_response(
+            'delete_objects', {},
+            {'Bucket': 'bucket',
+             'Delete': {'Objects': [{'Key': k} for k in batch],
+                        'Quiet': True}})
+    result = s3.delete_many('bucket', iter(keys), max_workers=1)
+    assert result.deleted == 1500
+    assert result.errors == []
+    stubber.assert_no_pending_responses()
+
+
+def test_delete_many_retries_transient_errors(stubbed_s3, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda _: None)
+    s3, stubber = stubbed_s3
+    slowdown = {'Key': 'b', 'Code': 'SlowDown', 'Message': 'Slow down'}
+    denied = {'Key': 'c', 'Code': 'AccessDenied', 'Message': 'Denied'}
+    stubber.add_response('delete_objects', {'Errors': [slowdown, denied]})
+    stubber.add_response(
+        'delete_objects', {},
+        {'Bucket': 'bucket', 'Delete': {'Objects': [{'Key': 'b'}],
+                                        'Quiet': True}})
+    result = s3.delete_many('bucket', ['a', 'b', 'c'])
+    assert result.deleted == 2
+    assert result.errors == [denied]
+
+
+def test_delete_prefix_all_versions(stubbed_s3):
+    s3, stubber = stubbed_s3
+    stubber.add_response(
+        'list_object_versions',
+        {'Versions': [{'Key': 'p/a', 'VersionId': 'v1'}],
+         'DeleteMarkers': [{'Key': 'p/a', 'VersionId': 'v2'}]},
+        {'Bucket': 'bucket', 'Prefix': 'p/'})
+    stubber.add_response(
+        'delete_objects', {},
+        {'Bucket': 'bucket',
+         'Delete': {'Objects': [{'Key': 'p/a', 'VersionId': 'v1'},
+                                {'Key': 'p/a', 'VersionId': 'v2'}],
+                    'Quiet': True}})
+    result = s3.delete_prefix('bucket', 'p/', all_versions=True)
+    assert result.deleted == 2
+
+
+def _listed(*keys):
+    return [{'Key': k, 'Size': 1, 'ETag': '"etag"',
+             'LastModified': datetime.datetime(2016, 1, 1)} for k in keys]
+
+
+def test_iter_objects_ordered(stubbed_s3, monkeypatch):
+    monkeypatch.setattr(boto3facade.s3, 'SHARDS_PER_WORKER', 2)
+    s3, stubber = stubbed_s3
+    stubber.add_response(
+        'list_objects_v2',
+        {'Contents': _listed('a.txt'),
+         'CommonPrefixes': [{'Prefix': 'a/'}, {'Prefix': 'b/'}]},
+        {'Bucket': 'bucket', 'Prefix': '', 'Delimiter': '/'})
+    stubber.add_response('list_objects_v2', {'Contents': _listed('a/1', 'a/2')},
+                         {'Bucket': 'bucket', 'Prefix': 'a/'})
+    stubber.add_response('list_objects_v2', {'Contents': _listed('b/1')},
+                         {'Bucket': 'bucket', 'Prefix': 'b/'})
+    objects = list(s3.iter_objects('bucket', max_workers=1, ordered=True,
+                                   compact=True))
+    assert [o.key for o in objects] == ['a.txt', 'a/1', 'a/2', 'b/1']
+    assert objects[0] == ('a.txt', 1, '"etag"', 1451606400)
+
+
+def test_iter_objects_resumes_large_levels(stubbed_s3, monkeypatch):
+    monkeypatch.setattr(boto3facade.s3, 'SHARDS_PER_WORKER', 2)
+    monkeypatch.setattr(boto3facade.s3, 'LEVEL_MAX_KEYS', 1)
+    s3, stubber = stubbed_s3
+    stubber.add_response(
+        'list_objects_v2',
+        {'Contents': _listed('a.txt', 'b.txt'),
+         'CommonPrefixes': [{'Prefix': 'a/'}], 'IsTruncated': True,
+         'NextContinuationToken': 'token'},
+        {'Bucket': 'bucket', 'Prefix': '', 'Delimiter': '/'})
+    stubber.add_response('list_objects_v2', {'Contents': _listed('a/1')},
+                         {'Bucket': 'bucket', 'Prefix': 'a/'})
+    # The rest of the level is listed from where its splitting stopped
+    stubber.add_response(
+        'list_objects_v2',
+        {'Contents': _listed('c.txt'), 'CommonPrefixes': [{'Prefix': 'd/'}]},
+        {'Bucket': 'bucket', 'Prefix': '', 'Delimiter': '/',
+         'ContinuationToken': 'token'})
+    stubber.add_response('list_objects_v2', {'Contents': _listed('d/1')},
+                         {'Bucket': 'bucket', 'Prefix': 'd/'})
+    objects = list(s3.iter_objects('bucket', max_workers=1, ordered=True,
+                                   compact=True))
+    assert [o.key for o in objects] == ['a.txt', 'a/1', 'b.txt', 'c.txt',
+                                        'd/1']
+    stubber.assert_no_pending_responses()
+
+
+def test_iter_objects_orders_split_prefixes_before_level_rest(stubbed_s3,
+                                                              monkeypatch):
+    monkeypatch.setattr(boto3facade.s3, 'LEVEL_MAX_KEYS', 2)
+    s3, stubber = stubbed_s3
+    stubber.add_response(
+        'list_objects_v2',
+        {'Contents': _listed('a.txt', 'a0'),
+         'CommonPrefixes': [{'Prefix': 'b/'}], 'IsTruncated': True,
+         'NextContinuationToken': 'token'},
+        {'Bucket': 'bucket', 'Prefix': '', 'Delimiter': '/'})
+    stubber.add_response(
+        'list_objects_v2',
+        {'Contents': _listed('b/1'), 'CommonPrefixes': [{'Prefix': 'b/x/'}]},
+        {'Bucket': 'bucket', 'Prefix': 'b/', 'Delimiter': '/'})
+    stubber.add_response(
+        'list_objects_v2', {'Contents': _listed('b/x/1')},
+        {'Bucket': 'bucket', 'Prefix': 'b/x/', 'Delimiter': '/'})
+    # The rest of the level comes after everything under b/
+    stubber.add_response(
+        'list_objects_v2', {'Contents': _listed('c.txt')},
+        {'Bucket': 'bucket', 'Prefix': '', 'Delimiter': '/',
+         'ContinuationToken': 'token'})
+    objects = list(s3.iter_objects('bucket', max_workers=1, ordered=True,
+                                   compact=True))
+    assert [o.key for o in objects] == ['a.txt', 'a0', 'b/1', 'b/x/1',
+                                        'c.txt']
+    stubber.assert_no_pending_responses()
+
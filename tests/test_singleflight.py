@@ -0,0 +1,132 @@
+"""Tests the coalescing of identical API calls."""
+import threading
+import time
+import types
+
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+from boto3facade import utils
+from boto3facade.aws import new_session
+from boto3facade.kinesis import Kinesis
+from boto3facade.singleflight import SingleFlight
+
+
+@pytest.fixture
+def fake_kinesis(random_file_path):
+    """A Kinesis facade whose API calls are answered by a slow handler"""
+    facade = Kinesis(config_file=random_file_path,
+                     single_flight=SingleFlight(ttl=60))
+    calls = []
+    lock = threading.Lock()
+
+    def respond(model, **kwargs):
+        with lock:
+            calls.append(model.name)
+        time.sleep(0.2)
+        if model.name == 'DescribeStream':
+            error = {'Error': {'Code': 'ResourceNotFoundException',
+                               'Message': 'Not found'}}
+            return AWSResponse('https://kinesis', 400, {}, None), error
+        return AWSResponse('https://kinesis', 200, {}, None), \
+            {'StreamNames': ['stream'], 'HasMoreStreams': False}
+
+    # Runs after the handlers of the facade, in place of the HTTP request
+    facade.client.meta.events.register_last('before-call.*.*', respond)
+    return facade, calls
+
+
+def call_concurrently(func, nb_calls=8):
+    return list(utils.parallel_map(lambda _: func(), range(nb_calls),
+                                   max_workers=nb_calls))
+
+
+def test_concurrent_identical_calls_are_coalesced(fake_kinesis):
+    kinesis, calls = fake_kinesis
+    results = call_concurrently(kinesis.client.list_streams)
+    assert calls == ['ListStreams']
+    assert all(r['StreamNames'] == ['stream'] for r in results)
+    # Every caller gets its own copy of the response
+    assert len({id(r) for r in results}) == len(results)
+    # The response is memoized
+    kinesis.client.list_streams()
+    assert len(calls) == 1
+    kinesis.client.list_streams(Limit=10)
+    assert len(calls) == 2
+
+
+def test_errors_are_shared(fake_kinesis):
+    kinesis, calls = fake_kinesis
+
+    def describe():
+        try:
+            kinesis.client.describe_stream(StreamName='stream')
+        except ClientError as error:
+            return error.response['Error']['Code']
+
+    assert set(call_concurrently(describe)) == {'ResourceNotFoundException'}
+    assert calls == ['DescribeStream']
+    # Errors are not memoized
+    describe()
+    assert len(calls) == 2
+
+
+def test_write_calls_are_not_coalesced(fake_kinesis):
+    kinesis, calls = fake_kinesis
+    call_concurrently(lambda: kinesis.client.create_stream(
+        StreamName='stream', ShardCount=1), nb_calls=3)
+    assert calls == ['CreateStream'] * 3
+
+
+def test_lone_calls_are_not_copied(random_file_path, monkeypatch):
+    kinesis = Kinesis(config_file=random_file_path,
+                      single_flight=SingleFlight())
+    copies = []
+    monkeypatch.setattr('boto3facade.singleflight.copy', types.SimpleNamespace(
+        deepcopy=lambda obj: copies.append(obj) or obj))
+    kinesis.client.meta.events.register_last(
+        'before-call.*.*', lambda **kwargs: (
+            AWSResponse('https://kinesis', 200, {}, None),
+            {'StreamNames': [], 'HasMoreStreams': False}))
+    kinesis.client.list_streams()
+    assert copies == []
+
+
+def test_excluded_calls_are_not_coalesced(fake_kinesis):
+    kinesis, calls = fake_kinesis
+    kinesis.single_flight.exclude = frozenset(['ListStreams'])
+    call_concurrently(kinesis.client.list_streams, nb_calls=3)
+    assert calls == ['ListStreams'] * 3
+
+
+def test_calls_of_other_identities_are_not_shared(random_file_path):
+    single_flight = SingleFlight(ttl=60)
+    names = []
+    for key_id in ('AKIAFIRST', 'AKIASECOND'):
+        session = new_session(aws_access_key_id=key_id,
+                              aws_secret_access_key='secret',
+                              region_name='eu-west-1')
+        kinesis = Kinesis(config_file=random_file_path, session=session,
+                          single_flight=single_flight)
+        kinesis.client.meta.events.register_last(
+            'before-call.*.*', lambda key_id=key_id, **kwargs: (
+                AWSResponse('https://kinesis', 200, {}, None),
+                {'StreamNames': [key_id], 'HasMoreStreams': False}))
+        names += kinesis.client.list_streams()['StreamNames']
+    assert names == ['AKIAFIRST', 'AKIASECOND']
+
+
+def test_flights_of_calls_that_fail_before_sending_are_landed(
+        random_file_path):
+    kinesis = Kinesis(config_file=random_file_path,
+                      single_flight=SingleFlight())
+
+    def fail(**kwargs):
+        raise ValueError("Invalid request")
+
+    # Runs after the handler of the facade, which has started a flight
+    kinesis.client.meta.events.register_last('before-call.*.*', fail)
+    with pytest.raises(ValueError):
+        kinesis.client.list_streams()
+    assert kinesis.single_flight._flights == {}
@@ -0,0 +1,53 @@
+"""Tests the common utilities."""
+import pickle
+
+import pytest
+
+from boto3facade import utils
+
+
+def test_chunked():
+    assert list(utils.chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_parallel_map_ordered():
+    results = utils.parallel_map(lambda x: x * 2, iter(range(100)),
+                                 max_workers=4, ordered=True)
+    assert list(results) == [x * 2 for x in range(100)]
+
+
+def test_merge_streams_ordered():
+    producers = [lambda i=i: range(i * 10, i * 10 + 10) for i in range(5)]
+    merged = utils.merge_streams(producers, max_workers=2, ordered=True,
+                                 maxsize=2)
+    assert list(merged) == list(range(50))
+
+
+def test_merge_streams_takes_producers_lazily():
+    taken = []
+
+    def producers():
+        for i in range(1000):
+            taken.append(i)
+            yield lambda i=i: [i]
+
+    merged = utils.merge_streams(producers(), max_workers=2)
+    assert [next(merged) for _ in range(3)]
+    merged.close()
+    assert len(taken) < 10
+
+
+def test_merge_streams_propagates_errors():
+    def failing():
+        yield 1
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        list(utils.merge_streams([failing, lambda: [2]]))
+
+
+def test_merge_streams_reports_producers_that_cannot_run():
+    # A lambda cannot be pickled to be sent to another process
+    with pytest.raises((pickle.PicklingError, AttributeError)):
+        list(utils.merge_streams([lambda: [1, 2]], max_workers=1,
+                                 processes=True))
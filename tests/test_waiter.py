@@ -0,0 +1,114 @@
+"""Tests the batched waits on the states of resources."""
+import pytest
+from botocore.stub import Stubber
+
+from boto3facade.ec2 import Ec2
+from boto3facade.exceptions import AwsError
+from boto3facade.redshift import Redshift
+from boto3facade.waiter import WAITS, WaiterEngine
+
+
+def _reservations(ids, state):
+    return {'Reservations': [{'Instances': [
+        {'InstanceId': i, 'State': {'Name': state}} for i in ids]}]}
+
+
+@pytest.fixture
+def engine():
+    engine = WaiterEngine(min_interval=0.2, max_interval=0.2)
+    yield engine
+    engine.close()
+
+
+def test_waits_are_batched(random_file_path, engine):
+    ec2 = Ec2(config_file=random_file_path)
+    ids = ['i-{}'.format(i) for i in range(250)]
+    batches = [ids[:100], ids[100:200], ids[200:]]
+    with Stubber(ec2.client) as stubber:
+        for state in ('pending', 'running'):
+            for batch in batches:
+                stubber.add_response('describe_instances',
+                                     _reservations(batch, state),
+                                     {'InstanceIds': batch})
+        futures = [engine.wait(ec2.client, 'instance_running', i)
+                   for i in ids]
+        results = [f.result(timeout=5) for f in futures]
+        stubber.assert_no_pending_responses()
+    assert [r['InstanceId'] for r in results] == ids
+
+
+def test_failure_and_timeout(random_file_path, engine):
+    ec2 = Ec2(config_file=random_file_path)
+    with Stubber(ec2.client) as stubber:
+        stubber.add_response('describe_instances',
+                             _reservations(['i-1'], 'terminated'))
+        stubber.add_client_error('describe_instances',
+                                 'InvalidInstanceID.NotFound')
+        stubber.add_client_error('describe_instances',
+                                 'InvalidInstanceID.NotFound')
+        failed = engine.wait(ec2.client, 'instance_running', 'i-1')
+        with pytest.raises(AwsError):
+            failed.result(timeout=5)
+        # Unknown instances are waited for until the timeout
+        timed_out = engine.wait(ec2.client, 'instance_running', 'i-2',
+                                timeout=0.3)
+        with pytest.raises(AwsError):
+            timed_out.result(timeout=5)
+
+
+def test_wait_for_deleted_cluster(random_file_path, monkeypatch, engine):
+    monkeypatch.setattr('boto3facade.waiter.default_engine', lambda: engine)
+    redshift = Redshift(config_file=random_file_path)
+    with Stubber(redshift.client) as stubber:
+        stubber.add_response('describe_clusters', {'Clusters': [
+            {'ClusterIdentifier': 'a', 'ClusterStatus': 'deleting'}]})
+        stubber.add_response('describe_clusters', {'Clusters': []})
+        future, = redshift.wait_for_clusters(['a'], state='deleted')
+        assert future.result(timeout=5) is None
+
+
+def test_cancelled_waits_are_dropped(random_file_path, engine):
+    ec2 = Ec2(config_file=random_file_path)
+    with Stubber(ec2.client) as stubber:
+        stubber.add_response('describe_instances',
+                             _reservations(['i-1', 'i-2'], 'pending'))
+        stubber.add_response('describe_instances',
+                             _reservations(['i-2'], 'running'),
+                             {'InstanceIds': ['i-2']})
+        cancelled = engine.wait(ec2.client, 'instance_running', 'i-1',
+                                timeout=0.3)
+        waited = engine.wait(ec2.client, 'instance_running', 'i-2')
+        assert cancelled.cancel()
+        # The poll thread survives the timeout of the cancelled wait
+        assert waited.result(timeout=5)['InstanceId'] == 'i-2'
+
+
+def test_unknown_ids_are_left_out_of_batches(random_file_path):
+    engine = WaiterEngine(min_interval=0.2, max_interval=60, batch_size=3)
+    ec2 = Ec2(config_file=random_file_path)
+    with Stubber(ec2.client) as stubber:
+        stubber.add_client_error('describe_instances',
+                                 'InvalidInstanceID.NotFound',
+                                 expected_params={'InstanceIds': [
+                                     'i-1', 'i-bad', 'i-2']})
+        for resource_id in ('i-1', 'i-bad', 'i-2'):
+            if resource_id == 'i-bad':
+                stubber.add_client_error(
+                    'describe_instances', 'InvalidInstanceID.NotFound',
+                    expected_params={'InstanceIds': [resource_id]})
+            else:
+                stubber.add_response(
+                    'describe_instances',
+                    _reservations([resource_id], 'pending'),
+                    {'InstanceIds': [resource_id]})
+        stubber.add_response('describe_instances',
+                             _reservations(['i-1', 'i-2'], 'running'),
+                             {'InstanceIds': ['i-1', 'i-2']})
+        spec = WAITS['instance_running']._replace(expected=1)
+        futures = [engine.wait(ec2.client, spec, i)
+                   for i in ('i-1', 'i-bad', 'i-2')]
+        assert futures[0].result(timeout=5)['InstanceId'] == 'i-1'
+        assert futures[2].result(timeout=5)['InstanceId'] == 'i-2'
+        stubber.assert_no_pending_responses()
+    engine.close()
+    assert futures[1].cancelled()